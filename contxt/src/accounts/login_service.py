@@ -1,5 +1,6 @@
 
 from accounts.utils import get_username_password
+from contxt.utils.helper_functions import get_redis_client
 
 from django.conf import settings
 
@@ -8,22 +9,29 @@ from selectolax.lexbor import LexborHTMLParser
 from requests_toolbelt import MultipartEncoder
 
 import logging
+import json
+import time
 
 logger = logging.getLogger('login')
 
 class SessionManager:
     """
-    Manages a single session for interacting with the Corrlinks website, including handling
+    Manages one session per bot for interacting with the Corrlinks website, including handling
     login and session management.
 
+    Sessions are kept in a per process registry keyed by bot, and their cookie jars are also
+    stored in Redis with a TTL. Any worker on any node can pick up a session that another worker
+    already logged in with, instead of paying for the full login round trips again. A session is
+    only refreshed when a probe shows that Corrlinks has expired it.
+
     Attributes:
-    - _session (requests.Session, optional): A class-level attribute that holds the session instance.
-      It is initialized to `None` and set during the first call to `get_session()`.
+    - _sessions (dict): A class-level registry of sessions keyed by `get_session_key()`.
+      Every entry is a dict holding the `session` and the time it was last `validated_at`.
 
     Methods:
     - get_session(cls, bot_id, is_accept_invite=False):
-        Retrieves the current session for the specified bot. If no session exists, initializes a
-        new session by logging in with the credentials associated with the given `bot_id`.
+        Retrieves a valid session for the specified bot. The session is looked up in the process
+        registry first, then in Redis, and a new login is done only if neither holds a live session.
 
         Args:
             bot_id (str): The bot ID used to fetch the appropriate credentials.
@@ -34,6 +42,9 @@ class SessionManager:
             requests.Session: The session object for interacting with the Corrlinks website.
             If login fails, `None` is returned.
 
+    - invalidate_session(cls, bot_id, is_accept_invite=False):
+        Drops the session of the specified bot from the process registry and from Redis.
+
     - _login_to_corrlinks(cls, bot_id, is_accept_invite=False):
         Handles the login process to the Corrlinks website using credentials associated with the
         specified `bot_id`. This includes sending login credentials, managing headers, handling
@@ -55,13 +66,36 @@ class SessionManager:
             None: If login fails or an error occurs.
     """
 
-    _session = None
+    _sessions = {}
+
+    @classmethod
+    def get_session_key(cls, bot_id, is_accept_invite=False):
+        """
+        Builds the key a session is registered under, both in the process registry and in Redis.
+
+        Args:
+            bot_id (str): The bot ID the session belongs to.
+            is_accept_invite (bool, optional): Sessions for accepting invites use the alternate
+                                               credentials, so they get their own key. Defaults to False.
+
+        Returns:
+            str: The registry key for the session.
+        """
+        if is_accept_invite:
+            return 'corrlinks_session_accept_invite'
+        return f'corrlinks_session_bot_{bot_id}'
 
     @classmethod
     def get_session(cls, bot_id, is_accept_invite=False):
         """
-        Retrieves the current session for the specified bot. If no session exists, initializes a
-        new session by logging in with the credentials associated with the given `bot_id`.
+        Retrieves a valid session for the specified bot.
+
+        The lookup order is:
+        1. The process registry. The session is probed again only if it was last validated more
+           than `CORRLINKS_SESSION_PROBE_INTERVAL` seconds ago.
+        2. The cookie jar stored in Redis by any worker. The restored session is probed before use.
+        3. A new login, done under a Redis lock so that workers needing the same bot do not all
+           log in at once. The new cookie jar is stored in Redis for the other workers.
 
         Args:
             bot_id (str): The bot ID used to fetch the appropriate credentials.
@@ -72,9 +106,202 @@ class SessionManager:
             requests.Session: The session object for interacting with the Corrlinks website.
             If login fails, `None` is returned.
         """
-        if cls._session is None:
-            cls._session = cls._login_to_corrlinks(bot_id, is_accept_invite=is_accept_invite)
-        return cls._session
+        session_key = cls.get_session_key(bot_id, is_accept_invite=is_accept_invite)
+
+        session = cls._get_registered_session(session_key)
+        if session:
+            return session
+
+        redis_client = get_redis_client()
+        session = cls._restore_session(session_key, redis_client)
+        if session:
+            return session
+
+        lock = redis_client.lock(f'{session_key}_login_lock', timeout=120)
+        if not lock.acquire(blocking=True, blocking_timeout=120):
+            logger.error(f'Timed out waiting for another worker to log in for session {session_key}.')
+            return None
+
+        try:
+            # Another worker may have logged in while this one was waiting for the lock.
+            session = cls._restore_session(session_key, redis_client)
+            if session:
+                return session
+
+            session = cls._login_to_corrlinks(bot_id, is_accept_invite=is_accept_invite)
+            if session:
+                cls._register_session(session_key, session)
+                cls._store_session(session_key, session, redis_client)
+        finally:
+            lock.release()
+        return session
+
+    @classmethod
+    def clone_session(cls, session):
+        """
+        Creates a new session logged in with the cookies and headers of an existing one.
+
+        curl_cffi keeps a separate curl handle, and so a separate connection, for every thread that
+        uses a session. Threads that send many requests get their own clone instead, so each of them
+        keeps reusing one connection.
+
+        Args:
+            session (requests.Session): The logged in session to copy.
+
+        Returns:
+            requests.Session: The new session.
+        """
+        clone = cls._build_session()
+        clone.headers.update(session.headers)
+        for cookie in session.cookies.jar:
+            clone.cookies.set(cookie.name, cookie.value, domain=cookie.domain, path=cookie.path, secure=cookie.secure)
+        return clone
+
+    @classmethod
+    def invalidate_session(cls, bot_id, is_accept_invite=False):
+        """
+        Drops the session of the specified bot from the process registry and from Redis,
+        so that the next call to `get_session()` logs in again.
+
+        Args:
+            bot_id (str): The bot ID the session belongs to.
+            is_accept_invite (bool, optional): A flag to indicate if the session is for accepting an invite.
+                                               Defaults to False.
+        """
+        session_key = cls.get_session_key(bot_id, is_accept_invite=is_accept_invite)
+        cls._sessions.pop(session_key, None)
+        get_redis_client().delete(session_key)
+        logger.info(f'Session {session_key} invalidated.')
+
+    @classmethod
+    def _get_registered_session(cls, session_key):
+        """
+        Returns the session from the process registry if it is still valid.
+
+        Args:
+            session_key (str): The registry key of the session.
+
+        Returns:
+            requests.Session: The registered session, or `None` if there is none or it has expired.
+        """
+        entry = cls._sessions.get(session_key)
+        if entry is None:
+            return None
+
+        if time.time() - entry['validated_at'] < settings.CORRLINKS_SESSION_PROBE_INTERVAL:
+            return entry['session']
+
+        if cls._probe_session(entry['session']):
+            entry['validated_at'] = time.time()
+            return entry['session']
+
+        logger.info(f'Session {session_key} has expired. A new login is required.')
+        cls._sessions.pop(session_key, None)
+        return None
+
+    @classmethod
+    def _register_session(cls, session_key, session):
+        """
+        Adds a session to the process registry and marks it as validated now.
+
+        Args:
+            session_key (str): The registry key of the session.
+            session (requests.Session): The session to register.
+        """
+        cls._sessions[session_key] = {'session': session, 'validated_at': time.time()}
+
+    @classmethod
+    def _store_session(cls, session_key, session, redis_client):
+        """
+        Stores the cookie jar of a session in Redis with a TTL of `CORRLINKS_SESSION_TTL` seconds.
+
+        Args:
+            session_key (str): The registry key of the session.
+            session (requests.Session): The session whose cookies are stored.
+            redis_client (Redis): The Redis client to use.
+        """
+        cookies = [
+            {'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path, 'secure': cookie.secure}
+            for cookie in session.cookies.jar
+        ]
+        redis_client.set(session_key, json.dumps(cookies), ex=settings.CORRLINKS_SESSION_TTL)
+
+    @classmethod
+    def _restore_session(cls, session_key, redis_client):
+        """
+        Rebuilds a session from the cookie jar stored in Redis and probes it.
+
+        Args:
+            session_key (str): The registry key of the session.
+            redis_client (Redis): The Redis client to use.
+
+        Returns:
+            requests.Session: The restored session if it is still valid, otherwise `None`.
+        """
+        stored_cookies = redis_client.get(session_key)
+        if not stored_cookies:
+            return None
+
+        try:
+            session = cls._build_session()
+            for cookie in json.loads(stored_cookies):
+                session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'], secure=cookie['secure'])
+        except Exception as e:
+            logger.error(f'An error occurred while restoring session {session_key} from redis: {e}')
+            return None
+
+        if not cls._probe_session(session):
+            logger.info(f'Stored session {session_key} has expired. A new login is required.')
+            redis_client.delete(session_key)
+            return None
+
+        logger.info(f'Session {session_key} restored from redis.')
+        cls._register_session(session_key, session)
+        return session
+
+    @classmethod
+    def _probe_session(cls, session):
+        """
+        Checks whether Corrlinks still accepts a session by requesting the inbox page without
+        following redirects. An expired session is redirected to, or served, the login page.
+
+        Args:
+            session (requests.Session): The session to probe.
+
+        Returns:
+            bool: True if the session is still logged in, False otherwise.
+        """
+        try:
+            response = session.get(settings.INBOX_URL, allow_redirects=False)
+        except Exception as e:
+            logger.error(f'An error occurred while probing session: {e}')
+            return False
+        return response.status_code == 200 and settings.LOGIN_EMAIL_FIELD_ID not in response.text
+
+    @classmethod
+    def _build_session(cls):
+        """
+        Creates a new session configured the way Corrlinks expects it: user agent header,
+        browser impersonation, base url and proxies if enabled.
+
+        Returns:
+            requests.Session: The configured session, without any cookies.
+        """
+        req = requests.Session()
+        req.headers.update({
+            'User-Agent': settings.LOGIN_REQUEST_HEADER
+        })
+
+        # Configure proxies if specified
+        if settings.USE_PROXY and settings.PROXY_URL:
+            logger.info(f'Using proxies {settings.PROXY_URL}')
+            req.proxies = {'http': settings.PROXY_URL, 'https': settings.PROXY_URL}
+        else:
+            logger.info('Continue Without Proxies.')
+
+        req.impersonate = 'chrome'
+        req.base_url = settings.BASE_URL
+        return req
 
     @classmethod
     def _login_to_corrlinks(cls, bot_id, is_accept_invite=False):
@@ -102,20 +329,7 @@ class SessionManager:
             # Retrieve credentials
             user_name, password = get_username_password(bot_id=bot_id, is_accept_invite=is_accept_invite)
             logger.info(f'Credentials = {user_name} ____ {password}')
-            req = requests.Session()
-            req.headers.update({
-                'User-Agent': settings.LOGIN_REQUEST_HEADER
-            })
-
-            # Configure proxies if specified
-            if settings.USE_PROXY and settings.PROXY_URL:
-                logger.info(f'Using proxies {settings.PROXY_URL}')
-                req.proxies = {'http': settings.PROXY_URL, 'https': settings.PROXY_URL}
-            else:
-                logger.info('Continue Without Proxies.')
-
-            req.impersonate = 'chrome'
-            req.base_url = settings.BASE_URL
+            req = cls._build_session()
 
             # Verify IP masking by checking the external IP
             http_ip_response = req.get(settings.HTTPBIN_IP_URL_HTTP)
@@ -1,10 +1,9 @@
 from accounts.models import BotAccount
+from core.utils import get_bot_stage_periodic_tasks
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
-from django_celery_beat.models import PeriodicTask
-
 import json
 import os
 
@@ -80,11 +79,8 @@ class Command(BaseCommand):
             else:
                 self.stdout.write(self.style.SUCCESS(f'Updated bot: {bot_config["name"]}'))
 
-            # Step 4: Update the corresponding Celery Beat task's enabled status
-            periodic_task_for_bot = PeriodicTask.objects.filter(args__contains=[bot.id]).first()
-            if periodic_task_for_bot:
-                periodic_task_for_bot.enabled = bot.is_active
-                periodic_task_for_bot.save()
+            # Step 4: Update the corresponding Celery Beat tasks enabled status
+            get_bot_stage_periodic_tasks(bot.id).update(enabled=bot.is_active)
 
         # Step 5: Identify and deactivate bots that are in the database but not in the configuration file
         missing_bots = existing_bot_names - configured_bot_emails
@@ -92,11 +88,8 @@ class Command(BaseCommand):
             for missing_bot in missing_bots:
                 bot_obj = BotAccount.objects.filter(email_address=missing_bot).first()
                 if bot_obj:
-                    # Disable the corresponding Celery Beat task
-                    periodic_task_for_bot = PeriodicTask.objects.filter(args__contains=[bot_obj.id]).first()
-                    if periodic_task_for_bot:
-                        periodic_task_for_bot.enabled = False
-                        periodic_task_for_bot.save()
+                    # Disable the corresponding Celery Beat tasks
+                    get_bot_stage_periodic_tasks(bot_obj.id).update(enabled=False)
 
                     # Deactivate the bot in the database
                     bot_obj.is_active = False
@@ -1,12 +1,8 @@
-
 from accounts.models import BotAccount
+from core.utils import get_bot_stage_periodic_tasks, setup_bot_stage_periodic_tasks
 
 from django.core.management.base import BaseCommand
-from django.conf import settings
-
-from django_celery_beat.models import PeriodicTask, IntervalSchedule
 
-import json
 
 class Command(BaseCommand):
     help = 'Sync bot accounts to their celery beat tasks from database tables'
@@ -16,10 +12,10 @@ class Command(BaseCommand):
         The main method that gets executed when the command is run.
         This method performs the following steps:
         1. Retrieves all bot accounts from the database.
-        2. Iterates over each bot account to find the corresponding periodic task.
-        3. If a periodic task is found, it updates the task's 'enabled' status
+        2. Iterates over each bot account to find the corresponding stage periodic tasks.
+        3. If periodic tasks are found, it updates their 'enabled' status
            based on the bot's 'is_active' status.
-        4. If no periodic task is found for an active bot, it creates a new periodic task.
+        4. If no periodic tasks are found for an active bot, it creates one per stage.
         5. Saves the changes to the database and outputs the result.
         """
 
@@ -28,33 +24,20 @@ class Command(BaseCommand):
 
         # Step 2: Iterate over each bot account
         for bot in bot_accounts:
-            periodic_task_for_bot = PeriodicTask.objects.filter(args__contains=[bot.id]).first()
+            periodic_tasks_for_bot = get_bot_stage_periodic_tasks(bot.id)
 
-            # Step 3: Check if a corresponding periodic task was found
-            if periodic_task_for_bot:
+            # Step 3: Check if corresponding periodic tasks were found
+            if periodic_tasks_for_bot.exists():
                 # Update the 'enabled' status based on the bot's 'is_active' status
-                if periodic_task_for_bot.enabled != bot.is_active:
-                    periodic_task_for_bot.enabled = bot.is_active
-                    periodic_task_for_bot.save()
+                periodic_tasks_for_bot.exclude(enabled=bot.is_active).update(enabled=bot.is_active)
                 self.stdout.write(
-                    self.style.SUCCESS(f'Bot_{bot.id} periodic task value set to {periodic_task_for_bot.enabled}.')
+                    self.style.SUCCESS(f'Bot_{bot.id} periodic tasks value set to {bot.is_active}.')
                 )
             elif bot.is_active:
-                # Step 4: Create a new periodic task if the bot is active and no task exists
-                schedule, _ = IntervalSchedule.objects.get_or_create(
-                    every=settings.BOT_TASK_INTERVAL_VALUE,  # Set the interval for the task, e.g., every 10 minutes
-                    period=IntervalSchedule.MINUTES
-                )
-
-                PeriodicTask.objects.create(
-                    interval=schedule,
-                    name=f'BOT_{bot.id}_TASKS',
-                    task='core.tasks.entrypoint_for_bots',
-                    args=json.dumps([bot.id]),
-                    enabled=True
-                )
+                # Step 4: Create the stage periodic tasks if the bot is active and no task exists
+                setup_bot_stage_periodic_tasks(bot)
                 self.stdout.write(
-                    self.style.SUCCESS(f'Created a new periodic task for Bot_{bot.id} and enabled it.')
+                    self.style.SUCCESS(f'Created new periodic tasks for Bot_{bot.id} and enabled them.')
                 )
             else:
                 self.stdout.write(
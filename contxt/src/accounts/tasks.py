@@ -30,3 +30,28 @@ def schedule_accept_invites(self):
     """
     if not settings.ENVIRONMENT == 'LOCAL':
         call_command('accept_invites')
+
+@shared_task(base=CustomExceptionHandler, bind=True, queue='scheduling_queue')
+def set_initial_user_passwords_task(self, user_ids=None):
+    """
+    Celery task to set the initial password of users created while pulling emails.
+
+    Password hashing is deliberately slow, so users are created with an unusable password
+    and the initial password is hashed here instead of inside the pull loop.
+
+    Args:
+        self (celery.Task): The Celery task instance.
+        user_ids (list of int): The IDs of the newly created users.
+
+    Returns:
+        None
+
+    Notes:
+        - Users that already have a usable password are left untouched.
+    """
+    from accounts.models import User
+
+    for user in User.objects.filter(id__in=user_ids or []):
+        if not user.has_usable_password():
+            user.set_password(settings.SUPER_SECRET_INITIAL_USER_PASSWORD)
+            user.save(update_fields=['password'])
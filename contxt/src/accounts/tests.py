@@ -1,3 +1,60 @@
-from django.test import TestCase
+from accounts.models import User
+from accounts.utils import get_or_create_users, user_cache
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from unittest.mock import patch
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CELERY_ENABLED=False)
+class GetOrCreateUsersTests(TestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        patcher = patch('accounts.utils.set_initial_user_passwords_task')
+        self.password_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_deleted_user_is_not_served_from_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = get_or_create_users([{'from': 'JOHN SMITH (12345678)'}])[0]
+        User.objects.filter(id=first.id).delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = get_or_create_users([{'from': 'JOHN SMITH (12345678)'}])[0]
+
+        self.assertNotEqual(first.id, second.id)
+        self.assertTrue(User.objects.filter(id=second.id, pic_number='12345678').exists())
+
+    def test_re_keyed_user_is_not_served_from_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = get_or_create_users([{'from': 'JOHN SMITH (12345678)'}])[0]
+        User.objects.filter(id=first.id).update(pic_number='87654321', user_name='JOHNSMITH_87654321')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = get_or_create_users([{'from': 'JOHN SMITH (12345678)'}])[0]
+
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(second.pic_number, '12345678')
+
+    def test_cached_users_are_fetched_with_one_query(self):
+        senders = [{'from': 'JOHN SMITH (12345678)'}, {'from': 'JANE DOE (23456789)'}]
+        with self.captureOnCommitCallbacks(execute=True):
+            get_or_create_users(senders)
+
+        with self.assertNumQueries(1):
+            users = get_or_create_users(senders + [{'from': 'JOHN SMITH (12345678)'}])
+
+        self.assertEqual([user.pic_number for user in users], ['12345678', '23456789', '12345678'])
+
+    def test_broker_outage_does_not_abort_the_pull(self):
+        self.password_task.delay.side_effect = ConnectionError('broker is down')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            users = get_or_create_users([{'from': 'JOHN SMITH (12345678)'}])
+
+        self.assertEqual(users[0].pic_number, '12345678')
+        self.password_task.delay.assert_called_once_with(user_ids=[users[0].id])
@@ -1,9 +1,13 @@
 
 from accounts.models import User, BotAccount
+from accounts.tasks import set_initial_user_passwords_task
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.contrib.auth.hashers import make_password
 
-
+from collections import OrderedDict
 import logging
 
 
@@ -17,13 +21,159 @@ MAP_EMAIL_URL_TO_EMAIL_SEARCH_STRINGS = {
 }
 
 
+class UserLRUCache:
+    """
+    A small in-process least recently used cache of `User` ids keyed by `pic_number`.
+
+    Most pulled emails come from users that were already resolved in an earlier cycle. Only the ids are
+    kept, and they are always checked against the `users` table, so a user that was deleted or re-keyed
+    in another process is never served from a stale entry.
+
+    Attributes:
+        max_size (int): The maximum number of user ids kept in the cache.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._user_ids = OrderedDict()
+
+    def get(self, pic_number):
+        user_id = self._user_ids.get(pic_number)
+        if user_id is not None:
+            self._user_ids.move_to_end(pic_number)
+        return user_id
+
+    def set(self, pic_number, user_id):
+        self._user_ids[pic_number] = user_id
+        self._user_ids.move_to_end(pic_number)
+        while len(self._user_ids) > self.max_size:
+            self._user_ids.popitem(last=False)
+
+    def discard(self, pic_number):
+        self._user_ids.pop(pic_number, None)
+
+    def clear(self):
+        self._user_ids.clear()
+
+
+user_cache = UserLRUCache(max_size=settings.USER_CACHE_SIZE)
+
+
+def parse_sender(user_id_name=None):
+    """
+    Splits the 'from' value of a Corrlinks email, e.g. "JOHN SMITH (12345678)", into the name and `pic_number`.
+
+    Parameters:
+        user_id_name (str, optional): The 'from' value of the email.
+
+    Returns:
+        tuple: The name and `pic_number` of the sender, or (None, None) if the format is invalid.
+    """
+    try:
+        name, user_id = user_id_name.rsplit(' (', 1)
+    except (AttributeError, ValueError):
+        pull_email_logger.error(f"Invalid format for user_name_id: {user_id_name}")
+        return None, None
+
+    return name.strip(), user_id.strip(')')
+
+
+def get_or_create_users(email_data_list=None):
+    """
+    Retrieves or creates the `User` of every email in a batch.
+
+    Senders whose id is in the in-process cache are fetched by primary key, in the same query that fetches
+    the remaining ones by `pic_number`. Cached ids that no longer match a user are dropped and looked up
+    again by `pic_number`, and the senders that still do not exist are created with a single bulk insert.
+    New users are created with an unusable password and their initial password is hashed by
+    `set_initial_user_passwords_task`, so the slow hashing does not run inside the pull loop.
+
+    Parameters:
+        email_data_list (list of dict, optional): Email data dictionaries with a 'from' field that includes user information.
+
+    Returns:
+        list: The `User` of every email, in the same order as `email_data_list`.
+        An entry is `None` if the sender of that email could not be parsed.
+    """
+    if not email_data_list:
+        return []
+
+    senders = [parse_sender(email_data.get('from')) for email_data in email_data_list]
+
+    sender_names = {}
+    cached_user_ids = {}
+    for name, user_id in senders:
+        if user_id is None or user_id in sender_names:
+            continue
+        sender_names[user_id] = name
+        cached_id = user_cache.get(user_id)
+        if cached_id is not None:
+            cached_user_ids[user_id] = cached_id
+
+    users_by_pic_number = {}
+    uncached_pic_numbers = [user_id for user_id in sender_names if user_id not in cached_user_ids]
+    for user in User.objects.filter(Q(pk__in=cached_user_ids.values()) | Q(pic_number__in=uncached_pic_numbers)):
+        if user.pic_number in sender_names:
+            users_by_pic_number[user.pic_number] = user
+
+    # Cached ids of users that were deleted or got a new pic number since they were cached.
+    stale_pic_numbers = [user_id for user_id in cached_user_ids if user_id not in users_by_pic_number]
+    if stale_pic_numbers:
+        for user_id in stale_pic_numbers:
+            user_cache.discard(user_id)
+        for user in User.objects.filter(pic_number__in=stale_pic_numbers):
+            users_by_pic_number[user.pic_number] = user
+
+    new_users = [
+        User(
+            pic_number=user_id,
+            name=name,
+            is_active=False,
+            user_name=f'{name.replace(" ", "")}_{user_id.replace(" ", "")}',
+            password=make_password(None)
+        )
+        for user_id, name in sender_names.items() if user_id not in users_by_pic_number
+    ]
+    if new_users:
+        User.objects.bulk_create(new_users, ignore_conflicts=True)
+        # Re-read the created users to get their ids. This also picks up users created by another worker in the meantime.
+        created_users = list(User.objects.filter(pic_number__in=[user.pic_number for user in new_users]))
+        for user in created_users:
+            users_by_pic_number[user.pic_number] = user
+        queue_initial_user_passwords(user_ids=[user.id for user in created_users])
+
+    for user_id, user in users_by_pic_number.items():
+        user_cache.set(user_id, user.id)
+
+    return [users_by_pic_number.get(user_id) if user_id else None for _, user_id in senders]
+
+
+def queue_initial_user_passwords(user_ids=None):
+    """
+    Queues `set_initial_user_passwords_task` for the given users once the current transaction commits.
+
+    The users are already saved at this point, so failing to reach the broker must not abort the email pull.
+    The error is logged and the users keep their unusable password until the task is queued again.
+
+    Parameters:
+        user_ids (list of int, optional): The IDs of the newly created users.
+    """
+    def queue_task():
+        try:
+            set_initial_user_passwords_task.delay(user_ids=user_ids)
+        except Exception as e:
+            pull_email_logger.error(f"Could not queue the initial password task for users {user_ids}: {e}")
+
+    transaction.on_commit(queue_task)
+
+
 def get_or_create_user(email_data=None):
     """
     Retrieves or creates a `User` based on the provided email data.
 
     This function extracts user information from `email_data` and uses it to either fetch an existing user
     or create a new user. The user is identified by `pic_number` (extracted from `email_data`). If the user is created,
-    an initial password is set.
+    an initial password is set in the background. See `get_or_create_users` to resolve a whole batch at once.
 
     Parameters:
         email_data (dict, optional): Dictionary containing email data with 'from' field that includes user information.
@@ -39,34 +189,7 @@ def get_or_create_user(email_data=None):
         pull_email_logger.error("No email data provided.")
         return None
 
-    password_value = settings.SUPER_SECRET_INITIAL_USER_PASSWORD
-    user_id_name = None
-    user_id = None
-    name = None
-
-    try:
-        user_id_name = email_data.get('from')
-        name, user_id = user_id_name.rsplit(' (', 1)
-        user_id = user_id.strip(')')
-        name = name.strip()
-    except ValueError:
-        pull_email_logger.error(f"Invalid format for user_name_id: {user_id_name}")
-        return None
-
-    user, created = User.objects.get_or_create(
-        pic_number=user_id,
-        defaults={
-            'name': name,
-            'is_active': False,
-            'user_name': f'{name.replace(" ", "")}_{user_id.replace(" ", "")}'
-        }
-    )
-
-    if created:
-        user.set_password(password_value)
-        user.save()
-
-    return user
+    return get_or_create_users([email_data])[0]
 
 def get_email_password_url(bot_id=None, is_accept_invite=False):
     """
@@ -372,6 +372,14 @@ else:
     CELERY_ENABLED = False
 
 BOT_TASK_INTERVAL_VALUE = env('BOT_TASK_INTERVAL_VALUE')
+# Every bot stage has its own schedule. Falls back to BOT_TASK_INTERVAL_VALUE when not set.
+BOT_STAGE_INTERVAL_VALUES = {
+    'accept_invites': env('ACCEPT_INVITES_INTERVAL_VALUE', default=BOT_TASK_INTERVAL_VALUE),
+    'pull_emails': env('PULL_EMAILS_INTERVAL_VALUE', default=BOT_TASK_INTERVAL_VALUE),
+    'push_emails': env('PUSH_EMAILS_INTERVAL_VALUE', default=BOT_TASK_INTERVAL_VALUE),
+    'send_sms': env('SEND_SMS_INTERVAL_VALUE', default=BOT_TASK_INTERVAL_VALUE),
+}
+BOT_STAGE_LOCK_TIMEOUT = int(env('BOT_STAGE_LOCK_TIMEOUT', default=300))
 CELERY_BROKER_URL = env('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = env('CELERY_RESULT_BACKEND')
 
@@ -401,6 +409,14 @@ LOGIN_EMAIL_FIELD_ID = env('LOGIN_EMAIL_FIELD_ID')
 LOGIN_PASSWORD_FIELD_ID = env('LOGIN_PASSWORD_FIELD_ID')
 LOGIN_BUTTON_ID = env('LOGIN_BUTTON_ID')
 SUPER_SECRET_INITIAL_USER_PASSWORD = env('SUPER_SECRET_INITIAL_USER_PASSWORD')
+# Number of user ids (keyed by pic number) kept in memory by every worker while pulling emails.
+USER_CACHE_SIZE = int(env('USER_CACHE_SIZE', default=1024))
+# Corrlinks session cookies are shared between workers through redis for this many seconds.
+CORRLINKS_SESSION_TTL = int(env('CORRLINKS_SESSION_TTL', default=1200))
+# A session that was validated less than this many seconds ago is reused without probing it again.
+CORRLINKS_SESSION_PROBE_INTERVAL = int(env('CORRLINKS_SESSION_PROBE_INTERVAL', default=60))
+# Maximum length of a Corrlinks message body. SMS replies to the same email are joined into replies of at most this length.
+CORRLINKS_REPLY_MAX_LENGTH = int(env('CORRLINKS_REPLY_MAX_LENGTH', default=13000))
 
 USE_PROXY = env('USE_PROXY')
 if USE_PROXY == 'True' or USE_PROXY == 'true':
@@ -432,12 +448,30 @@ DATE_ELEMENT_CSS_SELECTOR = env('DATE_ELEMENT_CSS_SELECTOR')
 PULL_EMAIL_EVENTTARGET = env('PULL_EMAIL_EVENTTARGET')
 ASYNCPOST = env('ASYNCPOST')
 TOPSCRIPTMANAGER = env('TOPSCRIPTMANAGER')
+# Maximum number of email bodies fetched at the same time for a single bot. Every fetch thread opens its own connection.
+PULL_EMAIL_CONCURRENCY = int(env('PULL_EMAIL_CONCURRENCY', default=4))
+# Number of unprocessed emails loaded and marked as processed together by the contact management handler.
+EMAIL_PROCESSING_CHUNK_SIZE = int(env('EMAIL_PROCESSING_CHUNK_SIZE', default=100))
+# Number of failed processing attempts after which an email is parked (marked as processed without a reply).
+EMAIL_PROCESSING_MAX_ATTEMPTS = int(env('EMAIL_PROCESSING_MAX_ATTEMPTS', default=3))
+# Seconds the response templates and bot email addresses stay cached. They are also cleared whenever they are saved.
+RESPONSE_CONTEXT_CACHE_TTL = int(env('RESPONSE_CONTEXT_CACHE_TTL', default=3600))
+# Number of recent text messages listed in contact management responses.
+RECENT_SMS_STATUS_LIMIT = int(env('RECENT_SMS_STATUS_LIMIT', default=20))
+# Number of queued replies the push emails stage sends per batch, and how often a reply is tried before it is marked as failed.
+REPLY_OUTBOX_BATCH_SIZE = int(env('REPLY_OUTBOX_BATCH_SIZE', default=20))
+REPLY_OUTBOX_MAX_ATTEMPTS = int(env('REPLY_OUTBOX_MAX_ATTEMPTS', default=3))
 
 HEADERS_FOR_PUSH_EMAIL_REQUEST = json.loads(env('HEADERS_FOR_PUSH_EMAIL_REQUEST'))
 MAX_EMAIL_REPLY_RETRIES = int(env('MAX_EMAIL_REPLY_RETRIES'))
+# How replies are sent to Corrlinks: 'splash' renders the reply page, 'postback' posts the reply form directly and only falls
+# back to Splash if the form could not be posted, 'shadow' sends with Splash and compares the outcome with a postback dry run.
+CORRLINKS_REPLY_SENDER = env('CORRLINKS_REPLY_SENDER', default='splash')
 STATIC_COOKIES = json.loads(env('STATIC_COOKIES'))
 
 HEADERS_FOR_NEW_EMAIL_REQUEST = json.loads(env('HEADERS_FOR_NEW_EMAIL_REQUEST'))
+# How welcome messages are sent to Corrlinks, with the same choices as CORRLINKS_REPLY_SENDER.
+CORRLINKS_NEW_MESSAGE_SENDER = env('CORRLINKS_NEW_MESSAGE_SENDER', default='splash')
 MAX_NEW_EMAIL_RETRIES = int(env('MAX_NEW_EMAIL_RETRIES'))
 
 USE_ALTERNATE_EMAIL = env('USE_ALTERNATE_EMAIL')
@@ -472,3 +506,68 @@ TEST_KEY = env('TEST_KEY')
 TEST_USER_ID = env('TEST_USER_ID')
 MAX_SMS_RETRIES = int(env('MAX_SMS_RETRIES'))
 SMS_RETRY_DELAY = int(env('SMS_RETRY_DELAY'))
+# Delivery status checks back off exponentially from SMS_RETRY_DELAY seconds, up to SMS_RETRY_MAX_DELAY seconds, with random jitter.
+SMS_RETRY_MAX_DELAY = int(env('SMS_RETRY_MAX_DELAY', default=600))
+# Outbound SMS still in 'Sent' or 'Unknown' after SMS_STATUS_SWEEP_AGE minutes are checked again by the sweeper.
+# The sweeper runs every SMS_STATUS_SWEEP_INTERVAL_VALUE minutes, checks at most SMS_STATUS_SWEEP_BATCH_SIZE messages
+# with SMS_STATUS_SWEEP_CONCURRENCY parallel requests and marks messages older than SMS_STATUS_SWEEP_MAX_AGE hours as failed.
+SMS_STATUS_SWEEP_INTERVAL_VALUE = int(env('SMS_STATUS_SWEEP_INTERVAL_VALUE', default=15))
+SMS_STATUS_SWEEP_AGE = int(env('SMS_STATUS_SWEEP_AGE', default=60))
+SMS_STATUS_SWEEP_MAX_AGE = int(env('SMS_STATUS_SWEEP_MAX_AGE', default=72))
+SMS_STATUS_SWEEP_BATCH_SIZE = int(env('SMS_STATUS_SWEEP_BATCH_SIZE', default=200))
+SMS_STATUS_SWEEP_CONCURRENCY = int(env('SMS_STATUS_SWEEP_CONCURRENCY', default=8))
+# Number of SMS sent in parallel by one send sms run, and the limit of sends per second across all workers and bots.
+# A send waits at most SMS_RATE_LIMIT_MAX_WAIT seconds for a free slot, otherwise the email is left for the next run.
+SMS_DISPATCH_CONCURRENCY = int(env('SMS_DISPATCH_CONCURRENCY', default=4))
+SMS_RATE_LIMIT_PER_SECOND = int(env('SMS_RATE_LIMIT_PER_SECOND', default=5))
+SMS_RATE_LIMIT_MAX_WAIT = int(env('SMS_RATE_LIMIT_MAX_WAIT', default=30))
+SMS_REQUEST_TIMEOUT = int(env('SMS_REQUEST_TIMEOUT', default=30))
+# Seconds the remaining SMS quota is cached before it is read from Textbelt again, and how often the same quota limit notification may be sent.
+SMS_QUOTA_CACHE_TTL = int(env('SMS_QUOTA_CACHE_TTL', default=600))
+SMS_QUOTA_NOTIFICATION_INTERVAL = int(env('SMS_QUOTA_NOTIFICATION_INTERVAL', default=86400))
+# Seconds a send key is kept once the message was accepted by Textbelt, so the same email is never sent twice to the same contact.
+# A key whose send outcome is unknown (e.g. the worker stopped mid request) blocks the send for SMS_SEND_PENDING_TTL seconds.
+SMS_SEND_KEY_TTL = int(env('SMS_SEND_KEY_TTL', default=604800))
+SMS_SEND_PENDING_TTL = int(env('SMS_SEND_PENDING_TTL', default=3600))
+# Outbound SMS queue: messages claimed per batch by a worker, seconds a claimed message is leased (must be longer than
+# SMS_RATE_LIMIT_MAX_WAIT + SMS_REQUEST_TIMEOUT), failed send attempts before a message is given up, number of dispatch
+# tasks queued by a send sms run, and minutes between the periodic dispatches that pick up expired leases.
+SMS_QUEUE_BATCH_SIZE = int(env('SMS_QUEUE_BATCH_SIZE', default=20))
+SMS_QUEUE_LEASE_SECONDS = int(env('SMS_QUEUE_LEASE_SECONDS', default=300))
+SMS_QUEUE_MAX_ATTEMPTS = int(env('SMS_QUEUE_MAX_ATTEMPTS', default=5))
+SMS_QUEUE_DISPATCHERS = int(env('SMS_QUEUE_DISPATCHERS', default=4))
+SMS_QUEUE_DISPATCH_INTERVAL_VALUE = int(env('SMS_QUEUE_DISPATCH_INTERVAL_VALUE', default=1))
+# SMS providers messages are routed between, in order of preference ('textbelt', 'stub'). The latency and error rate of every
+# provider are averaged over its recent sends (SMS_PROVIDER_HEALTH_ALPHA is the weight of the newest send) and forgotten after
+# SMS_PROVIDER_HEALTH_TTL seconds without sends. A provider failing more than SMS_PROVIDER_MAX_ERROR_RATE of its sends is used last.
+SMS_PROVIDERS = env('SMS_PROVIDERS', default='textbelt').split(',')
+SMS_PROVIDER_HEALTH_ALPHA = float(env('SMS_PROVIDER_HEALTH_ALPHA', default=0.2))
+SMS_PROVIDER_HEALTH_TTL = int(env('SMS_PROVIDER_HEALTH_TTL', default=300))
+SMS_PROVIDER_MAX_ERROR_RATE = float(env('SMS_PROVIDER_MAX_ERROR_RATE', default=0.5))
+# The local stub provider sends nothing. It answers after SMS_STUB_LATENCY seconds and fails SMS_STUB_FAILURE_RATE of the sends.
+SMS_STUB_LATENCY = float(env('SMS_STUB_LATENCY', default=0.05))
+SMS_STUB_FAILURE_RATE = float(env('SMS_STUB_FAILURE_RATE', default=0))
+# Textbelt reply webhooks are only validated and put on a Redis stream, and a consumer task stores the replies in batches
+# (only when CELERY_ENABLED). The consumer runs SMS_WEBHOOK_INGEST_DELAY seconds after the first reply of a burst, reads up to
+# SMS_WEBHOOK_BATCH_SIZE replies per query, and takes over replies left unacknowledged for SMS_WEBHOOK_CLAIM_IDLE seconds by a
+# stopped worker. The stream is trimmed to about SMS_WEBHOOK_STREAM_MAX_LENGTH entries, and a periodic consumer runs every
+# SMS_WEBHOOK_INGEST_INTERVAL_VALUE minutes to pick up replies left behind.
+SMS_WEBHOOK_FAST_ACK = env('SMS_WEBHOOK_FAST_ACK', default='True')
+if SMS_WEBHOOK_FAST_ACK == 'True' or SMS_WEBHOOK_FAST_ACK == 'true':
+    SMS_WEBHOOK_FAST_ACK = True
+else:
+    SMS_WEBHOOK_FAST_ACK = False
+SMS_WEBHOOK_INGEST_DELAY = int(env('SMS_WEBHOOK_INGEST_DELAY', default=1))
+SMS_WEBHOOK_BATCH_SIZE = int(env('SMS_WEBHOOK_BATCH_SIZE', default=100))
+SMS_WEBHOOK_CLAIM_IDLE = int(env('SMS_WEBHOOK_CLAIM_IDLE', default=300))
+SMS_WEBHOOK_STREAM_MAX_LENGTH = int(env('SMS_WEBHOOK_STREAM_MAX_LENGTH', default=100000))
+SMS_WEBHOOK_INGEST_INTERVAL_VALUE = int(env('SMS_WEBHOOK_INGEST_INTERVAL_VALUE', default=5))
+# Seconds the email and contact of a sent SMS are cached for the reply webhook (replies with an older token are rejected
+# anyway).
+SMS_OUTBOUND_CONTEXT_TTL = int(env('SMS_OUTBOUND_CONTEXT_TTL', default=172800))
+# Seconds within which the same reply delivered again by Textbelt is ignored. Textbelt sends no per delivery id, so a
+# user who sends the exact same reply twice within this window only gets it forwarded once. Keep it around the few
+# minutes Textbelt keeps retrying a webhook: a longer window drops more genuine repeats, a shorter one lets late retries through.
+SMS_WEBHOOK_REPLAY_WINDOW = int(env('SMS_WEBHOOK_REPLAY_WINDOW', default=300))
+# Seconds a bot waits after the first SMS reply of a burst before forwarding the replies to Corrlinks (only when CELERY_ENABLED).
+SMS_REPLY_PUSH_DELAY = int(env('SMS_REPLY_PUSH_DELAY', default=5))
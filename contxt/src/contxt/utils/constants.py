@@ -6,6 +6,19 @@ SMS MODEL CONSTANTS
 """
 SMS_DIRECTION_CHOICES = [('Inbound', 'Inbound'), ('Outbound', 'Outbound')]
 SMS_STATUS_CHOICES = [('Sent', 'Sent'), ('Delivered', 'Delivered'), ('Failed', 'Failed'), ('Unknown', 'Unknown')]
+# Maps the delivery status reported by Textbelt to the SMS status stored in the database.
+TEXTBELT_STATUS_TO_SMS_STATUS = {'DELIVERED': 'Delivered', 'SENT': 'Sent', 'SENDING': 'Sent', 'FAILED': 'Failed', 'UNKNOWN': 'Unknown'}
+# The statuses an SMS may move to from each status. 'Delivered' and 'Failed' are final.
+SMS_STATUS_TRANSITIONS = {
+    'Sent': ['Sent', 'Delivered', 'Unknown', 'Failed'],
+    'Unknown': ['Unknown', 'Delivered', 'Failed'],
+    'Delivered': [],
+    'Failed': [],
+}
+# Status of a message in the outbound SMS queue. A 'processing' message is leased by a worker until its lease expires.
+OUTBOUND_SMS_STATUS_CHOICES = [('pending', 'Pending'), ('processing', 'Processing'), ('sent', 'Sent'), ('failed', 'Failed'), ('unknown', 'Unknown')]
+# The providers an SMS can be sent with. Every provider reports statuses with the Textbelt names above.
+SMS_PROVIDER_CHOICES = [('textbelt', 'Textbelt'), ('stub', 'Stub')]
 
 """
 LOG MODEL CONSTANTS
@@ -46,6 +59,27 @@ CURRENT_TASKS_RUN_BY_BOTS = {
 }
 
 
+"""
+BOT STAGE TASKS
+"""
+# Every stage a bot runs is its own celery task with its own queue, lock and periodic task.
+# Periodic tasks are named BOT_<bot id>_<STAGE KEY IN UPPER CASE>.
+BOT_STAGE_TASKS = {
+    'accept_invites' : 'core.tasks.accept_invites_for_bot',
+    'pull_emails' : 'core.tasks.pull_emails_for_bot',
+    'push_emails' : 'core.tasks.push_emails_for_bot',
+    'send_sms' : 'core.tasks.send_sms_for_bot',
+}
+
+
+"""
+RESPONSE CONTEXT CACHE KEYS
+"""
+# Shared inputs of contact management responses kept in the default cache. Both are cleared whenever the underlying rows change.
+RESPONSE_MESSAGES_CACHE_KEY = 'response_messages_templates'
+BOT_EMAIL_ADDRESSES_CACHE_KEY = 'bot_email_addresses'
+
+
 """
 CONTACT MANAGEMENT RESPONSE CONSTANTS
 """
@@ -3,6 +3,8 @@ from contxt.utils.constants import CURRENT_TASKS_RUN_BY_BOTS
 
 from django.conf import settings
 
+from redis import Redis
+
 import logging
 import base64
 import os
@@ -87,6 +89,18 @@ def get_lua_script_absolute_path(relative_path):
 
     return file_path
 
+def get_redis_client():
+    """
+    Builds a Redis client for the configured Redis instance.
+
+    Used for the locks and small pieces of shared state that have to be visible to every
+    celery worker, no matter which node it is running on.
+
+    Returns:
+    - Redis: A client connected to `REDIS_HOST`, `REDIS_PORT` and `REDIS_DB`.
+    """
+    return Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+
 def update_logging_config():
     """
     Update the logging configuration based on bot data from a JSON file.
@@ -19,6 +19,8 @@ class CoreConfig(AppConfig):
         It sets up the periodic tasks for bot accounts if Celery is enabled in the settings.
         """
         update_logging_config()
+        # Connects the receivers that keep the cached response context up to date.
+        import core.signals
         if settings.CELERY_ENABLED:  # Check if Celery is enabled in the settings
             # The following code sets up periodic tasks after migrations are applied
 
@@ -29,8 +31,8 @@ class CoreConfig(AppConfig):
                 It creates periodic tasks for each active bot account in the database.
                 """
                 from accounts.models import BotAccount
+                from core.utils import setup_bot_stage_periodic_tasks
                 from django_celery_beat.models import PeriodicTask, IntervalSchedule
-                import json
 
                 # Create or get an existing interval schedule that runs every 10 minutes
                 schedule, _ = IntervalSchedule.objects.get_or_create(
@@ -45,18 +47,10 @@ class CoreConfig(AppConfig):
                 # Iterate over all active bot accounts in the database
                 for bot in BotAccount.objects.filter(is_active=True):
                     """
-                    Create a new periodic task for each active bot.
-                    Each task will run every 10 minutes and will trigger the
-                    'core.tasks.entrypoint_for_bots' task with the bot's ID as an argument.
+                    Create one periodic task per stage (accept invites, pull emails, push emails, send sms) for each active bot.
+                    Every stage runs on its own queue, lock and interval so a slow stage never holds up the others.
                     """
-                    PeriodicTask.objects.update_or_create(
-                        name=f'BOT_{bot.id}_TASKS',  # Name the task uniquely using the bot's ID as the lookup field
-                        defaults={
-                            'interval': schedule,  # Specify the interval or schedule for the task
-                            'task': 'core.tasks.entrypoint_for_bots',  # Specify the task to run
-                            'args': json.dumps([bot.id])  # Pass the bot's ID as a JSON-encoded argument
-                        }
-                    )
+                    setup_bot_stage_periodic_tasks(bot)
                 """
                 This is used to accept invite from info@contxts.net mail. This is seperated from the bot logic.
                 This is defined here to keep the definition for all periodic tasks in one place for simplicity.
@@ -79,3 +73,48 @@ class CoreConfig(AppConfig):
                         'task': 'core.tasks.sync_bot_tasks_with_bots',  # Specify the task to run
                     }
                 )
+                """
+                Outbound SMS can be left in 'Sent' or 'Unknown' if the worker tracking their status stops.
+                Below task checks such messages against Textbelt again so their status always settles.
+                """
+                sweep_schedule, _ = IntervalSchedule.objects.get_or_create(
+                    every=settings.SMS_STATUS_SWEEP_INTERVAL_VALUE,
+                    period=IntervalSchedule.MINUTES
+                )
+                PeriodicTask.objects.update_or_create(
+                    name='SMS_STATUS_SWEEP_TASK',
+                    defaults={
+                        'interval': sweep_schedule,
+                        'task': 'sms_app.tasks.sweep_stale_sms_statuses_task',
+                    }
+                )
+                """
+                Messages in the outbound SMS queue are sent by the dispatch tasks queued by send sms. Below task also
+                sends the messages left behind, e.g. when their worker stopped and their lease expired.
+                """
+                dispatch_schedule, _ = IntervalSchedule.objects.get_or_create(
+                    every=settings.SMS_QUEUE_DISPATCH_INTERVAL_VALUE,
+                    period=IntervalSchedule.MINUTES
+                )
+                PeriodicTask.objects.update_or_create(
+                    name='SMS_QUEUE_DISPATCH_TASK',
+                    defaults={
+                        'interval': dispatch_schedule,
+                        'task': 'sms_app.tasks.dispatch_outbound_sms_task',
+                    }
+                )
+                """
+                SMS replies are stored by the ingest tasks queued by the Textbelt webhook. Below task also stores the
+                replies left behind, e.g. when the worker storing them stopped before acknowledging them.
+                """
+                webhook_ingest_schedule, _ = IntervalSchedule.objects.get_or_create(
+                    every=settings.SMS_WEBHOOK_INGEST_INTERVAL_VALUE,
+                    period=IntervalSchedule.MINUTES
+                )
+                PeriodicTask.objects.update_or_create(
+                    name='SMS_WEBHOOK_INGEST_TASK',
+                    defaults={
+                        'interval': webhook_ingest_schedule,
+                        'task': 'sms_app.tasks.ingest_sms_webhooks_task',
+                    }
+                )
@@ -0,0 +1,88 @@
+from process_emails.command_parser import CommandParser
+from process_emails.email_processing_service import EmailProcessingHandler
+from process_emails.models import Email
+
+from django.core.management.base import BaseCommand
+
+from fuzzywuzzy import process
+import time
+
+# Used when there are no emails in the database yet.
+SAMPLE_SUBJECTS = [
+    'Add Mom 5551234567',
+    'add John Smith john.smith@example.com',
+    'Update Mom 555-987-6543',
+    'Updte Sister jane@example.com',
+    'Remove John Smith',
+    'Contact List',
+    'contact lst',
+    'Contacts please',
+    '5551234567',
+    'Text Mom',
+    'Hello there',
+    'Re: visit on sunday',
+]
+
+
+class Command(BaseCommand):
+    """
+    Compares the throughput of `CommandParser` with the fuzzywuzzy based command detection it replaced.
+
+    Subject lines are read from the `emails` table, or from a small built-in sample if it is empty.
+    Both parsers run over the same subjects and any subject where they detect a different command is listed.
+    """
+
+    help = 'Benchmark the contact management command parser against fuzzywuzzy scoring.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='Maximum number of subject lines read from the database.')
+        parser.add_argument('--iterations', type=int, default=20, help='How many times every subject line is parsed.')
+
+    def handle(self, *args, **kwargs):
+        subjects = list(Email.objects.order_by('-id').values_list('subject', flat=True)[:kwargs['limit']])
+        if not subjects:
+            self.stdout.write('No emails found in the database, using the built-in sample subjects.')
+            subjects = SAMPLE_SUBJECTS
+
+        iterations = kwargs['iterations']
+        command_parser = CommandParser(EmailProcessingHandler.COMMANDS, similarity_threshold=EmailProcessingHandler.SIMILARITY_THRESHOLD)
+
+        fuzzy_seconds, fuzzy_commands = self.run(self.detect_command_with_fuzzywuzzy, subjects, iterations)
+        parser_seconds, parser_commands = self.run(lambda subject: command_parser.parse(subject).command, subjects, iterations)
+
+        parsed_count = len(subjects) * iterations
+        self.stdout.write(f'Subjects: {len(subjects)} x {iterations} iterations')
+        self.stdout.write(f'fuzzywuzzy:    {fuzzy_seconds:.4f}s ({parsed_count / fuzzy_seconds:,.0f} subjects/s)')
+        self.stdout.write(f'CommandParser: {parser_seconds:.4f}s ({parsed_count / parser_seconds:,.0f} subjects/s)')
+        self.stdout.write(f'Speedup:       {fuzzy_seconds / parser_seconds:.1f}x')
+
+        for subject, fuzzy_command, parser_command in zip(subjects, fuzzy_commands, parser_commands):
+            if fuzzy_command != parser_command:
+                self.stdout.write(f'Different command for "{subject}": fuzzywuzzy = {fuzzy_command}, CommandParser = {parser_command}')
+
+    def run(self, detect_command, subjects, iterations):
+        """
+        Runs a command detection function over all subjects `iterations` times.
+
+        Returns:
+            tuple: The elapsed seconds and the commands detected in the last iteration.
+        """
+        commands = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            commands = [detect_command(subject) for subject in subjects]
+        return time.perf_counter() - start, commands
+
+    def detect_command_with_fuzzywuzzy(self, subject):
+        """
+        The command detection used before `CommandParser`, kept here as the baseline.
+        """
+        parts = subject.strip().split()
+        if len(parts) < 2:
+            return None
+
+        for candidate in [' '.join(parts[:2]), parts[0]]:
+            best_match, confidence = process.extractOne(candidate, EmailProcessingHandler.COMMANDS)
+            if confidence >= EmailProcessingHandler.SIMILARITY_THRESHOLD:
+                return best_match
+        return None
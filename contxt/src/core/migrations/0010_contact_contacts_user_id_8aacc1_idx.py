@@ -0,0 +1,21 @@
+# Generated by Django 5.0.8 on 2026-10-18 04:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_alter_responsemessages_options_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                fields=["user", "phone_number"], name="contacts_user_id_8aacc1_idx"
+            ),
+        ),
+    ]
@@ -64,6 +64,7 @@ class Contact(models.Model):
         indexes = [
             models.Index(fields=['user']),
             models.Index(fields=['phone_number']),
+            models.Index(fields=['user', 'phone_number']),
         ]
 
 
@@ -0,0 +1,23 @@
+from accounts.models import BotAccount
+from contxt.utils.constants import RESPONSE_MESSAGES_CACHE_KEY, BOT_EMAIL_ADDRESSES_CACHE_KEY
+from core.models import ResponseMessages
+
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+
+@receiver([post_save, post_delete], sender=ResponseMessages)
+def clear_response_messages_cache(sender, **kwargs):
+    """
+    Clears the cached response message templates whenever a template is saved or deleted.
+    """
+    cache.delete(RESPONSE_MESSAGES_CACHE_KEY)
+
+
+@receiver([post_save, post_delete], sender=BotAccount)
+def clear_bot_email_addresses_cache(sender, **kwargs):
+    """
+    Clears the cached bot email addresses whenever a bot account is saved or deleted.
+    """
+    cache.delete(BOT_EMAIL_ADDRESSES_CACHE_KEY)
@@ -1,14 +1,13 @@
 
 from contxt.celery import CustomExceptionHandler
+from contxt.utils.helper_functions import get_redis_client
 
 from django.core.management import call_command
 from django.conf import settings
 
 from celery import shared_task
-from redis import Redis
 
 import logging
-import time
 import random
 
 
@@ -18,6 +17,8 @@ push_email_logger = logging.getLogger('push_email')
 pull_email_logger = logging.getLogger('pull_email')
 send_sms_logger = logging.getLogger('send_sms')
 
+REPLY_PUSH_SCHEDULED_KEY = 'bot_reply_push_scheduled_{}'
+
 @shared_task(base=CustomExceptionHandler, bind=True, queue='scheduling_queue')
 def schedule_test_command(self):
     if settings.TEST_MODE == True:
@@ -25,52 +26,132 @@ def schedule_test_command(self):
     else:
         pass
 
+def run_bot_stage(bot_id, stage, stage_logger):
+    """
+    Runs a single bot stage (management command) under a lock specific to that bot and stage.
+
+    Every stage has its own lock, so a slow Splash render in one stage or a Textbelt status poll
+    in another never blocks the remaining stages of the same bot.
+
+    Args:
+        bot_id (int): The unique identifier of the bot being processed.
+        stage (str): The name of the management command for the stage (e.g. 'pull_emails').
+        stage_logger (logging.Logger): The logger to write progress information to.
+
+    Returns:
+        bool: True if the stage was executed, False if it is already running for this bot.
+    """
+    redis_client = get_redis_client()
+
+    # Create a lock specific to the bot_id and stage to ensure no two runs of the same stage for the same bot overlap
+    lock = redis_client.lock(f"bot_lock_{bot_id}_{stage}", timeout=settings.BOT_STAGE_LOCK_TIMEOUT)
+
+    # Attempt to acquire the lock. If it fails, it means this stage is already running for this bot
+    if not lock.acquire(blocking=False):
+        logger.warning(f'Stage {stage} for bot {bot_id} is already being processed.')
+        return False
+
+    try:
+        stage_logger.debug(f'Starting {stage} processing ......')
+        stage_logger.debug(f'Current bot id is {bot_id}')
+        call_command(stage, bot_id=bot_id)
+    finally:
+        # Release the lock once the stage has been completed
+        lock.release()
+    return True
+
+@shared_task(base=CustomExceptionHandler, bind=True, queue='accept_invites_queue')
+def accept_invites_for_bot(self, bot_id):
+    """
+    Accepts pending Corrlinks invites for a single bot.
+
+    Args:
+        self: Reference to the task instance.
+        bot_id (int): The unique identifier of the bot being processed.
+    """
+    run_bot_stage(bot_id, 'accept_invites', accept_invite_logger)
+
+@shared_task(base=CustomExceptionHandler, bind=True, queue='pull_emails_queue')
+def pull_emails_for_bot(self, bot_id):
+    """
+    Pulls new emails from the Corrlinks inbox for a single bot.
+
+    `send_sms` works on the emails stored by this stage, so it is queued as soon as
+    the pull finishes instead of waiting for its own schedule.
+
+    Args:
+        self: Reference to the task instance.
+        bot_id (int): The unique identifier of the bot being processed.
+    """
+    if run_bot_stage(bot_id, 'pull_emails', pull_email_logger):
+        send_sms_for_bot.delay(bot_id)
+
+@shared_task(base=CustomExceptionHandler, bind=True, queue='push_emails_queue')
+def push_emails_for_bot(self, bot_id, triggered_by_reply=False):
+    """
+    Forwards received SMS replies to Corrlinks for a single bot.
+
+    Args:
+        self: Reference to the task instance.
+        bot_id (int): The unique identifier of the bot being processed.
+        triggered_by_reply (bool): Whether the push was queued by `schedule_reply_push` instead of the schedule.
+    """
+    if triggered_by_reply:
+        # Replies arriving from here on may be missed by this push, so they queue the next one
+        get_redis_client().delete(REPLY_PUSH_SCHEDULED_KEY.format(bot_id))
+
+    if not run_bot_stage(bot_id, 'push_emails', push_email_logger) and triggered_by_reply:
+        # The running push may have read the replies before the new ones were stored
+        schedule_reply_push(bot_id)
+
+def schedule_reply_push(bot_id):
+    """
+    Queues a push for a bot that just received SMS replies, so they reach Corrlinks within seconds
+    instead of waiting for the next scheduled push.
+
+    Only the first reply of a burst queues the push. It runs `SMS_REPLY_PUSH_DELAY` seconds later and
+    forwards every reply stored until then with one Corrlinks session.
+
+    Args:
+        bot_id (int): The unique identifier of the bot that received the replies.
+
+    Returns:
+        bool: True if a push was queued, False if one is already waiting.
+    """
+    scheduled = get_redis_client().set(
+        REPLY_PUSH_SCHEDULED_KEY.format(bot_id), 1, nx=True, ex=settings.SMS_REPLY_PUSH_DELAY + 60
+    )
+    if scheduled:
+        push_emails_for_bot.apply_async(args=[bot_id], kwargs={'triggered_by_reply': True}, countdown=settings.SMS_REPLY_PUSH_DELAY)
+    return bool(scheduled)
+
+@shared_task(base=CustomExceptionHandler, bind=True, queue='send_sms_queue')
+def send_sms_for_bot(self, bot_id):
+    """
+    Sends SMS for the unprocessed emails of a single bot.
+
+    Args:
+        self: Reference to the task instance.
+        bot_id (int): The unique identifier of the bot being processed.
+    """
+    run_bot_stage(bot_id, 'send_sms', send_sms_logger)
+
 @shared_task(base=CustomExceptionHandler, bind=True, queue='scheduling_queue')
 def entrypoint_for_bots(self, bot_id):
     """
-    Entry point task for processing bot operations. This task acquires a lock to ensure that only
-    one instance of a bot's task is running at any given time. It also introduces a random delay
-    to stagger the execution of tasks for different bots, reducing the likelihood of concurrent
-    execution issues.
+    Entry point task for processing all bot operations at once. Kept for periodic tasks created
+    before the stages were split. It only queues every stage task for the bot and returns, each
+    stage then runs independently on its own queue and lock.
+
+    A random countdown staggers the stages of different bots, reducing the likelihood of them
+    all hitting Corrlinks at the same moment, without keeping a worker asleep.
 
     Args:
         self: Reference to the task instance.
         bot_id (int): The unique identifier of the bot being processed.
     """
-
-    redis_client = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
-
-    # Create a lock specific to the bot_id to ensure no two tasks for the same bot run simultaneously
-    lock = redis_client.lock(f"bot_lock_{bot_id}", timeout=300)
-
-     # Attempt to acquire the lock. If it fails, it means another task is already running for this bot
-    if lock.acquire(blocking=False):
-        try:
-            # Introduce a random delay between 5 and 10 seconds to stagger the start of bot tasks.
-            # This helps in avoiding concurrent execution and reduces potential resource contention.
-            delay = random.uniform(5, 10) # Adding random delay between bot tasks. Maybe can be improved?
-            time.sleep(delay)
-
-            accept_invite_logger.debug(f'Starting invites processing ......')
-            accept_invite_logger.debug(f'Current bot id is {bot_id}')
-            call_command('accept_invites', bot_id=bot_id)
-
-            logger.debug(f'Starting pull emails processing ......')
-            pull_email_logger.debug(f'Current bot id is {bot_id}')
-            call_command('pull_emails', bot_id=bot_id)
-
-            push_email_logger.debug(f'Starting push emails processing ......')
-            push_email_logger.debug(f'Current bot id is {bot_id}')
-            call_command('push_emails', bot_id=bot_id)
-
-            send_sms_logger.debug(f'Starting send sms processing ......')
-            send_sms_logger.debug(f'Current bot id is {bot_id}')
-            call_command('send_sms', bot_id=bot_id)
-        finally:
-            # Release the lock once all tasks for the bot have been completed
-            lock.release()
-    else:
-        logger.warning(f'Bot {bot_id} is already being processed.')
+    for stage_task in [accept_invites_for_bot, pull_emails_for_bot, push_emails_for_bot]:
+        stage_task.apply_async(args=[bot_id], countdown=random.uniform(5, 10))
 
 
 @shared_task(base=CustomExceptionHandler, bind=True, queue='scheduling_queue')
@@ -0,0 +1,148 @@
+from accounts.models import BotAccount
+from contxt.utils.constants import BOT_STAGE_TASKS, RESPONSE_MESSAGES_CACHE_KEY, BOT_EMAIL_ADDRESSES_CACHE_KEY
+from core.models import Contact, ResponseMessages
+
+from django.conf import settings
+from django.core.cache import cache
+
+from django_celery_beat.models import PeriodicTask, IntervalSchedule
+
+import json
+
+
+def get_bot_stage_task_name(bot_id, stage):
+    """
+    Builds the name of the periodic task that runs a single stage for a bot.
+
+    Args:
+        bot_id (int): The ID of the bot.
+        stage (str): The stage key from `BOT_STAGE_TASKS` (e.g. 'pull_emails').
+
+    Returns:
+        str: The periodic task name, e.g. 'BOT_1_PULL_EMAILS'.
+    """
+    return f'BOT_{bot_id}_{stage.upper()}'
+
+
+def get_bot_stage_periodic_tasks(bot_id):
+    """
+    Retrieves every stage periodic task that belongs to a bot.
+
+    Args:
+        bot_id (int): The ID of the bot.
+
+    Returns:
+        QuerySet: The `PeriodicTask` rows for all stages of the bot.
+    """
+    task_names = [get_bot_stage_task_name(bot_id, stage) for stage in BOT_STAGE_TASKS]
+    return PeriodicTask.objects.filter(name__in=task_names)
+
+
+def setup_bot_stage_periodic_tasks(bot, enabled=True):
+    """
+    Creates or updates one periodic task per stage for a bot.
+
+    Each stage gets its own interval schedule from `BOT_STAGE_INTERVAL_VALUES`, so a slow stage
+    never delays the others and every stage can be tuned on its own.
+
+    Args:
+        bot (BotAccount): The bot to create the periodic tasks for.
+        enabled (bool, optional): Whether the periodic tasks should be enabled. Defaults to True.
+
+    Returns:
+        list: The created or updated `PeriodicTask` instances.
+    """
+    periodic_tasks = []
+    for stage, task in BOT_STAGE_TASKS.items():
+        schedule, _ = IntervalSchedule.objects.get_or_create(
+            every=settings.BOT_STAGE_INTERVAL_VALUES[stage],
+            period=IntervalSchedule.MINUTES
+        )
+        periodic_task, _ = PeriodicTask.objects.update_or_create(
+            name=get_bot_stage_task_name(bot.id, stage),
+            defaults={
+                'interval': schedule,
+                'task': task,
+                'args': json.dumps([bot.id]),
+                'enabled': enabled
+            }
+        )
+        periodic_tasks.append(periodic_task)
+    return periodic_tasks
+
+
+def get_response_message_templates():
+    """
+    Retrieves every response message template keyed by `message_key`.
+
+    The templates are loaded with a single query and kept in the default cache, so processing a
+    batch of emails does not query the `response_messages` table once per email. The cache entry
+    is cleared by `core.signals` whenever a template is saved or deleted.
+
+    Returns:
+        dict: Mapping of `message_key` to `response_content`.
+    """
+    templates = cache.get(RESPONSE_MESSAGES_CACHE_KEY)
+    if templates is None:
+        templates = dict(ResponseMessages.objects.values_list('message_key', 'response_content'))
+        cache.set(RESPONSE_MESSAGES_CACHE_KEY, templates, timeout=settings.RESPONSE_CONTEXT_CACHE_TTL)
+    return templates
+
+
+def get_bot_email_addresses():
+    """
+    Retrieves the email addresses of all bot accounts, as listed in contact management responses.
+
+    The addresses are kept in the default cache and the entry is cleared by `core.signals`
+    whenever a bot account is saved or deleted.
+
+    Returns:
+        list: The email addresses of all bot accounts.
+    """
+    bot_email_addresses = cache.get(BOT_EMAIL_ADDRESSES_CACHE_KEY)
+    if bot_email_addresses is None:
+        bot_email_addresses = list(BotAccount.objects.order_by('id').values_list('email_address', flat=True))
+        cache.set(BOT_EMAIL_ADDRESSES_CACHE_KEY, bot_email_addresses, timeout=settings.RESPONSE_CONTEXT_CACHE_TTL)
+    return bot_email_addresses
+
+
+def get_or_create_contacts(user_numbers):
+    """
+    Resolves the contacts for a batch of (user, phone number) pairs, creating the missing ones.
+
+    All existing contacts are read with one query backed by the (user, phone_number) index, and the
+    missing ones are created with one bulk insert. New contacts get a placeholder name and no email
+    address, so they never conflict on the unique email column.
+
+    Args:
+        user_numbers (list of tuple): The (User, phone_number) pairs.
+
+    Returns:
+        dict: The `Contact` of every pair, keyed by (user_id, phone_number). Where a user has several
+        contacts with the same number, the oldest one is used.
+    """
+    if not user_numbers:
+        return {}
+
+    users_by_id = {user.id: user for user, _ in user_numbers}
+    wanted_keys = {(user.id, phone_number) for user, phone_number in user_numbers}
+
+    contacts = {}
+    existing_contacts = Contact.objects.filter(
+        user_id__in=users_by_id.keys(),
+        phone_number__in={phone_number for _, phone_number in user_numbers}
+    ).order_by('id')
+    for contact in existing_contacts:
+        key = (contact.user_id, contact.phone_number)
+        if key in wanted_keys:
+            contacts.setdefault(key, contact)
+
+    missing_keys = sorted(wanted_keys - contacts.keys())
+    new_contacts = Contact.objects.bulk_create([
+        Contact(user_id=user_id, contact_name=f'{users_by_id[user_id].user_name}_{phone_number}', phone_number=phone_number)
+        for user_id, phone_number in missing_keys
+    ])
+    for key, contact in zip(missing_keys, new_contacts):
+        contacts[key] = contact
+
+    return contacts
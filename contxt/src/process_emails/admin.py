@@ -1,5 +1,5 @@
 
-from process_emails.models import Email
+from process_emails.models import Email, ReplyOutbox
 
 from django.contrib import admin
 
@@ -85,3 +85,16 @@ class EmailAdmin(admin.ModelAdmin):
         return self.readonly_fields
 
 admin.site.register(Email, EmailAdmin)
+
+class ReplyOutboxAdmin(admin.ModelAdmin):
+    """
+    Admin interface for reviewing the replies queued for the push emails stage.
+    """
+
+    list_display = ('message_id', 'bot', 'status', 'attempts', 'sent_at', 'created_at')
+    list_filter = ('status', 'bot')
+    search_fields = ('message_id', 'message_content')
+    readonly_fields = ('sent_at', 'created_at', 'updated_at')
+    ordering = ('-created_at',)
+
+admin.site.register(ReplyOutbox, ReplyOutboxAdmin)
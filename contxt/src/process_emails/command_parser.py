@@ -0,0 +1,186 @@
+from dataclasses import dataclass
+import re
+
+
+@dataclass(frozen=True, slots=True)
+class ParsedCommand:
+    """
+    The result of parsing the subject line of a contact management email.
+
+    Attributes:
+        command (str): The detected command ('Add', 'Update', 'Remove' or 'Contact List'), or None.
+        contact_name (str): The name of the contact (if applicable).
+        contact_detail (str): The email address or phone number of the contact (if applicable).
+        detail_type (str): Either 'email' or 'phone_number' (if applicable).
+    """
+    command: str = None
+    contact_name: str = None
+    contact_detail: str = None
+    detail_type: str = None
+
+
+class CommandParser:
+    """
+    Parses contact management commands from email subject lines in a single pass.
+
+    The command is looked up in a case-folded dictionary first, which covers correctly spelled commands.
+    Only when that fails are the subject words compared to the commands with a bounded edit distance,
+    so small typos such as "Updte", "Ad" or "Contact Lst" are still accepted, as are two word commands
+    with their words swapped such as "List Contacts". Unlike the previous fuzzy matching, a subject that
+    merely starts with a command ("Addition to my account") or is a single word of a two word command
+    ("List") is not accepted.
+
+    Attributes:
+        commands (list): The supported commands.
+        similarity_threshold (int): The minimum similarity (0-100) for a misspelled command to be accepted.
+    """
+
+    EMAIL_REGEX = re.compile(r'[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+')
+    PHONE_REGEX = re.compile(r'(?:\+?\d{1,4}[-.\s]?)?(?:\(?\d{1,5}\)?[-.\s]?)?\d{1,4}[-.\s]?\d{1,4}[-.\s]?\d{1,9}')
+
+    def __init__(self, commands, similarity_threshold=90):
+        self.commands = list(commands)
+        self.similarity_threshold = similarity_threshold
+        self._commands_by_key = {command.casefold(): command for command in self.commands}
+        self._commands_by_sorted_key = {self.sort_words(key): command for key, command in self._commands_by_key.items()}
+
+    def parse(self, subject):
+        """
+        Detects the command in a subject line and extracts the contact name and detail.
+
+        Args:
+            subject (str): The subject of the email.
+
+        Returns:
+            ParsedCommand: The parsed command. `command` is None if no command was found.
+        """
+        parts = subject.split()
+        if len(parts) < 2:
+            return ParsedCommand()
+
+        command = self.match_command(parts)
+        if command is None:
+            return ParsedCommand()
+
+        if command == "Contact List":
+            return ParsedCommand(command=command)
+
+        # Remove only contains the name of the contact
+        if command == "Remove":
+            return ParsedCommand(command=command, contact_name=' '.join(parts[1:]))
+
+        # Add and Update end with the contact detail, everything in between is the name
+        contact_detail = parts[-1]
+        if self.EMAIL_REGEX.match(contact_detail):
+            detail_type = 'email'
+        elif self.PHONE_REGEX.match(contact_detail):
+            detail_type = 'phone_number'
+        else:
+            detail_type = 'email'
+
+        if len(parts) < 3:
+            return ParsedCommand(command=command, detail_type=detail_type)
+
+        return ParsedCommand(
+            command=command,
+            contact_name=' '.join(parts[1:-1]),
+            contact_detail=contact_detail,
+            detail_type=detail_type
+        )
+
+    def match_command(self, parts):
+        """
+        Finds the command at the start of a subject line.
+
+        The first two words are tried before the first word, so two word commands such as
+        "Contact List" take precedence. Misspelled candidates are compared as written first and
+        then with their words sorted, so the word order of a two word command does not matter.
+
+        Args:
+            parts (list): The words of the subject line.
+
+        Returns:
+            str: The matched command, or None if the subject does not start with a command.
+        """
+        candidates = [f'{parts[0]} {parts[1]}'.casefold(), parts[0].casefold()]
+
+        for candidate in candidates:
+            command = self._commands_by_key.get(candidate)
+            if command:
+                return command
+
+        for candidate in candidates:
+            for key, command in self._commands_by_key.items():
+                if self.is_similar(candidate, key):
+                    return command
+            sorted_candidate = self.sort_words(candidate)
+            for sorted_key, command in self._commands_by_sorted_key.items():
+                if sorted_candidate != candidate and self.is_similar(sorted_candidate, sorted_key):
+                    return command
+
+        return None
+
+    @staticmethod
+    def sort_words(text):
+        """
+        Returns `text` with its words in alphabetical order, e.g. "list contacts" becomes "contacts list".
+        """
+        return ' '.join(sorted(text.split()))
+
+    def is_similar(self, first, second):
+        """
+        Checks whether two strings are at least `similarity_threshold` percent similar.
+
+        The similarity is the same ratio used by python-Levenshtein: the share of characters that
+        do not need to be inserted or deleted to turn one string into the other. The allowed number
+        of edits is derived from the threshold, and the comparison stops as soon as it is exceeded.
+        At least one edit is always allowed, otherwise a threshold of 90 would reject every typo in
+        a three letter command such as "Add".
+
+        Args:
+            first (str): The first string.
+            second (str): The second string.
+
+        Returns:
+            bool: True if the strings are similar enough, False otherwise.
+        """
+        total_length = len(first) + len(second)
+        max_edits = max(1, int(total_length * (100 - self.similarity_threshold) / 100))
+        if abs(len(first) - len(second)) > max_edits:
+            return False
+        return self.bounded_indel_distance(first, second, max_edits) <= max_edits
+
+    @staticmethod
+    def bounded_indel_distance(first, second, max_edits):
+        """
+        Computes the number of insertions and deletions needed to turn `first` into `second`.
+
+        Only the diagonal band of width `max_edits` is evaluated, and the computation stops early
+        once every value in a row exceeds `max_edits`.
+
+        Args:
+            first (str): The first string.
+            second (str): The second string.
+            max_edits (int): The largest distance that is of interest.
+
+        Returns:
+            int: The distance, or `max_edits + 1` if it is larger than `max_edits`.
+        """
+        too_far = max_edits + 1
+        previous_row = list(range(len(second) + 1))
+
+        for i, first_char in enumerate(first, start=1):
+            current_row = [too_far] * (len(second) + 1)
+            current_row[0] = i
+            start = max(1, i - max_edits)
+            end = min(len(second), i + max_edits)
+            for j in range(start, end + 1):
+                if first_char == second[j - 1]:
+                    current_row[j] = previous_row[j - 1]
+                else:
+                    current_row[j] = min(previous_row[j], current_row[j - 1]) + 1
+            if min(current_row) > max_edits:
+                return too_far
+            previous_row = current_row
+
+        return min(previous_row[-1], too_far)
@@ -1,12 +1,18 @@
-from core.models import Contact, ResponseMessages
-from process_emails.models import Email
-from accounts.models import BotAccount
+from core.models import Contact
+from core.tasks import push_emails_for_bot
+from core.utils import get_response_message_templates, get_bot_email_addresses
+from process_emails.command_parser import CommandParser
+from process_emails.models import Email, ReplyOutbox
 from sms_app.models import SMS
 from contxt.utils.constants import CURRENT_TASKS_RUN_BY_BOTS
 
-from django.core.management import call_command
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 
-from fuzzywuzzy import process
+from collections import defaultdict
 import re
 import logging
 
@@ -42,74 +48,228 @@ class EmailProcessingHandler:
         """
         self.bot_id = bot_id
         self.module_name = CURRENT_TASKS_RUN_BY_BOTS['contact_management']
+        self.command_parser = CommandParser(self.COMMANDS, similarity_threshold=self.SIMILARITY_THRESHOLD)
+        # Per user response context of the current chunk, filled by `_prefetch_response_context`.
+        self._contacts_by_user = {}
+        self._recent_sms_status_by_user = {}
+        # Replies of the current chunk, written to the outbox together with the processed flags.
+        self._pending_replies = []
+        self.queued_replies_count = 0
         self.process_emails()
 
     def process_emails(self):
         """
-        Retrieves all unprocessed emails associated with the bot and processes each one.
+        Retrieves all unprocessed emails associated with the bot and processes them in chunks.
         It skips emails that contain only phone numbers or the word 'text' in the subject.
 
         The method fetches email data, detects commands and relevant information from the email
         subject, and processes the commands to add, update, or remove contacts.
+
+        Every chunk loads its emails together with their bot and user in a single query, and the
+        processed emails of the chunk are marked with a single update, so the number of queries per
+        email does not grow with the size of the backlog.
+
+        Responses are not sent from here. They are queued in the `ReplyOutbox` and the push emails
+        stage of the bot is triggered once all chunks are done.
+
+        An email that raises is logged and left unprocessed for the next run, and the remaining emails
+        are still handled. See `_record_failed_emails` for how often it is retried.
         """
         logger = logging.getLogger(f'bot_{self.bot_id}_{self.module_name}')
-        emails = self._get_emails_for_processing()
+        last_email_id = 0
+
+        while True:
+            emails = list(self._get_emails_for_processing(after_id=last_email_id)[:settings.EMAIL_PROCESSING_CHUNK_SIZE])
+            if not emails:
+                break
+            last_email_id = emails[-1].id
+            self._prefetch_response_context(emails)
+
+            processed_email_ids = []
+            failed_email_ids = []
+            for email in emails:
+                if 'text' in email.subject.lower():
+                    logger.info(f"Skipping email with subject '{email.subject}' because it contains 'text' which is part of a valid command. This will be used in send_sms command.")
+                    continue
+
+                # Skip emails where the subject is just a phone number
+                if re.fullmatch(self.PHONE_REGEX, email.subject.strip()):
+                    logger.info(f"Skipping email with subject '{email.subject}' because it is just a phone number. This will be used in send_sms command.")
+                    continue
+
+                email_data = {
+                    'bot': email.bot,
+                    'user_id': email.user,
+                    'subject': email.subject,
+                    'body': email.body,
+                    'message_id': email.message_id,
+                    'email_id': email.id
+                }
+                pending_replies_count = len(self._pending_replies)
+                try:
+                    self._process_email(email_data, logger=logger)
+                except Exception as e:
+                    # A failing email must not hold back the rest of the backlog, it is retried on the next run.
+                    logger.exception(f"Error processing email with id = {email.id} for bot = {self.bot_id}: {e}")
+                    del self._pending_replies[pending_replies_count:]
+                    failed_email_ids.append(email.id)
+                    continue
+                processed_email_ids.append(email.id)
+
+            with transaction.atomic():
+                self._queue_pending_replies(logger=logger)
+                self._mark_emails_as_processed(processed_email_ids, logger=logger)
+                self._record_failed_emails(failed_email_ids, logger=logger)
+
+        if self.queued_replies_count and settings.CELERY_ENABLED:
+            push_emails_for_bot.delay(self.bot_id)
+
+    def _get_emails_for_processing(self, after_id=0):
+        """
+        Fetches the unprocessed emails for the bot, oldest first.
+
+        Args:
+            after_id (int, optional): Only emails with an id greater than this are returned. Used to
+            walk through the emails chunk by chunk. Default is 0.
+
+        Returns:
+            QuerySet: A queryset containing all emails that are not yet processed and are
+            associated with the bot, with the bot and user loaded in the same query.
+        """
+        return Email.objects.filter(
+            is_processed=False, bot__id=self.bot_id, id__gt=after_id
+        ).select_related('bot', 'user').order_by('id')
+
+    def _prefetch_response_context(self, emails):
+        """
+        Loads the contact lists and recent text message statuses of every user in a chunk of emails.
+
+        Both are loaded with one query each for the whole chunk instead of once per email. Contact
+        lists changed by a command are reloaded for that user only (see `_get_user_contacts`).
+
+        Args:
+            emails (list of Email): The emails of the current chunk.
+        """
+        user_ids = {email.user_id for email in emails}
 
-        for email in emails:
-            if 'text' in email.subject.lower():
-                logger.info(f"Skipping email with subject '{email.subject}' because it contains 'text' which is part of a valid command. This will be used in send_sms command.")
-                continue
+        self._contacts_by_user = {user_id: [] for user_id in user_ids}
+        for contact in Contact.objects.filter(user_id__in=user_ids).order_by('id'):
+            self._contacts_by_user[contact.user_id].append(contact)
 
-            # Skip emails where the subject is just a phone number
-            if re.fullmatch(self.PHONE_REGEX, email.subject.strip()):
-                logger.info(f"Skipping email with subject '{email.subject}' because it is just a phone number. This will be used in send_sms command.")
-                continue
+        recent_sms_by_user = defaultdict(list)
+        recent_sms = SMS.objects.filter(contact__user_id__in=user_ids).select_related('contact').annotate(
+            row_number=Window(RowNumber(), partition_by=F('contact__user_id'), order_by=F('created_at').desc())
+        ).filter(row_number__lte=settings.RECENT_SMS_STATUS_LIMIT).order_by('-created_at')
+        for sms in recent_sms:
+            recent_sms_by_user[sms.contact.user_id].append(sms)
 
-            email_data = {
-                'bot': email.bot,
-                'user_id': email.user,
-                'subject': email.subject,
-                'body': email.body,
-                'message_id': email.message_id,
-                'email_id': email.id
-            }
-            self._process_email(email_data, logger=logger)
+        self._recent_sms_status_by_user = {
+            user_id: self._format_sms_status(recent_sms_by_user[user_id]) for user_id in user_ids
+        }
 
-    def _get_emails_for_processing(self):
+    def _get_user_contacts(self, user):
         """
-        Fetches all unprocessed emails for the bot.
+        Returns the contacts of a user from the prefetched chunk context, loading them if they are missing.
+
+        Args:
+            user (User): The user whose contacts are needed.
 
         Returns:
-            QuerySet: A queryset containing all emails that are not yet processed and are
-            associated with the bot.
+            list: The `Contact` instances of the user.
+        """
+        if user.id not in self._contacts_by_user:
+            self._contacts_by_user[user.id] = list(Contact.objects.filter(user=user).order_by('id'))
+        return self._contacts_by_user[user.id]
+
+    def _get_recent_sms_status(self, user):
+        """
+        Returns the formatted status of the recent text messages of a user, loading it if it was not prefetched.
+
+        Args:
+            user (User): The user whose text messages are needed.
+
+        Returns:
+            str: The formatted status lines.
+        """
+        if user.id not in self._recent_sms_status_by_user:
+            recent_sms = SMS.objects.filter(contact__user=user).select_related('contact').order_by('-created_at')[:settings.RECENT_SMS_STATUS_LIMIT]
+            self._recent_sms_status_by_user[user.id] = self._format_sms_status(recent_sms)
+        return self._recent_sms_status_by_user[user.id]
+
+    def _queue_pending_replies(self, logger=None):
+        """
+        Writes the replies built for the current chunk to the `ReplyOutbox` with a single insert.
+
+        Args:
+            logger (logging.Logger, optional): A logger instance to log processing details. Default is None.
+        """
+        if not self._pending_replies:
+            return
+        ReplyOutbox.objects.bulk_create(self._pending_replies)
+        self.queued_replies_count += len(self._pending_replies)
+        if logger:
+            logger.info(f"Queued {len(self._pending_replies)} replies for bot = {self.bot_id}")
+        self._pending_replies = []
+
+    def _mark_emails_as_processed(self, email_ids, logger=None):
+        """
+        Marks a chunk of emails as processed with a single update query.
+
+        Args:
+            email_ids (list of int): The ids of the emails to mark.
+            logger (logging.Logger, optional): A logger instance to log processing details. Default is None.
         """
-        return Email.objects.filter(is_processed=False, bot__id=self.bot_id)
+        if not email_ids:
+            return
+        updated_count = Email.objects.filter(id__in=email_ids).update(is_processed=True, updated_at=timezone.now())
+        if logger:
+            logger.debug(f"Marked {updated_count} emails as processed for bot = {self.bot_id}")
+
+    def _record_failed_emails(self, email_ids, logger=None):
+        """
+        Counts a failed processing attempt for every email in `email_ids`.
+
+        Emails that reached `EMAIL_PROCESSING_MAX_ATTEMPTS` are parked by marking them as processed, so a
+        single email that always fails is not retried forever. Parked emails keep their attempt count and
+        can be found with `processing_attempts__gte=EMAIL_PROCESSING_MAX_ATTEMPTS`.
+
+        Args:
+            email_ids (list of int): The ids of the emails that failed.
+            logger (logging.Logger, optional): A logger instance to log processing details. Default is None.
+        """
+        if not email_ids:
+            return
+        Email.objects.filter(id__in=email_ids).update(processing_attempts=F('processing_attempts') + 1, updated_at=timezone.now())
+        parked_count = Email.objects.filter(
+            id__in=email_ids, processing_attempts__gte=settings.EMAIL_PROCESSING_MAX_ATTEMPTS
+        ).update(is_processed=True)
+        if logger and parked_count:
+            logger.error(f"Parked {parked_count} emails for bot = {self.bot_id} after {settings.EMAIL_PROCESSING_MAX_ATTEMPTS} failed attempts")
 
     def _process_email(self, email_data, logger=None):
         """
         Processes an individual email by detecting commands, extracting phone numbers or
         email addresses, and handling the appropriate actions (such as adding, updating,
-        or removing contacts).
+        or removing contacts). The email is marked as processed by `process_emails` together
+        with the rest of its chunk.
 
         Args:
             email_data (dict): Contains the email's data, including the subject, body, message_id,
             and email_id.
             logger (logging.Logger, optional): A logger instance to log processing details. Default is None.
         """
-        command, contact_name, contact_detail, detail_type = self.detect_commands_and_contact_details(email_data['subject'])
-
-        # Parse contact info based on the detected command
-        contact_name, contact_detail, _ = self._parse_contact_info(email_data['subject'], command)
+        # The subject is parsed once, the command and contact details are passed along from here
+        parsed_command = self.command_parser.parse(email_data['subject'])
+        command = parsed_command.command
 
         success, details, failed_contacts, new_contacts = self._process_command(
-            email_data, command, contact_name, contact_detail, detail_type
+            email_data, command, parsed_command.contact_name, parsed_command.contact_detail, parsed_command.detail_type
         )
         logger.info(f"Details = : {details}")
 
-        email_obj = Email.objects.filter(id=email_data['email_id']).first()
-        if email_obj:
-            email_obj.is_processed = True
-            email_obj.save()
+        if command in ["Add", "Update", "Remove"]:
+            # The contact list changed, so the response has to show the current one.
+            self._contacts_by_user.pop(email_data['user_id'].id, None)
 
         self._construct_response_message(
             user_id=email_data['user_id'],
@@ -125,68 +285,6 @@ class EmailProcessingHandler:
             new_contacts=new_contacts
         )
 
-    def detect_commands_and_contact_details(self, input_string):
-        """
-        Detects commands and extracts contact names and contact details (phone numbers or email addresses)
-        from the input string (email subject).
-
-        Args:
-            input_string (str): The subject of the email from which the command, contact name,
-            and contact detail are to be detected.
-
-        Returns:
-            tuple:
-                - found_command (str): The detected command ('Add', 'Update', 'Remove', or 'Contact List').
-                - contact_name (str): The name of the contact (if applicable).
-                - contact_detail (str): The email or phone number (if applicable).
-                - detail_type (str): Either 'email' or 'phone_number' (if applicable).
-        """
-        input_string_cleaned = input_string.strip()
-
-        # Extract the first word(s) for detecting command (first or second depending on command type)
-        parts = input_string_cleaned.split()
-        if len(parts) < 2:
-            return None, None, None, None
-
-        # Match command with fuzzy matching
-        command_candidates = [' '.join(parts[:2]), parts[0]]  # Either first two words or first word
-        found_command = None
-        for candidate in command_candidates:
-            best_match, confidence = process.extractOne(candidate, self.COMMANDS)
-            if confidence >= self.SIMILARITY_THRESHOLD:
-                found_command = best_match
-                break
-
-        if not found_command:
-            return None, None, None, None
-
-        # Handle Contact List separately
-        if found_command == "Contact List":
-            return found_command, None, None, None
-
-        # Handle Remove separately: it doesn't contain contact details, only the name
-        if found_command == "Remove":
-            contact_name = ' '.join(parts[1:])
-            return found_command, contact_name, None, None
-
-        # Find contact detail (last element of string)
-        contact_detail = parts[-1]
-        contact_name = None
-
-        # Determine if contact detail is phone number or email
-        if re.match(self.EMAIL_REGEX, contact_detail):
-            detail_type = 'email'
-        elif re.match(self.PHONE_REGEX, contact_detail):
-            detail_type = 'phone_number'
-        else:
-            detail_type = 'email'
-
-        # Extract contact name based on command type
-        if found_command in ["Add", "Update"]:  # One-word commands that need contact detail
-            contact_name = ' '.join(parts[1:-1])
-
-        return found_command, contact_name, contact_detail, detail_type
-
     def _process_command(self, email_data, command, contact_name, contact_detail, detail_type):
         """
         Processes the detected command and performs the appropriate action
@@ -210,7 +308,7 @@ class EmailProcessingHandler:
         new_contacts = []
 
         if command == "Add":
-            success, contact_name = self._handle_contact(email_data, 'Add', detail_type, contact_detail, failed_contacts)
+            success, contact_name = self._handle_contact(email_data, 'Add', contact_name, detail_type, contact_detail, failed_contacts)
             if success and contact_name:
                 new_contacts.append(contact_name)
             return success, "FAMILY_CONTACT_UPDATE", failed_contacts, new_contacts
@@ -219,14 +317,13 @@ class EmailProcessingHandler:
             contact_found = self._find_contact(email_data['user_id'], contact_name)
             if not contact_found:
                 return False, "CONTACT_NOT_FOUND", failed_contacts, new_contacts
-            success, contact_name = self._handle_contact(email_data, 'Update', detail_type, contact_detail, failed_contacts)
+            success, contact_name = self._handle_contact(email_data, 'Update', contact_name, detail_type, contact_detail, failed_contacts)
             return success, "FAMILY_CONTACT_UPDATE", failed_contacts, new_contacts
 
         if command == "Remove":
-            contact_found = self._find_contact(email_data['user_id'], contact_name)
-            if not contact_found:
+            success, contact_name = self._remove_contact(email_data, contact_name)
+            if not success:
                 return False, "CONTACT_NOT_FOUND", failed_contacts, new_contacts
-            contact_found.delete()
             return True, "FAMILY_CONTACT_UPDATE", failed_contacts, new_contacts
 
         if command == "Contact List":
@@ -248,13 +345,14 @@ class EmailProcessingHandler:
         """
         return Contact.objects.filter(user=user_id, contact_name=contact_name).first()
 
-    def _handle_contact(self, email_data, action, detail_type, detail_value, failed_contacts):
+    def _handle_contact(self, email_data, action, contact_name, detail_type, detail_value, failed_contacts):
         """
         Handles the addition or update of a contact based on the provided action.
 
         Args:
             email_data (dict): Contains the email's data, including the subject, body, and user_id.
             action (str): The action to perform, either 'Add' or 'Update'.
+            contact_name (str): The name of the contact, as parsed from the subject.
             detail_type (str): Specifies whether the detail being handled is 'email' or 'phone_number'.
             detail_value (str): The value of the email or phone number to be added or updated.
             failed_contacts (list): A list to store failed contact operations.
@@ -264,11 +362,10 @@ class EmailProcessingHandler:
                 - success (bool): Indicates whether the operation was successful.
                 - contact_name (str): The name of the contact that was added or updated.
         """
-        contact_name, contact_detail, _ = self._parse_contact_info(email_data['subject'], action)
-        valid, message = self._validate_contact_details(contact_name, **{detail_type: contact_detail})
+        valid, message = self._validate_contact_details(contact_name, **{detail_type: detail_value})
 
         if not valid:
-            failed_contacts.append(f"Invalid {detail_type}: {contact_detail}")
+            failed_contacts.append(f"Invalid {detail_type}: {detail_value}")
             return False, contact_name
 
         defaults = {detail_type: detail_value}
@@ -279,20 +376,20 @@ class EmailProcessingHandler:
 
         return True, contact_name
 
-    def _remove_contact(self, email_data):
+    def _remove_contact(self, email_data, contact_name):
         """
         Removes a contact for a given user based on the contact name.
 
         Args:
-            email_data (dict): Contains the email's data, including the subject and user_id.
+            email_data (dict): Contains the email's data, including the user_id.
+            contact_name (str): The name of the contact, as parsed from the subject.
 
         Returns:
             tuple:
                 - success (bool): Indicates whether the contact was successfully removed.
                 - contact_name (str): The name of the removed contact.
         """
-        contact_name, _, _ = self._parse_contact_info(email_data['subject'], "Remove")
-        contact = Contact.objects.filter(user=email_data['user_id'], contact_name=contact_name).first()
+        contact = self._find_contact(email_data['user_id'], contact_name)
         if contact:
             contact.delete()
             return True, contact_name
@@ -300,7 +397,7 @@ class EmailProcessingHandler:
 
     def _contact_list(self, email_data):
         """
-        Retrieves the contact list for a user.
+        Retrieves the contact list for a user from the contacts prefetched for the chunk.
 
         Args:
             email_data (dict): Contains the email's data, including the user_id.
@@ -308,44 +405,10 @@ class EmailProcessingHandler:
         Returns:
             bool: True if the user has contacts, False if no contacts are found.
         """
-        contacts = Contact.objects.filter(user=email_data['user_id'])
-        if contacts.exists():
+        if self._get_user_contacts(email_data['user_id']):
             return True
         return False
 
-    def _parse_contact_info(self, subject_string, command):
-        """
-        Parses the contact information (name and detail) from the email subject line based
-        on the detected command.
-
-        Args:
-            subject_string (str): The subject of the email containing the command, contact name, and detail.
-            command (str): The detected command from the subject line.
-
-        Returns:
-            tuple:
-                - contact_name (str): The extracted contact name.
-                - contact_detail (str): The email or phone number (if applicable).
-                - None (None): A placeholder for a future parameter.
-        """
-        subject_cleaned = subject_string.strip()
-        parts = subject_cleaned.split()
-
-        # Handle the "Remove" command (no contact detail)
-        if command == "Remove":
-            contact_name = ' '.join(parts[1:])  # Everything after the command is the name
-            return contact_name, None, None
-
-        # Handle "Add" and "Update" commands
-        if command in ["Add", "Update"]:
-            if len(parts) < 3:  # Ensure there are enough parts to extract a name and a detail
-                return None, None, None
-            contact_detail = parts[-1]  # The last part is the contact detail (email/phone)
-            contact_name = ' '.join(parts[1:-1])  # Everything between the command and the contact detail is the name
-            return contact_name, contact_detail, None
-
-        return None, None, None
-
     def _validate_contact_details(self, name, email=None, phone_number=None):
         """
         Validates the contact details, ensuring the contact name is present and that the
@@ -408,8 +471,9 @@ class EmailProcessingHandler:
 
     def _construct_response_message(self, user_id, success, message_key, message_args, message_id, email_id, bot, logger, new_contacts=[]):
         """
-        Constructs and sends a response message to the user based on the outcome of
-        the email command processing (e.g., whether the contact was added, updated, or removed).
+        Constructs a response message to the user based on the outcome of the email command
+        processing (e.g., whether the contact was added, updated, or removed) and queues it
+        for the push emails stage.
 
         Args:
             user_id (int): The ID of the user to whom the response will be sent.
@@ -424,28 +488,29 @@ class EmailProcessingHandler:
         """
         logger.info(f"User {user_id} | Success: {success} | Message Key: {message_key} | Message ID: {message_id}")
         try:
-            response_message = ResponseMessages.objects.filter(message_key=message_key).first()
+            response_message = get_response_message_templates().get(message_key)
             first_name = user_id.name
             message_args['first_name'] = first_name
 
-            all_bot_accounts = BotAccount.objects.all()
-            bot_accounts_str = '\n'.join([f"{bot.email_address}" for bot in all_bot_accounts])
+            bot_accounts_str = '\n'.join(get_bot_email_addresses())
             message_args['bot_accounts'] = bot_accounts_str
 
-            all_contacts_for_user = Contact.objects.filter(user=user_id)
+            all_contacts_for_user = self._get_user_contacts(user_id)
             contact_list_str = '\n'.join([f"{contact.contact_name}: {contact.email if contact.email else ''} : {contact.phone_number if contact.phone_number else ''}" for contact in all_contacts_for_user])
             message_args['new_contacts'] = ', '.join(new_contacts) if new_contacts else 'No new contacts'
             message_args['existing_contacts'] = contact_list_str
 
-            recent_sms_sent_by_user = SMS.objects.filter(contact__user=user_id).order_by('-created_at')[:20]
-            previous_text_messages_status = self._format_sms_status(recent_sms_sent_by_user)
-            message_args['previous_text_messages_status'] = previous_text_messages_status
-
+            message_args['previous_text_messages_status'] = self._get_recent_sms_status(user_id)
 
             if response_message:
-                formatted_message = response_message.response_content.format(**message_args)
-                call_command('push_emails', message_id=message_id, message_content=formatted_message, bot_id=self.bot_id)
-                logger.info(f"Response sent: {formatted_message}")
+                formatted_message = response_message.format(**message_args)
+                self._pending_replies.append(ReplyOutbox(
+                    bot_id=self.bot_id,
+                    email_id=email_id,
+                    message_id=message_id,
+                    message_content=formatted_message
+                ))
+                logger.info(f"Response queued: {formatted_message}")
 
         except Exception as e:
             logger.error(f'Error constructing response message: {e}')
@@ -467,9 +532,9 @@ class EmailProcessingHandler:
 
     def _format_sms_status(self, sms_queryset):
         """
-        Formats the last 20 SMS messages into a readable string for the previous_text_messages_status.
+        Formats the most recent SMS messages into a readable string for the previous_text_messages_status.
         Args:
-            sms_queryset (QuerySet): The last 20 SMS messages.
+            sms_queryset (QuerySet or list): The most recent SMS messages, with their contact loaded.
         Returns:
             str: A formatted string containing SMS details.
         """
@@ -1,7 +1,7 @@
 
 from accounts.login_service import SessionManager
-from accounts.utils import get_or_create_user
-from process_emails.utils import save_emails
+from accounts.utils import get_or_create_users
+from process_emails.utils import save_emails, get_ingested_message_ids, update_last_read_message_id
 from contxt.utils.constants import CURRENT_TASKS_RUN_BY_BOTS
 
 from django.core.management.base import BaseCommand
@@ -10,8 +10,10 @@ from django.conf import settings
 from selectolax.lexbor import LexborHTMLParser
 from requests_toolbelt import MultipartEncoder
 
+from concurrent.futures import ThreadPoolExecutor
 import re
 import logging
+import threading
 
 
 HEADERS = settings.PULL_EMAIL_REQUEST_HEADERS
@@ -32,12 +34,13 @@ class Command(BaseCommand):
         1. Retrieves a session using the `SessionManager`.
         2. Fetches the inbox page and checks the response status.
         3. Parses the inbox page to retrieve `COMPRESSEDVIEWSTATE` and email rows.
-        4. For each email row:
-            - Extracts the `MessageId`, sender, subject, and date.
-            - Sends a POST request to fetch the email content using the extracted `MessageId`.
+        4. Extracts the `MessageId`, sender, subject, and date of every email row and drops
+           the rows whose `MessageId` is already stored for the bot.
+        5. Sends the POST requests that fetch the email contents, up to `PULL_EMAIL_CONCURRENCY` at a time.
+        6. In inbox order, for each fetched email:
             - Parses and processes the AJAX response to extract email data.
             - Creates or retrieves a user and prepares email data for saving.
-        5. Saves the processed emails if any.
+        7. Saves the processed emails if any and moves the bot's `last_read_message_id` forward.
 
         Args:
             *args: Positional arguments (not used).
@@ -93,7 +96,7 @@ class Command(BaseCommand):
                 logger.info(f"No email rows found for bot = {bot_id}. Check the logs above for more information.")
                 return
 
-            emails_to_save = []
+            inbox_rows = []
 
             for i, row in enumerate(email_rows):
                 logger.debug(f"Processing email row {i+1} for bot = {bot_id}")
@@ -101,82 +104,173 @@ class Command(BaseCommand):
                     logger.info(f"Test mode: stopping after 3 emails for bot = {bot_id}")
                     break
 
-                row_html = row.html
-                message_id_match = re.search(r'(Command="REPLY"\s+MessageId="(\d+)"|messageid="(\d+)")', row_html, re.IGNORECASE)
-
-                if message_id_match:
-                    message_id = message_id_match.group(2) or message_id_match.group(3)
-                    logger.debug(f"Found MessageId: {message_id}")
+                inbox_row = self.parse_inbox_row(row, i, logger=logger)
+                if inbox_row['message_id']:
+                    inbox_rows.append(inbox_row)
                 else:
-                    message_id = None
-                    logger.error(f"MessageId not found in row {i+1}.")
-
-                from_elem = row.css_first(settings.FROM_ELEMENT_CSS_SELECTOR)
-                subject_elem = row.css_first(settings.SUBJECT_ELEMENT_CSS_SELECTOR)
-                date_elem = row.css_first(settings.DATE_ELEMENT_CSS_SELECTOR)
-
-                from_text = from_elem.text() if from_elem else 'Not found'
-                subject_text = subject_elem.text() if subject_elem else 'Not found'
-                date_text = date_elem.text() if date_elem else 'Not found'
-
-                logger.info(f"Extracted email data: MessageId={message_id}, From={from_text}, Subject={subject_text}, Date={date_text}")
-
-                if message_id:
-                    post_data = {
-                        '__EVENTTARGET': settings.PULL_EMAIL_EVENTTARGET,
-                        '__EVENTARGUMENT': f'rc{i}',
-                        '__COMPRESSEDVIEWSTATE': compressed_viewstate_value,
-                        '__ASYNCPOST': settings.ASYNCPOST,
-                        'ctl00$topScriptManager': settings.TOPSCRIPTMANAGER
-                    }
+                    logger.warning(f"Failed to extract message ID for email {i+1}. bot = {bot_id}")
+
+            # Only fetch the bodies of messages that were not ingested in a previous run.
+            ingested_message_ids = get_ingested_message_ids(bot_id=bot_id, message_ids=[inbox_row['message_id'] for inbox_row in inbox_rows])
+            if ingested_message_ids:
+                logger.info(f"Skipping {len(ingested_message_ids)} already ingested emails for bot = {bot_id}")
+                inbox_rows = [inbox_row for inbox_row in inbox_rows if inbox_row['message_id'] not in ingested_message_ids]
+
+            if not inbox_rows:
+                logger.info(f"No new emails to fetch for bot = {bot_id}")
+                return
 
-                    form = MultipartEncoder(fields=post_data)
-                    headers = HEADERS.copy()
-                    headers['Content-Type'] = form.content_type
-
-                    logger.info(f"Sending POST request for email {message_id} for bot = {bot_id}")
-                    email_response = session.post(settings.UNREAD_MESSAGES_URL, data=form.to_string(), headers=headers)
-                    logger.info(f"Email response status code: {email_response.status_code} for bot = {bot_id}")
-
-                    if email_response.status_code == 200:
-                        email_content = self.parse_ajax_response(email_response.text)
-                        if email_content:
-                            email_data = self.process_email_content(email_content, message_id, logger=logger)
-                            if email_data:
-                                user_id = get_or_create_user(email_data)
-                                if user_id:
-                                    email_to_save = {
-                                        'user_id': user_id,
-                                        'sent_datetime': email_data['date'],
-                                        'subject': email_data['subject'],
-                                        'body': email_data['message'],
-                                        'message_id': email_data['message_id'],
-                                        'bot_id' : bot_id
-                                    }
-                                    emails_to_save.append(email_to_save)
-                                    logger.info(f"Processed email: {email_to_save} for bot = {bot_id}")
-                                else:
-                                    logger.warning(f"Failed to ensure user exists for email: {email_data['message_id']} bot = {bot_id}")
-                            else:
-                                logger.warning(f"Failed to process email content for message ID {message_id}. bot = {bot_id}")
-                        else:
-                            logger.error(f"Failed to parse AJAX response for message ID {message_id}. bot = {bot_id}")
+            # Bodies are fetched concurrently but come back in inbox order, so they are parsed and saved in that order.
+            email_contents = self.fetch_email_contents(session, inbox_rows, compressed_viewstate_value, bot_id=bot_id, logger=logger)
+
+            parsed_emails = []
+
+            for inbox_row, email_content in zip(inbox_rows, email_contents):
+                message_id = inbox_row['message_id']
+                if email_content:
+                    email_data = self.process_email_content(email_content, message_id, logger=logger)
+                    if email_data:
+                        parsed_emails.append(email_data)
                     else:
-                        logger.error(f"Failed to fetch email content, status code: {email_response.status_code}. bot = {bot_id}")
+                        logger.warning(f"Failed to process email content for message ID {message_id}. bot = {bot_id}")
 
-                else:
-                    logger.warning(f"Failed to extract message ID for email {i+1}. bot = {bot_id}")
+            # Senders of the whole batch are resolved at once instead of one lookup per email.
+            users = get_or_create_users(parsed_emails)
+            emails_to_save = []
 
-                if settings.TEST_MODE and i >= 2:
-                    logger.info("Test mode: stopping after 3 emails")
-                    break
+            for email_data, user_id in zip(parsed_emails, users):
+                if user_id:
+                    email_to_save = {
+                        'user_id': user_id,
+                        'sent_datetime': email_data['date'],
+                        'subject': email_data['subject'],
+                        'body': email_data['message'],
+                        'message_id': email_data['message_id'],
+                        'bot_id' : bot_id
+                    }
+                    emails_to_save.append(email_to_save)
+                    logger.info(f"Processed email: {email_to_save} for bot = {bot_id}")
+                else:
+                    logger.warning(f"Failed to ensure user exists for email: {email_data['message_id']} bot = {bot_id}")
 
             if emails_to_save:
-                save_emails(emails_to_save)
+                saved_message_ids = save_emails(emails_to_save)
+                # Only emails that were stored move the high-water mark
+                update_last_read_message_id(bot_id=bot_id, message_ids=saved_message_ids)
 
         except Exception as e:
             logger.error(f"An error occurred while processing emails for bot = {bot_id}: {str(e)}.", exc_info=True)
 
+    def parse_inbox_row(self, row, row_index, logger):
+        """
+        Extracts the `MessageId`, sender, subject and date from a single inbox row.
+        Parameters:
+        - row (Node): The parsed inbox table row
+        - row_index (int): The position of the row in the inbox, used as the postback argument
+
+        Returns:
+        - dict: The row data. `message_id` is None if it could not be found in the row.
+        """
+        row_html = row.html
+        message_id_match = re.search(r'(Command="REPLY"\s+MessageId="(\d+)"|messageid="(\d+)")', row_html, re.IGNORECASE)
+
+        if message_id_match:
+            message_id = message_id_match.group(2) or message_id_match.group(3)
+            logger.debug(f"Found MessageId: {message_id}")
+        else:
+            message_id = None
+            logger.error(f"MessageId not found in row {row_index+1}.")
+
+        from_elem = row.css_first(settings.FROM_ELEMENT_CSS_SELECTOR)
+        subject_elem = row.css_first(settings.SUBJECT_ELEMENT_CSS_SELECTOR)
+        date_elem = row.css_first(settings.DATE_ELEMENT_CSS_SELECTOR)
+
+        from_text = from_elem.text() if from_elem else 'Not found'
+        subject_text = subject_elem.text() if subject_elem else 'Not found'
+        date_text = date_elem.text() if date_elem else 'Not found'
+
+        logger.info(f"Extracted email data: MessageId={message_id}, From={from_text}, Subject={subject_text}, Date={date_text}")
+
+        return {
+            'row_index': row_index,
+            'message_id': message_id,
+            'from': from_text,
+            'subject': subject_text,
+            'date': date_text
+        }
+
+    def fetch_email_contents(self, session, inbox_rows, compressed_viewstate_value, bot_id=None, logger=None):
+        """
+        Fetches the content of every given inbox row, with at most `PULL_EMAIL_CONCURRENCY`
+        requests in flight for the bot at a time. Each worker thread sends its requests over its
+        own clone of the bot's session (see `SessionManager.clone_session`).
+        Parameters:
+        - session (requests.Session): The logged in session of the bot
+        - inbox_rows (list): Rows returned by `parse_inbox_row`
+        - compressed_viewstate_value (str): The `__COMPRESSEDVIEWSTATE` of the inbox page
+
+        Returns:
+        - list: The email content of every row, in the same order as `inbox_rows`.
+          An entry is None if the content could not be fetched.
+        """
+        if not inbox_rows:
+            return []
+
+        max_workers = min(settings.PULL_EMAIL_CONCURRENCY, len(inbox_rows))
+        logger.info(f"Fetching {len(inbox_rows)} emails with concurrency {max_workers} for bot = {bot_id}")
+
+        # Every worker thread gets its own copy of the session, so it keeps one connection for all its rows
+        worker_sessions = threading.local()
+
+        def fetch(inbox_row):
+            if not hasattr(worker_sessions, 'session'):
+                worker_sessions.session = SessionManager.clone_session(session)
+            return self.fetch_email_content(worker_sessions.session, inbox_row, compressed_viewstate_value, bot_id=bot_id, logger=logger)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(fetch, inbox_rows))
+
+    def fetch_email_content(self, session, inbox_row, compressed_viewstate_value, bot_id=None, logger=None):
+        """
+        Fetches the content of a single email by posting back the inbox row selection.
+        Parameters:
+        - session (requests.Session): The logged in session of the bot
+        - inbox_row (dict): A row returned by `parse_inbox_row`
+        - compressed_viewstate_value (str): The `__COMPRESSEDVIEWSTATE` of the inbox page
+
+        Returns:
+        - str: The HTML content of the email, or None if it could not be fetched or parsed.
+        """
+        message_id = inbox_row['message_id']
+        post_data = {
+            '__EVENTTARGET': settings.PULL_EMAIL_EVENTTARGET,
+            '__EVENTARGUMENT': f"rc{inbox_row['row_index']}",
+            '__COMPRESSEDVIEWSTATE': compressed_viewstate_value,
+            '__ASYNCPOST': settings.ASYNCPOST,
+            'ctl00$topScriptManager': settings.TOPSCRIPTMANAGER
+        }
+
+        form = MultipartEncoder(fields=post_data)
+        headers = HEADERS.copy()
+        headers['Content-Type'] = form.content_type
+
+        try:
+            logger.info(f"Sending POST request for email {message_id} for bot = {bot_id}")
+            email_response = session.post(settings.UNREAD_MESSAGES_URL, data=form.to_string(), headers=headers)
+            logger.info(f"Email response status code: {email_response.status_code} for bot = {bot_id}")
+        except Exception as e:
+            logger.error(f"Failed to fetch email content for message ID {message_id}. bot = {bot_id}: {str(e)}")
+            return None
+
+        if email_response.status_code != 200:
+            logger.error(f"Failed to fetch email content, status code: {email_response.status_code}. bot = {bot_id}")
+            return None
+
+        email_content = self.parse_ajax_response(email_response.text)
+        if not email_content:
+            logger.error(f"Failed to parse AJAX response for message ID {message_id}. bot = {bot_id}")
+        return email_content
+
     def parse_ajax_response(self, response_text):
         """
         Parses the AJAX response to extract the relevant HTML content.
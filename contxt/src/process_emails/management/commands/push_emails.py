@@ -1,18 +1,23 @@
 
 from accounts.login_service import SessionManager
+from process_emails.models import ReplyOutbox
+from process_emails.postback_service import REPLY_URL, send_reply_postback, record_shadow_result
 from process_emails.utils import convert_cookies_to_splash_format, get_messages_to_send_from_database, update_sms_processed_value
 from contxt.utils.helper_functions import save_screenshots_to_local, get_lua_script_absolute_path
 from contxt.utils.constants import CURRENT_TASKS_RUN_BY_BOTS
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
 
 import logging
 import json
 import sys
 
 STATIC_COOKIES = settings.STATIC_COOKIES
-
+# Every reply sent in test mode goes to this message, so real users are never answered from a test setup.
+TEST_REPLY_MESSAGE_ID = "3735999911"
 
 
 class Command(BaseCommand):
@@ -32,9 +37,18 @@ class Command(BaseCommand):
         log_response_info(response, is_splash_response=False, retry_number=0):
             Logs detailed information about the response from the email reply request.
 
+        get_lua_script():
+            Loads the Splash Lua script for replies once per run.
+
         send_email_reply(session, message_content, message_id, session_state):
+            Sends an email reply with the sender selected by `CORRLINKS_REPLY_SENDER`.
+
+        send_email_reply_with_splash(session, message_content, message_id, session_state):
             Sends an email reply using a Splash service and handles retry logic.
 
+        send_outbox_replies(session, bot_id):
+            Sends the replies queued in the `ReplyOutbox` for the bot in batches.
+
         run_push_email(session=None):
             Main method to handle the push email process including retrieving messages and sending replies.
     """
@@ -71,6 +85,7 @@ class Command(BaseCommand):
 
         logger.info(f'Push Email got bot id = {bot_id} ')
 
+        self.lua_script = None
         session = SessionManager.get_session(bot_id=bot_id)
         if not session:
             logger.error(f"Failed to retrieve session for bot = {bot_id}.")
@@ -132,7 +147,118 @@ class Command(BaseCommand):
                 f.write(response.text)
         logger.info(f"=====================")
 
+    def get_lua_script(self):
+        """
+        Loads the Splash Lua script used to send replies.
+
+        The script is read from disk once per run and reused for every reply sent in that run.
+
+        Returns:
+            str: The content of the Lua script.
+        """
+        if not getattr(self, 'lua_script', None):
+            lua_script_path = get_lua_script_absolute_path(relative_path='lua_scripts/send_email_reply.lua')
+            with open(lua_script_path, 'r') as file:
+                self.lua_script = file.read()
+        return self.lua_script
+
+    def send_outbox_replies(self, session, bot_id=None, logger=None):
+        """
+        Sends the replies queued in the `ReplyOutbox` for the bot.
+
+        Pending replies are read in batches of `REPLY_OUTBOX_BATCH_SIZE` and sent with the session and
+        Lua script of this run. The result of every batch is written with one update for the sent replies
+        and one for the failed ones. A reply that fails `REPLY_OUTBOX_MAX_ATTEMPTS` times is marked as failed.
+
+        Args:
+            session (requests.Session): The session object to use for sending the replies.
+            bot_id (int): The bot whose replies are sent.
+            logger (logging.Logger): The logger instance for logging the results.
+
+        Returns:
+            int: The number of replies sent successfully.
+        """
+        sent_count = 0
+        last_reply_id = 0
+        session_state = None
+
+        while True:
+            replies = list(
+                ReplyOutbox.objects.filter(bot_id=bot_id, status='pending', id__gt=last_reply_id)
+                .order_by('id')[:settings.REPLY_OUTBOX_BATCH_SIZE]
+            )
+            if not replies:
+                break
+            last_reply_id = replies[-1].id
+
+            if session_state is None:
+                session_state = self.capture_session_state(session, logger=logger)
+
+            sent_reply_ids = []
+            failed_reply_ids = []
+            for reply in replies:
+                reply_message_id = TEST_REPLY_MESSAGE_ID if settings.TEST_MODE else reply.message_id
+                try:
+                    success = self.send_email_reply(session=session, message_content=reply.message_content, message_id=reply_message_id, session_state=session_state, logger=logger)
+                except Exception as e:
+                    logger.error(f"Error occurred while sending queued reply {reply.id} for message_id = {reply.message_id}: {e}")
+                    success = False
+
+                if success:
+                    sent_reply_ids.append(reply.id)
+                else:
+                    failed_reply_ids.append(reply.id)
+
+            if sent_reply_ids:
+                ReplyOutbox.objects.filter(id__in=sent_reply_ids).update(
+                    status='sent', attempts=F('attempts') + 1, sent_at=timezone.now(), updated_at=timezone.now()
+                )
+                sent_count += len(sent_reply_ids)
+            if failed_reply_ids:
+                ReplyOutbox.objects.filter(id__in=failed_reply_ids).update(attempts=F('attempts') + 1, updated_at=timezone.now())
+                ReplyOutbox.objects.filter(
+                    id__in=failed_reply_ids, attempts__gte=settings.REPLY_OUTBOX_MAX_ATTEMPTS
+                ).update(status='failed')
+                logger.error(f"Failed to send {len(failed_reply_ids)} queued replies for bot = {bot_id}. They are retried on the next run until they fail {settings.REPLY_OUTBOX_MAX_ATTEMPTS} times.")
+
+        if sent_count:
+            logger.info(f"Sent {sent_count} queued replies for bot = {bot_id}")
+        return sent_count
+
     def send_email_reply(self, session, message_content, message_id, session_state, logger):
+        """
+        Sends an email reply with the sender selected by `CORRLINKS_REPLY_SENDER`.
+
+        - 'splash' renders the reply page in Splash.
+        - 'postback' posts the reply form directly (see `send_reply_postback`). Splash is only used if the
+          postback failed before the form was posted, so a reply is never sent twice.
+        - 'shadow' sends with Splash and compares the outcome with a postback dry run (see `record_shadow_result`).
+
+        Args:
+            session (requests.Session): The session object to use for sending the reply.
+            message_content (str): The content of the reply message.
+            message_id (str): The ID of the message to reply to.
+            session_state (dict): The current state of the session including headers and cookies.
+
+        Returns:
+            bool: True if the reply was sent successfully, False otherwise.
+        """
+        if settings.CORRLINKS_REPLY_SENDER == 'postback':
+            result = send_reply_postback(session, message_id=message_id, message_content=message_content, logger=logger)
+            logger.info(f'Postback reply results = {result}')
+            if result['success'] or result['posted']:
+                return result['success']
+            logger.warning(f"Postback reply for message_id = {message_id} failed before sending. Sending it with Splash.")
+
+        if settings.CORRLINKS_REPLY_SENDER == 'shadow':
+            postback_result = send_reply_postback(session, message_id=message_id, message_content=message_content, logger=logger, dry_run=True)
+            success = self.send_email_reply_with_splash(session=session, message_content=message_content, message_id=message_id, session_state=session_state, logger=logger)
+            record_shadow_result('reply', postback_result=postback_result, splash_success=success, logger=logger)
+            return success
+
+        return self.send_email_reply_with_splash(session=session, message_content=message_content, message_id=message_id, session_state=session_state, logger=logger)
+
+    def send_email_reply_with_splash(self, session, message_content, message_id, session_state, logger):
         """
         Sends an email reply using the Splash service.
 
@@ -147,11 +273,9 @@ class Command(BaseCommand):
         Returns:
             bool: True if the reply was sent successfully, False otherwise.
         """
-        reply_url = f"https://www.corrlinks.com/NewMessage.aspx?messageId={message_id}&type=reply"
+        reply_url = REPLY_URL.format(message_id)
 
-        lua_script_path = get_lua_script_absolute_path(relative_path='lua_scripts/send_email_reply.lua')
-        with open(lua_script_path, 'r') as file:
-            lua_script = file.read()
+        lua_script = self.get_lua_script()
         headers = settings.HEADERS_FOR_PUSH_EMAIL_REQUEST
         cookies = session_state['cookies']
 
@@ -208,7 +332,9 @@ class Command(BaseCommand):
         """
         Runs the push email process, retrieving messages from the database and sending replies.
 
-        Handles test mode and updates the SMS processed value after sending each reply.
+        Replies queued in the `ReplyOutbox` are sent first, followed by the SMS replies, which are coalesced
+        into one reply per email. Handles test mode and updates the SMS processed value of all SMS joined
+        in a reply after sending it.
 
         Args:
             session (requests.Session): The session object to use for sending replies.
@@ -221,8 +347,11 @@ class Command(BaseCommand):
             sys.exit(1)
         message_id_content = []
 
+        if not (message_id and message_content):
+            self.send_outbox_replies(session=session, bot_id=bot_id, logger=logger)
+
         if settings.TEST_MODE == True:
-            message_id = "3735999911"
+            message_id = TEST_REPLY_MESSAGE_ID
             message_content = "This is a test reply message sent from local. Please ignore these messages. Apologies for any inconvenience."
             message_id_content.append([None, message_id, message_content])
         elif message_id and message_content:
@@ -237,23 +366,23 @@ class Command(BaseCommand):
         session_state = self.capture_session_state(session, logger=logger)
 
         for sms_data in message_id_content:
-            sms_id, message_id, message_content = sms_data
+            sms_ids, message_id, message_content = sms_data
             if message_id and message_content:
                 success = self.send_email_reply(session=session, message_content=message_content, message_id=message_id, session_state=session_state, logger=logger)
             else:
                 continue
 
             if success:
-                if not settings.TEST_MODE == True and not sms_id == None:
-                    status = update_sms_processed_value(sms_id=sms_id)
+                if not settings.TEST_MODE == True and sms_ids:
+                    status = update_sms_processed_value(sms_ids=sms_ids)
                     if status:
                         logger.info('SMS processed value updated successfully.')
                     else:
                         logger.error('An error occurred while updating SMS processed value.')
-                logger.info(f"Email reply sent successfully  sms_id = {sms_id} message_id = {message_id}")
+                logger.info(f"Email reply sent successfully  sms_ids = {sms_ids} message_id = {message_id}")
                 logger.info("------------------------------------------------------")
             else:
-                logger.error(f"Failed to send email reply. sms_id = {sms_id} message_id = {message_id}. Check {logger.name}.log for details.")
+                logger.error(f"Failed to send email reply. sms_ids = {sms_ids} message_id = {message_id}. Check {logger.name}.log for details.")
                 logger.info("------------------------------------------------------")
         return f"Push email operation completed. Check {logger.name}.log for details."
 
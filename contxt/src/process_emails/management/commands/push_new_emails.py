@@ -1,6 +1,7 @@
 
 from accounts.login_service import SessionManager
 from process_emails.utils import convert_cookies_to_splash_format, transform_name
+from process_emails.postback_service import NEW_MESSAGE_URL, send_new_message_postback, record_shadow_result
 from core.models import ResponseMessages
 from contxt.utils.helper_functions import save_screenshots_to_local, get_lua_script_absolute_path
 from contxt.utils.constants import CURRENT_TASKS_RUN_BY_BOTS
@@ -33,8 +34,11 @@ class Command(BaseCommand):
         log_response_info(response, is_splash_response=False, retry_number=0):
             Logs detailed information about the response from the email reply request.
 
-        send_email_reply(session, message_content, message_id, session_state):
-            Sends an email reply using a Splash service and handles retry logic.
+        send_new_email(session, message_content, pic_name, session_state):
+            Sends a new message with the sender selected by `CORRLINKS_NEW_MESSAGE_SENDER`.
+
+        send_new_email_with_splash(session, message_content, pic_name, session_state):
+            Sends a new message using a Splash service and handles retry logic.
 
         run_push_email(session=None):
             Main method to handle the push email process including retrieving messages and sending replies.
@@ -136,6 +140,39 @@ class Command(BaseCommand):
         logger.info(f"=====================")
 
     def send_new_email(self, session, message_content, pic_name, session_state, logger):
+        """
+        Sends a new message with the sender selected by `CORRLINKS_NEW_MESSAGE_SENDER`.
+
+        - 'splash' renders the new message page in Splash.
+        - 'postback' addresses and sends the message with direct postbacks (see `send_new_message_postback`).
+          Splash is only used if the postback failed before the message was posted, so it is never sent twice.
+        - 'shadow' sends with Splash and compares the outcome with a postback dry run (see `record_shadow_result`).
+
+        Args:
+            session (requests.Session): The session object to use for sending the message.
+            message_content (str): The content of the message.
+            pic_name (str): The name of the contact to send the message to.
+            session_state (dict): The current state of the session including headers and cookies.
+
+        Returns:
+            bool: True if the message was sent successfully, False otherwise.
+        """
+        if settings.CORRLINKS_NEW_MESSAGE_SENDER == 'postback':
+            result = send_new_message_postback(session, pic_name=transform_name(pic_name), message_content=message_content, logger=logger)
+            logger.info(f'Postback new message results = {result}')
+            if result['success'] or result['posted']:
+                return result['success']
+            logger.warning(f"Postback new message to pic_name = {pic_name} failed before sending. Sending it with Splash.")
+
+        if settings.CORRLINKS_NEW_MESSAGE_SENDER == 'shadow':
+            postback_result = send_new_message_postback(session, pic_name=transform_name(pic_name), message_content=message_content, logger=logger, dry_run=True)
+            success = self.send_new_email_with_splash(session=session, message_content=message_content, pic_name=pic_name, session_state=session_state, logger=logger)
+            record_shadow_result('new_message', postback_result=postback_result, splash_success=success, logger=logger)
+            return success
+
+        return self.send_new_email_with_splash(session=session, message_content=message_content, pic_name=pic_name, session_state=session_state, logger=logger)
+
+    def send_new_email_with_splash(self, session, message_content, pic_name, session_state, logger):
         """
         Sends an email reply using the Splash service.
 
@@ -150,7 +187,7 @@ class Command(BaseCommand):
         Returns:
             bool: True if the reply was sent successfully, False otherwise.
         """
-        new_message_url = f"https://www.corrlinks.com/NewMessage.aspx"
+        new_message_url = NEW_MESSAGE_URL
 
         lua_script_path = get_lua_script_absolute_path(relative_path='lua_scripts/send_new_emails.lua')
         with open(lua_script_path, 'r') as file:
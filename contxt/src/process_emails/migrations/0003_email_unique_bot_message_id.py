@@ -0,0 +1,50 @@
+# Generated by Django 5.0.8 on 2026-10-18 04:13
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_emails(apps, schema_editor):
+    """
+    Keeps the oldest email for every (bot, message_id) pair and moves the SMS of the duplicates
+    onto it before deleting them, so the unique constraint can be created.
+    """
+    Email = apps.get_model("process_emails", "Email")
+    SMS = apps.get_model("sms_app", "SMS")
+
+    duplicates = (
+        Email.objects.exclude(message_id__isnull=True)
+        .exclude(bot__isnull=True)
+        .values("bot", "message_id")
+        .annotate(kept_id=Min("id"), total=Count("id"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        duplicate_emails = Email.objects.filter(
+            bot=duplicate["bot"], message_id=duplicate["message_id"]
+        ).exclude(id=duplicate["kept_id"])
+        SMS.objects.filter(email__in=duplicate_emails).update(
+            email_id=duplicate["kept_id"]
+        )
+        duplicate_emails.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_alter_botaccount_options"),
+        ("process_emails", "0002_email_bot_alter_email_message_id_and_more"),
+        ("sms_app", "0002_sms_bot_sms_sms_bot_id_7860cc_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="email",
+            constraint=models.UniqueConstraint(
+                fields=("bot", "message_id"), name="unique_bot_message_id"
+            ),
+        ),
+    ]
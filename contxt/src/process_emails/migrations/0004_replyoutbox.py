@@ -0,0 +1,77 @@
+# Generated by Django 5.0.8 on 2026-10-18 04:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_alter_botaccount_options"),
+        ("process_emails", "0003_email_unique_bot_message_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReplyOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("message_id", models.CharField(max_length=100)),
+                ("message_content", models.TextField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("sent", "Sent"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("sent_at", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "bot",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="accounts.botaccount",
+                    ),
+                ),
+                (
+                    "email",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="process_emails.email",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "reply_outbox",
+                "verbose_name_plural": "reply_outbox",
+                "db_table": "reply_outbox",
+                "indexes": [
+                    models.Index(
+                        fields=["bot", "status", "id"],
+                        name="reply_outbo_bot_id_a4b27f_idx",
+                    ),
+                    models.Index(
+                        fields=["email"], name="reply_outbo_email_i_e31265_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
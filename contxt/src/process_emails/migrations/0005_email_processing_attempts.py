@@ -0,0 +1,18 @@
+# Generated by Django 5.0.8 on 2026-10-18 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_emails', '0004_replyoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='processing_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
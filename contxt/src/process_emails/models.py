@@ -1,5 +1,6 @@
 
 from accounts.models import User, BotAccount
+from contxt.utils.constants import CONTACT_MANAGEMENT_RESPONSE_STATUS_CHOICES
 
 from django.db import models
 
@@ -15,6 +16,7 @@ class Email(models.Model):
         subject (CharField): The subject line of the email.
         body (TextField): The body content of the email.
         is_processed (BooleanField): Flag indicating whether the email has been processed.
+        processing_attempts (PositiveSmallIntegerField): The number of times processing the email failed.
         updated_at (DateTimeField): The timestamp when the email record was last updated.
         created_at (DateTimeField): The timestamp when the email record was created.
 
@@ -31,6 +33,7 @@ class Email(models.Model):
     body = models.TextField()
 
     is_processed = models.BooleanField(default=False)
+    processing_attempts = models.PositiveSmallIntegerField(default=0)
 
     sent_date_time = models.DateTimeField()
     updated_at = models.DateTimeField(auto_now=True)
@@ -56,3 +59,57 @@ class Email(models.Model):
             models.Index(fields=['is_processed']),
             models.Index(fields=['bot']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['bot', 'message_id'], name='unique_bot_message_id'),
+        ]
+
+
+class ReplyOutbox(models.Model):
+    """
+    Represents a reply to a Corrlinks email that is waiting to be sent by the push emails stage.
+
+    Contact management responses are queued here instead of being sent while the emails are processed,
+    so processing is not held up by Splash. The push emails stage sends the pending replies in batches.
+
+    Attributes:
+        bot (ForeignKey): The bot that has to send the reply.
+        email (ForeignKey): The email that is being replied to, optional.
+        message_id (CharField): The Corrlinks message ID of the email that is being replied to.
+        message_content (TextField): The content of the reply.
+        status (CharField): The delivery status of the reply (pending, sent or failed).
+        attempts (PositiveIntegerField): The number of times sending the reply was attempted.
+        sent_at (DateTimeField): The timestamp when the reply was sent, optional.
+        updated_at (DateTimeField): The timestamp when the reply was last updated.
+        created_at (DateTimeField): The timestamp when the reply was queued.
+    """
+
+    bot = models.ForeignKey(BotAccount, on_delete=models.CASCADE)
+    email = models.ForeignKey(Email, on_delete=models.SET_NULL, null=True, blank=True)
+
+    message_id = models.CharField(max_length=100)
+    message_content = models.TextField()
+
+    status = models.CharField(max_length=20, choices=CONTACT_MANAGEMENT_RESPONSE_STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+
+    sent_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        """
+        Returns the string representation of the queued reply.
+
+        Returns:
+            str: The message ID being replied to and the status of the reply.
+        """
+        return f'Reply to {self.message_id} ({self.status})'
+
+    class Meta:
+        db_table = 'reply_outbox'
+        verbose_name = 'reply_outbox'
+        verbose_name_plural = 'reply_outbox'
+        indexes = [
+            models.Index(fields=['bot', 'status', 'id']),
+            models.Index(fields=['email']),
+        ]
@@ -0,0 +1,275 @@
+from contxt.utils.helper_functions import get_redis_client
+
+from selectolax.lexbor import LexborHTMLParser
+from requests_toolbelt import MultipartEncoder
+
+import re
+
+
+NEW_MESSAGE_URL = "https://www.corrlinks.com/NewMessage.aspx"
+REPLY_URL = "https://www.corrlinks.com/NewMessage.aspx?messageId={}&type=reply"
+MESSAGE_TEXT_BOX_ID = 'ctl00_mainContentPlaceHolder_messageTextBox'
+SUBJECT_TEXT_BOX_ID = 'ctl00_mainContentPlaceHolder_subjectTextBox'
+SEND_MESSAGE_BUTTON_ID = 'ctl00_mainContentPlaceHolder_sendMessageButton'
+MESSAGE_LABEL_ID = 'ctl00_mainContentPlaceHolder_messageLabel'
+ADDRESS_TEXT_BOX_ID = 'ctl00_mainContentPlaceHolder_addressBox_addressTextBox'
+ADDRESS_GRID_ID = 'ctl00_mainContentPlaceHolder_addressBox_addressGrid'
+ADDRESS_OK_BUTTON_ID = 'ctl00_mainContentPlaceHolder_addressBox_okButton'
+WELCOME_SUBJECT = 'Subject: Welcome to ConTXT! Your Messaging Guide.'
+POSTBACK_SHADOW_KEY = 'corrlinks_postback_shadow_{}'
+
+DO_POSTBACK_PATTERN = re.compile(r"__doPostBack\('([^']*)','([^']*)'\)")
+SKIPPED_INPUT_TYPES = ('submit', 'button', 'image', 'reset', 'file')
+
+
+def build_postback_fields(parser, button_id, field_values, extra_fields=None):
+    """
+    Collects the fields a browser would post when the given button of an ASP.NET form is clicked.
+
+    Every named input (including `__VIEWSTATE`, `__COMPRESSEDVIEWSTATE` and `__EVENTVALIDATION`),
+    textarea and select of the page is posted with its current value, the fields in `field_values`
+    are overwritten, and the button is posted the way ASP.NET expects it: as `__EVENTTARGET` for
+    an element that calls `__doPostBack`, or by name for a submit button.
+
+    Args:
+        parser (LexborHTMLParser): The parsed page holding the form.
+        button_id (str): The element ID of the button to click.
+        field_values (dict): The values to enter, keyed by element ID.
+        extra_fields (dict, optional): Further values to post, keyed by field name (e.g. a checked checkbox).
+
+    Returns:
+        dict: The fields to post, or None if the button or one of the fields is not on the page.
+    """
+    button = parser.css_first(f'#{button_id}')
+    if button is None:
+        return None
+
+    fields = {}
+    for element in parser.css('input[name]'):
+        input_type = (element.attributes.get('type') or 'text').lower()
+        if input_type in SKIPPED_INPUT_TYPES:
+            continue
+        if input_type in ('checkbox', 'radio') and 'checked' not in element.attributes:
+            continue
+        fields[element.attributes['name']] = element.attributes.get('value') or ''
+    for element in parser.css('textarea[name]'):
+        fields[element.attributes['name']] = element.text()
+    for element in parser.css('select[name]'):
+        option = element.css_first('option[selected]') or element.css_first('option')
+        fields[element.attributes['name']] = (option.attributes.get('value') or option.text()) if option else ''
+
+    for element_id, value in field_values.items():
+        element = parser.css_first(f'#{element_id}')
+        if element is None or not element.attributes.get('name'):
+            return None
+        fields[element.attributes['name']] = value
+    fields.update(extra_fields or {})
+
+    do_postback = DO_POSTBACK_PATTERN.search(button.attributes.get('href') or button.attributes.get('onclick') or '')
+    if do_postback:
+        fields['__EVENTTARGET'], fields['__EVENTARGUMENT'] = do_postback.groups()
+    elif button.attributes.get('name'):
+        fields[button.attributes['name']] = button.attributes.get('value') or ''
+    else:
+        return None
+
+    return fields
+
+
+def post_back(session, url, fields):
+    """
+    Posts the fields of an ASP.NET form back to its page, encoded like a browser would.
+
+    Args:
+        session (requests.Session): The logged in session of the bot.
+        url (str): The URL of the page holding the form.
+        fields (dict): The fields returned by `build_postback_fields`.
+
+    Returns:
+        requests.Response: The answer of Corrlinks.
+    """
+    form = MultipartEncoder(fields=fields)
+    return session.post(url, data=form.to_string(), headers={'Content-Type': form.content_type, 'Referer': url})
+
+
+def submit_postback_form(session, url, button_id, field_values, confirmation_id, logger, dry_run=False):
+    """
+    Fills and submits an ASP.NET form with plain HTTP requests instead of a Splash render.
+
+    The page is fetched with the session, its form is rebuilt from the HTML (see `build_postback_fields`)
+    and posted back to the same URL. The submission succeeded if the answer holds the confirmation element.
+
+    Args:
+        session (requests.Session): The logged in session of the bot.
+        url (str): The URL of the page holding the form.
+        button_id (str): The element ID of the button to click.
+        field_values (dict): The values to enter, keyed by element ID.
+        confirmation_id (str): The element ID shown after a successful submission.
+        logger (logging.Logger): The logger instance for logging the results.
+        dry_run (bool): Whether to stop before posting the form, to check that it could be submitted.
+
+    Returns:
+        dict: 'success' (bool) whether the form was submitted, or could be in a dry run, 'posted' (bool)
+        whether the form may have reached Corrlinks, and a 'message' describing the outcome.
+    """
+    try:
+        response = session.get(url)
+    except Exception as e:
+        return {'success': False, 'posted': False, 'message': f'Page request failed: {e}'}
+    if response.status_code != 200:
+        return {'success': False, 'posted': False, 'message': f'Page returned status code {response.status_code}'}
+
+    fields = build_postback_fields(LexborHTMLParser(response.text), button_id=button_id, field_values=field_values)
+    if fields is None:
+        return {'success': False, 'posted': False, 'message': 'Form not found'}
+    if dry_run:
+        return {'success': True, 'posted': False, 'message': 'Form ready'}
+
+    try:
+        response = post_back(session, url, fields)
+    except Exception as e:
+        # The form may have been received before the request failed
+        return {'success': False, 'posted': True, 'message': f'Postback failed: {e}'}
+
+    logger.info(f'Postback response status code: {response.status_code}')
+    if response.status_code == 200 and LexborHTMLParser(response.text).css_first(f'#{confirmation_id}') is not None:
+        return {'success': True, 'posted': True, 'message': 'Confirmation found'}
+    return {'success': False, 'posted': True, 'message': f'Confirmation not found, status code {response.status_code}'}
+
+
+def send_reply_postback(session, message_id, message_content, logger, dry_run=False):
+    """
+    Sends a reply to a Corrlinks message through the `NewMessage.aspx` postback, see `submit_postback_form`.
+
+    Args:
+        session (requests.Session): The logged in session of the bot.
+        message_id (str): The ID of the message to reply to.
+        message_content (str): The content of the reply.
+        logger (logging.Logger): The logger instance for logging the results.
+        dry_run (bool): Whether to stop before posting the reply.
+
+    Returns:
+        dict: The outcome, see `submit_postback_form`.
+    """
+    return submit_postback_form(
+        session, REPLY_URL.format(message_id), button_id=SEND_MESSAGE_BUTTON_ID,
+        field_values={MESSAGE_TEXT_BOX_ID: message_content}, confirmation_id=MESSAGE_LABEL_ID,
+        logger=logger, dry_run=dry_run
+    )
+
+
+def send_new_message_postback(session, pic_name, message_content, logger, dry_run=False):
+    """
+    Sends a new message to a Corrlinks contact through `NewMessage.aspx` postbacks instead of a Splash render.
+
+    The address book of the page is opened (with a postback if it is not part of the page already), the
+    row of the contact is checked and confirmed, and the message is sent with the welcome subject. Only
+    the last postback can send the message, so `posted` is False if any earlier step failed.
+
+    Args:
+        session (requests.Session): The logged in session of the bot.
+        pic_name (str): The name of the contact as shown in the address book, see `transform_name`.
+        message_content (str): The content of the message.
+        logger (logging.Logger): The logger instance for logging the results.
+        dry_run (bool): Whether to stop before sending the message.
+
+    Returns:
+        dict: The outcome, see `submit_postback_form`.
+    """
+    try:
+        response = session.get(NEW_MESSAGE_URL)
+        if response.status_code != 200:
+            return {'success': False, 'posted': False, 'message': f'Page returned status code {response.status_code}'}
+        parser = LexborHTMLParser(response.text)
+
+        if parser.css_first(f'#{ADDRESS_GRID_ID}') is None:
+            fields = build_postback_fields(parser, button_id=ADDRESS_TEXT_BOX_ID, field_values={})
+            if fields is None:
+                return {'success': False, 'posted': False, 'message': 'Address book not found'}
+            parser = LexborHTMLParser(post_back(session, NEW_MESSAGE_URL, fields).text)
+
+        checkbox = get_recipient_checkbox(parser, pic_name=pic_name)
+        if checkbox is None:
+            return {'success': False, 'posted': False, 'message': f'Recipient {pic_name} not found'}
+
+        fields = build_postback_fields(
+            parser, button_id=ADDRESS_OK_BUTTON_ID, field_values={},
+            extra_fields={checkbox.attributes['name']: checkbox.attributes.get('value') or 'on'}
+        )
+        if fields is None:
+            return {'success': False, 'posted': False, 'message': 'Address book confirmation not found'}
+        response = post_back(session, NEW_MESSAGE_URL, fields)
+        if response.status_code != 200:
+            return {'success': False, 'posted': False, 'message': f'Address book returned status code {response.status_code}'}
+    except Exception as e:
+        return {'success': False, 'posted': False, 'message': f'Addressing the message failed: {e}'}
+
+    fields = build_postback_fields(
+        LexborHTMLParser(response.text), button_id=SEND_MESSAGE_BUTTON_ID,
+        field_values={SUBJECT_TEXT_BOX_ID: WELCOME_SUBJECT, MESSAGE_TEXT_BOX_ID: message_content}
+    )
+    if fields is None:
+        return {'success': False, 'posted': False, 'message': 'Form not found'}
+    if dry_run:
+        return {'success': True, 'posted': False, 'message': 'Form ready'}
+
+    try:
+        response = post_back(session, NEW_MESSAGE_URL, fields)
+    except Exception as e:
+        # The message may have been received before the request failed
+        return {'success': False, 'posted': True, 'message': f'Postback failed: {e}'}
+
+    logger.info(f'Postback response status code: {response.status_code}')
+    if response.status_code == 200 and LexborHTMLParser(response.text).css_first(f'#{MESSAGE_LABEL_ID}') is not None:
+        return {'success': True, 'posted': True, 'message': 'Confirmation found'}
+    return {'success': False, 'posted': True, 'message': f'Confirmation not found, status code {response.status_code}'}
+
+
+def get_recipient_checkbox(parser, pic_name):
+    """
+    Finds the checkbox of a contact in the address book shown on the page.
+
+    Args:
+        parser (LexborHTMLParser): The parsed page holding the address book.
+        pic_name (str): The name of the contact as shown in the address book.
+
+    Returns:
+        Node: The checkbox of the contact, or None if the contact is not in the address book.
+    """
+    for row in parser.css(f'#{ADDRESS_GRID_ID} tr')[1:]:
+        checkbox = row.css_first('input[type="checkbox"]')
+        if checkbox is not None and checkbox.attributes.get('name') and is_recipient_row(row, pic_name):
+            return checkbox
+    return None
+
+
+def is_recipient_row(row, pic_name):
+    """
+    Checks whether an address book row shows the contact, the same way `send_new_emails.lua` matches it.
+    """
+    cells = row.css('td')
+    return len(cells) > 1 and pic_name in cells[1].text()
+
+
+def record_shadow_result(kind, postback_result, splash_success, logger):
+    """
+    Compares the dry run of a postback with the outcome of the Splash render that actually sent the message.
+
+    The number of matching and differing outcomes is counted per kind in Redis, so the postback path can be
+    enabled once it agrees with Splash.
+
+    Args:
+        kind (str): What was sent, e.g. 'reply'.
+        postback_result (dict): The outcome of the postback dry run.
+        splash_success (bool): Whether Splash sent the message.
+        logger (logging.Logger): The logger instance for logging differences.
+
+    Returns:
+        bool: True if both paths agree.
+    """
+    matched = postback_result['success'] == bool(splash_success)
+    get_redis_client().hincrby(POSTBACK_SHADOW_KEY.format(kind), 'match' if matched else 'mismatch', 1)
+    if not matched:
+        logger.warning(f"Postback {kind} disagrees with Splash. Splash success = {splash_success}, postback = {postback_result}")
+    return matched
+
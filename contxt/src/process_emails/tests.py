@@ -1,3 +1,340 @@
-from django.test import TestCase
+from accounts.models import BotAccount, User
+from core.models import Contact, ResponseMessages
+from process_emails.command_parser import CommandParser, ParsedCommand
+from process_emails.email_processing_service import EmailProcessingHandler
+from process_emails.models import Email, ReplyOutbox
+from process_emails.postback_service import (
+    build_postback_fields, get_recipient_checkbox, is_recipient_row, ADDRESS_TEXT_BOX_ID, MESSAGE_TEXT_BOX_ID,
+    SEND_MESSAGE_BUTTON_ID
+)
+from process_emails.utils import save_emails
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import DataError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from selectolax.lexbor import LexborHTMLParser
+
+from unittest.mock import patch
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CELERY_ENABLED=False)
+class EmailProcessingQueryCountTests(TestCase):
+    """
+    Locks in that `EmailProcessingHandler.process_emails` runs a fixed number of queries per chunk,
+    however many emails the chunk holds.
+    """
+
+    CHUNK_COUNT = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bot = BotAccount.objects.create(bot_name='bot1', email_address='bot1@example.com')
+        ResponseMessages.objects.create(message_key='CONTACT_LIST', response_content='Hi {first_name}\n{existing_contacts}')
+        ResponseMessages.objects.create(message_key='INSTRUCTIONAL_ERROR', response_content='Hi {first_name}, unknown command {command}')
+
+    def setUp(self):
+        # The response templates and bot addresses are loaded once per run, not once per email
+        cache.clear()
+
+    def seed_emails(self, count):
+        """
+        Creates `count` unprocessed emails, spread over as many users, mixing listed and unknown commands.
+        """
+        for index in range(count):
+            user = User.objects.create(user_name=f'user{index}', name=f'User {index}', pic_number=f'{index:08d}')
+            Contact.objects.create(user=user, contact_name=f'Contact {index}', phone_number='5555550100')
+            Email.objects.create(
+                user=user, bot=self.bot, message_id=f'message{index}',
+                subject='Contact List' if index % 2 else 'Hello there', body='', sent_date_time=timezone.now()
+            )
+
+    def process_emails(self, emails_per_chunk):
+        """
+        Processes `CHUNK_COUNT` chunks of `emails_per_chunk` emails and returns the number of queries it took.
+        """
+        self.seed_emails(emails_per_chunk * self.CHUNK_COUNT)
+        with self.settings(EMAIL_PROCESSING_CHUNK_SIZE=emails_per_chunk):
+            with self.assertNumQueries(self.expected_query_count()):
+                EmailProcessingHandler(self.bot.id)
+
+        self.assertFalse(Email.objects.filter(is_processed=False).exists())
+        self.assertEqual(ReplyOutbox.objects.count(), emails_per_chunk * self.CHUNK_COUNT)
+
+    def expected_query_count(self):
+        # Per chunk: emails, contacts, recent SMS, reply insert and processed update, plus the savepoint
+        # pair of the atomic block. The empty chunk ending the loop and the cached templates and bot
+        # addresses add three queries once.
+        return self.CHUNK_COUNT * 7 + 3
+
+    def test_small_chunks(self):
+        self.process_emails(emails_per_chunk=2)
+
+    def test_large_chunks(self):
+        self.process_emails(emails_per_chunk=20)
+
+    def fail_processing_of(self, failing_email_ids):
+        """
+        Returns a patch of `_process_email` that raises for the emails in `failing_email_ids`.
+        """
+        original_process_email = EmailProcessingHandler._process_email
+
+        def process_email(handler, email_data, logger=None):
+            if email_data['email_id'] in failing_email_ids:
+                raise ValueError('Processing failed')
+            original_process_email(handler, email_data, logger=logger)
+
+        return patch.object(EmailProcessingHandler, '_process_email', process_email)
+
+    def test_failed_email_is_not_marked_as_processed(self):
+        self.seed_emails(2)
+        processed_email, failing_email = Email.objects.order_by('id')
+
+        with self.fail_processing_of({failing_email.id}):
+            EmailProcessingHandler(self.bot.id)
+
+        processed_email.refresh_from_db()
+        failing_email.refresh_from_db()
+        self.assertTrue(processed_email.is_processed)
+        self.assertFalse(failing_email.is_processed)
+        self.assertEqual(failing_email.processing_attempts, 1)
+
+    def test_failed_email_does_not_stop_later_chunks(self):
+        self.seed_emails(4)
+        emails = list(Email.objects.order_by('id'))
+        failing_email = emails[1]
+
+        with self.settings(EMAIL_PROCESSING_CHUNK_SIZE=2, CELERY_ENABLED=True):
+            with self.fail_processing_of({failing_email.id}), patch('process_emails.email_processing_service.push_emails_for_bot') as push_emails:
+                EmailProcessingHandler(self.bot.id)
+
+        self.assertEqual(
+            list(Email.objects.filter(is_processed=False).values_list('id', flat=True)), [failing_email.id]
+        )
+        self.assertEqual(ReplyOutbox.objects.count(), 3)
+        push_emails.delay.assert_called_once_with(self.bot.id)
+
+    def test_email_is_parked_after_the_last_attempt(self):
+        self.seed_emails(1)
+        failing_email = Email.objects.get()
+
+        with self.settings(EMAIL_PROCESSING_MAX_ATTEMPTS=2), self.fail_processing_of({failing_email.id}):
+            EmailProcessingHandler(self.bot.id)
+            failing_email.refresh_from_db()
+            self.assertFalse(failing_email.is_processed)
+
+            EmailProcessingHandler(self.bot.id)
+            failing_email.refresh_from_db()
+            self.assertTrue(failing_email.is_processed)
+            self.assertEqual(failing_email.processing_attempts, 2)
+            self.assertFalse(ReplyOutbox.objects.exists())
+
+
+class CommandParserTests(SimpleTestCase):
+    """
+    Covers the command detection and contact extraction of `CommandParser`.
+    """
+
+    def setUp(self):
+        self.parser = CommandParser(EmailProcessingHandler.COMMANDS, similarity_threshold=EmailProcessingHandler.SIMILARITY_THRESHOLD)
+
+    def test_exact_commands_ignore_case(self):
+        self.assertEqual(self.parser.parse('add John 5555550100').command, 'Add')
+        self.assertEqual(self.parser.parse('UPDATE John 5555550100').command, 'Update')
+        self.assertEqual(self.parser.parse('Remove John').command, 'Remove')
+        self.assertEqual(self.parser.parse('contact list please').command, 'Contact List')
+
+    def test_one_edit_typos_are_accepted(self):
+        # One insertion or deletion is always allowed, even where the threshold of 90 would allow none
+        self.assertEqual(self.parser.parse('Addd John 5555550100').command, 'Add')
+        self.assertEqual(self.parser.parse('Ad John 5555550100').command, 'Add')
+        self.assertEqual(self.parser.parse('Adds John 5555550100').command, 'Add')
+        self.assertEqual(self.parser.parse('Updte John 5555550100').command, 'Update')
+        self.assertEqual(self.parser.parse('Updatee John 5555550100').command, 'Update')
+        self.assertEqual(self.parser.parse('Remov John').command, 'Remove')
+        self.assertEqual(self.parser.parse('Rmove John').command, 'Remove')
+        self.assertEqual(self.parser.parse('Contact Lst').command, 'Contact List')
+        self.assertEqual(self.parser.parse('Contakt List').command, 'Contact List')
+
+    def test_swapped_words_are_accepted(self):
+        self.assertEqual(self.parser.parse('List contacts').command, 'Contact List')
+        self.assertEqual(self.parser.parse('list contact please').command, 'Contact List')
+
+    def test_typos_beyond_the_threshold_are_rejected(self):
+        self.assertIsNone(self.parser.parse('Adddd John 5555550100').command)
+        self.assertIsNone(self.parser.parse('Updt John 5555550100').command)
+        self.assertIsNone(self.parser.parse('Rmve John Smith').command)
+
+    def test_prefix_only_matches_are_rejected(self):
+        # The previous fuzzy matching accepted these, they are deliberately rejected now
+        self.assertIsNone(self.parser.parse('Re: visit on sunday').command)
+        self.assertIsNone(self.parser.parse('Addition to my account').command)
+        self.assertIsNone(self.parser.parse('List of my contacts').command)
+
+    def test_single_word_subjects_have_no_command(self):
+        self.assertEqual(self.parser.parse('Add'), ParsedCommand())
+        self.assertEqual(self.parser.parse(''), ParsedCommand())
+
+    def test_add_extracts_name_and_detail(self):
+        self.assertEqual(
+            self.parser.parse('Add John Smith 555-555-0100'),
+            ParsedCommand(command='Add', contact_name='John Smith', contact_detail='555-555-0100', detail_type='phone_number')
+        )
+        self.assertEqual(
+            self.parser.parse('Update Jane jane@example.com'),
+            ParsedCommand(command='Update', contact_name='Jane', contact_detail='jane@example.com', detail_type='email')
+        )
+
+    def test_add_without_name_has_no_contact(self):
+        self.assertEqual(self.parser.parse('Add 5555550100'), ParsedCommand(command='Add', detail_type='phone_number'))
+
+    def test_remove_extracts_the_whole_name(self):
+        self.assertEqual(self.parser.parse('Remove John Smith'), ParsedCommand(command='Remove', contact_name='John Smith'))
+
+    def test_bounded_indel_distance_stops_past_the_bound(self):
+        self.assertEqual(CommandParser.bounded_indel_distance('update', 'updte', 1), 1)
+        self.assertEqual(CommandParser.bounded_indel_distance('update', 'remove', 2), 3)
+
+
+REPLY_FORM_HTML = """
+<form method="post" action="NewMessage.aspx">
+    <input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="viewstate" />
+    <input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="validation" />
+    <input type="text" name="ctl00$mainContentPlaceHolder$subjectTextBox" id="ctl00_mainContentPlaceHolder_subjectTextBox" value="RE: Hello" />
+    <textarea name="ctl00$mainContentPlaceHolder$messageTextBox" id="ctl00_mainContentPlaceHolder_messageTextBox">Quoted</textarea>
+    <select name="ctl00$mainContentPlaceHolder$folder"><option value="inbox">Inbox</option><option value="sent" selected>Sent</option></select>
+    <input type="checkbox" name="ctl00$mainContentPlaceHolder$copy" value="on" />
+    <input type="checkbox" name="ctl00$mainContentPlaceHolder$notify" value="on" checked />
+    <input type="submit" name="ctl00$mainContentPlaceHolder$cancelButton" id="ctl00_mainContentPlaceHolder_cancelButton" value="Cancel" />
+    <input type="submit" name="ctl00$mainContentPlaceHolder$sendMessageButton" id="ctl00_mainContentPlaceHolder_sendMessageButton" value="Send" />
+    <a id="ctl00_mainContentPlaceHolder_addressBox_addressTextBox" href="javascript:__doPostBack('ctl00$mainContentPlaceHolder$addressBox$addressTextBox','')">To</a>
+</form>
+"""
+
+
+class BuildPostbackFieldsTests(SimpleTestCase):
+    """
+    Covers how `build_postback_fields` rebuilds the fields a browser would post for an ASP.NET form.
+    """
+
+    def setUp(self):
+        self.parser = LexborHTMLParser(REPLY_FORM_HTML)
+
+    def test_submit_button_posts_the_form_state_and_the_entered_values(self):
+        fields = build_postback_fields(self.parser, SEND_MESSAGE_BUTTON_ID, {MESSAGE_TEXT_BOX_ID: 'Reply'})
+        self.assertEqual(fields, {
+            '__VIEWSTATE': 'viewstate',
+            '__EVENTVALIDATION': 'validation',
+            'ctl00$mainContentPlaceHolder$subjectTextBox': 'RE: Hello',
+            'ctl00$mainContentPlaceHolder$messageTextBox': 'Reply',
+            'ctl00$mainContentPlaceHolder$folder': 'sent',
+            'ctl00$mainContentPlaceHolder$notify': 'on',
+            'ctl00$mainContentPlaceHolder$sendMessageButton': 'Send',
+        })
+
+    def test_do_postback_element_is_posted_as_event_target(self):
+        fields = build_postback_fields(self.parser, ADDRESS_TEXT_BOX_ID, {}, extra_fields={'row$check': 'on'})
+        self.assertEqual(fields['__EVENTTARGET'], 'ctl00$mainContentPlaceHolder$addressBox$addressTextBox')
+        self.assertEqual(fields['__EVENTARGUMENT'], '')
+        self.assertEqual(fields['row$check'], 'on')
+        self.assertNotIn('ctl00$mainContentPlaceHolder$sendMessageButton', fields)
+
+    def test_missing_button_or_field_returns_none(self):
+        self.assertIsNone(build_postback_fields(self.parser, 'missingButton', {}))
+        self.assertIsNone(build_postback_fields(self.parser, SEND_MESSAGE_BUTTON_ID, {'missingTextBox': 'Reply'}))
+
+    def test_button_without_name_or_postback_returns_none(self):
+        parser = LexborHTMLParser('<form><input type="hidden" name="__VIEWSTATE" value="v" /><button id="sendButton">Send</button></form>')
+        self.assertIsNone(build_postback_fields(parser, 'sendButton', {}))
+
+
+ADDRESS_BOOK_HTML = """
+<table id="ctl00_mainContentPlaceHolder_addressBox_addressGrid">
+    <tr><th></th><th>Name</th></tr>
+    <tr><td><input type="checkbox" name="row1$check" /></td><td>SMITH, JANE</td></tr>
+    <tr><td></td><td>DOE, JOHN (no checkbox)</td></tr>
+    <tr><td><input type="checkbox" name="row3$check" /></td><td>DOE, JOHN</td></tr>
+</table>
+"""
+
+
+class RecipientCheckboxTests(SimpleTestCase):
+    """
+    Covers how the address book row of a contact is found for the postback new message sender.
+    """
+
+    def setUp(self):
+        self.parser = LexborHTMLParser(ADDRESS_BOOK_HTML)
+
+    def test_finds_the_checkbox_of_the_contact(self):
+        self.assertEqual(get_recipient_checkbox(self.parser, 'SMITH, JANE').attributes['name'], 'row1$check')
+
+    def test_skips_rows_without_a_checkbox(self):
+        self.assertEqual(get_recipient_checkbox(self.parser, 'DOE, JOHN').attributes['name'], 'row3$check')
+
+    def test_header_row_and_unknown_contacts_are_not_matched(self):
+        self.assertIsNone(get_recipient_checkbox(self.parser, 'Name'))
+        self.assertIsNone(get_recipient_checkbox(self.parser, 'ROE, RICHARD'))
+
+    def test_is_recipient_row_reads_the_name_cell(self):
+        rows = self.parser.css('tr')
+        self.assertTrue(is_recipient_row(rows[1], 'SMITH, JANE'))
+        self.assertFalse(is_recipient_row(rows[1], 'row1'))
+        self.assertFalse(is_recipient_row(LexborHTMLParser('<table><tr><td>SMITH, JANE</td></tr></table>').css_first('tr'), 'SMITH, JANE'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CELERY_ENABLED=False)
+class SaveEmailsTests(TestCase):
+    """
+    Covers how `save_emails` stores a pulled batch when some of its emails cannot be saved.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bot = BotAccount.objects.create(bot_name='bot1', email_address='bot1@example.com')
+        cls.user = User.objects.create(user_name='user1', name='User 1', pic_number='00000001')
+
+    def build_email(self, message_id, subject='Hello', body='Body'):
+        return {
+            'user_id': self.user, 'message_id': message_id, 'sent_datetime': '01/02/2026 10:00:00 AM',
+            'subject': subject, 'body': body, 'bot_id': self.bot.id
+        }
+
+    @patch('process_emails.utils.EmailProcessingHandler')
+    def test_bad_email_does_not_drop_the_batch(self, _):
+        saved_message_ids = save_emails([self.build_email('1'), self.build_email('2', body=None), self.build_email('3')])
+
+        self.assertEqual(saved_message_ids, ['1', '3'])
+        self.assertEqual(sorted(Email.objects.values_list('message_id', flat=True)), ['1', '3'])
+
+    @patch('process_emails.utils.EmailProcessingHandler')
+    def test_failed_bulk_insert_falls_back_to_single_inserts(self, _):
+        original_bulk_create = Email.objects.bulk_create
+
+        def bulk_create(email_objects, **kwargs):
+            if len(email_objects) > 1 or email_objects[0].message_id == '2':
+                raise DataError('value too long')
+            return original_bulk_create(email_objects, **kwargs)
+
+        with patch.object(Email.objects, 'bulk_create', side_effect=bulk_create):
+            saved_message_ids = save_emails([self.build_email('1'), self.build_email('2'), self.build_email('3')])
+
+        self.assertEqual(saved_message_ids, ['1', '3'])
+        self.assertEqual(sorted(Email.objects.values_list('message_id', flat=True)), ['1', '3'])
+
+    @patch('process_emails.utils.EmailProcessingHandler')
+    def test_long_subject_is_truncated(self, _):
+        save_emails([self.build_email('1', subject='x' * 150)])
+
+        self.assertEqual(Email.objects.get().subject, 'x' * Email._meta.get_field('subject').max_length)
+
+    @patch('process_emails.utils.EmailProcessingHandler')
+    def test_already_stored_emails_count_as_saved(self, _):
+        save_emails([self.build_email('1')])
+
+        self.assertEqual(save_emails([self.build_email('1'), self.build_email('2')]), ['1', '2'])
+        self.assertEqual(Email.objects.count(), 2)
@@ -7,8 +7,11 @@ from process_emails.email_processing_service import EmailProcessingHandler
 from core.models import ResponseMessages
 
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
 from datetime import datetime, timedelta
+from itertools import groupby
 import logging
 import pytz
 import json
@@ -18,14 +21,14 @@ pull_email_logger = logging.getLogger('pull_email')
 
 def convert_string_to_valid_datetime(datetime_string=None, timezone=settings.TIME_ZONE):
     """
-    Converts a string representation of a datetime to a formatted string with timezone information.
+    Converts a string representation of a datetime to a timezone aware datetime.
 
     Args:
         datetime_string (str, optional): The datetime string to convert, formatted as "%m/%d/%Y %I:%M:%S %p".
         timezone (str, optional): The timezone to localize the datetime to. Defaults to the timezone specified in settings.
 
     Returns:
-        str: The formatted datetime string with timezone information, or None if the input is invalid.
+        datetime: The timezone aware datetime, or None if the input is invalid.
 
     Logs:
         - Error if `datetime_string` is `None`.
@@ -41,45 +44,121 @@ def convert_string_to_valid_datetime(datetime_string=None, timezone=settings.TIM
         return None
 
     local_tz = pytz.timezone(timezone)
-    aware_datetime = local_tz.localize(parsed_datetime)
+    return local_tz.localize(parsed_datetime)
 
-    formatted_date = aware_datetime.strftime("%Y-%m-%d %H:%M:%S %z")
+def get_ingested_message_ids(bot_id=None, message_ids=None):
+    """
+    Finds which of the given Corrlinks message IDs are already stored for a bot, using a single query.
+
+    Args:
+        bot_id (int, optional): The ID of the bot the emails were pulled by.
+        message_ids (list of str, optional): The message IDs found on the inbox page.
+
+    Returns:
+        set: The message IDs from `message_ids` that already exist in the `Email` table for the bot.
+    """
+    if not message_ids:
+        return set()
 
-    return formatted_date
+    return set(
+        Email.objects.filter(bot_id=bot_id, message_id__in=message_ids).values_list('message_id', flat=True)
+    )
+
+def update_last_read_message_id(bot_id=None, message_ids=None):
+    """
+    Moves the high-water mark of a bot (`BotAccount.last_read_message_id`) to the newest of the given message IDs.
+    The mark only ever moves forward.
+
+    Args:
+        bot_id (int, optional): The ID of the bot the emails were pulled by.
+        message_ids (list of str, optional): The message IDs that were just ingested.
+
+    Returns:
+        str: The new high-water mark, or None if it was not changed.
+    """
+    numeric_ids = [int(message_id) for message_id in message_ids or [] if message_id and message_id.isdigit()]
+    if bot_id is None or not numeric_ids:
+        return None
+
+    newest_message_id = max(numeric_ids)
+    bot_obj = BotAccount.objects.filter(id=bot_id).only('last_read_message_id').first()
+    if not bot_obj:
+        return None
+
+    last_read_message_id = bot_obj.last_read_message_id
+    if last_read_message_id and last_read_message_id.isdigit() and int(last_read_message_id) >= newest_message_id:
+        return None
+
+    BotAccount.objects.filter(id=bot_id).update(last_read_message_id=str(newest_message_id))
+    return str(newest_message_id)
 
 def save_emails(emails_to_save=None):
     """
-    Saves a list of email records to the database.
+    Saves a list of email records to the database in bulk.
+
+    All emails are inserted with a single `bulk_create` inside one transaction. Emails that are already
+    stored for the same bot and message ID are skipped by the (bot, message_id) unique constraint,
+    so saving the same inbox page twice does not create duplicates. If the bulk insert fails, the emails
+    are inserted one by one, so a single bad email does not hold back the rest of the pull. Subjects
+    longer than the `subject` column are truncated.
 
     Args:
         emails_to_save (list of dicts, optional): List of dictionaries, each containing email details to be saved.
             Each dictionary must have the following keys: 'user_id', 'message_id', 'sent_datetime', 'subject', 'body', 'bot_id'.
 
+    Returns:
+        list: The message IDs of the emails that are stored, including the ones that already were.
+
     Logs:
         - Error if `emails_to_save` is `None`.
-        - Error if there is an exception while saving an email to the database.
+        - Error if the sent date of an email cannot be parsed. That email is skipped.
+        - Error for every email that could not be saved to the database.
     """
     if emails_to_save is None:
         pull_email_logger.error('emails_to_save cannot be empty.')
         return None
 
+    bot_ids = {email['bot_id'] for email in emails_to_save if email['bot_id'] is not None}
+    bots_by_id = BotAccount.objects.in_bulk(bot_ids)
+    subject_max_length = Email._meta.get_field('subject').max_length
+
     bot_id = None  # Variable to hold the bot_id
+    email_objects = []
 
     for email in emails_to_save:
-        try:
-            bot_obj = BotAccount.objects.filter(id=email['bot_id']).first()
-            if bot_obj:  # Extract bot_id from the first valid email
-                bot_id = email['bot_id']
-            Email.objects.create(
-                user=email['user_id'],
-                message_id=email['message_id'],
-                sent_date_time=convert_string_to_valid_datetime(email['sent_datetime']),
-                subject=email['subject'],
-                body=email['body'],
-                bot=bot_obj
-            )
-        except Exception as e:
-            pull_email_logger.error(f'Error occurred while saving Email to database: {email} {e}')
+        bot_obj = bots_by_id.get(email['bot_id'])
+        if bot_obj:  # Extract bot_id from the first valid email
+            bot_id = email['bot_id']
+
+        sent_date_time = convert_string_to_valid_datetime(email['sent_datetime'])
+        if sent_date_time is None:
+            pull_email_logger.error(f'Skipping email with invalid sent date: {email}')
+            continue
+
+        subject = email['subject'] or ''
+        if len(subject) > subject_max_length:
+            pull_email_logger.warning(f"Truncating the subject of email {email['message_id']} to {subject_max_length} characters.")
+            subject = subject[:subject_max_length]
+
+        email_objects.append(Email(
+            user=email['user_id'],
+            message_id=email['message_id'],
+            sent_date_time=sent_date_time,
+            subject=subject,
+            body=email['body'],
+            bot=bot_obj
+        ))
+
+    try:
+        with transaction.atomic():
+            Email.objects.bulk_create(email_objects, ignore_conflicts=True)
+    except Exception as e:
+        pull_email_logger.warning(f'Could not save {len(email_objects)} emails at once, saving them one by one. Error = {e}')
+        save_emails_one_by_one(email_objects)
+
+    # Read back what is stored, as ignored conflicts and failed rows are not reported by the inserts
+    stored_message_ids = get_ingested_message_ids(bot_id=bot_id, message_ids=[email_obj.message_id for email_obj in email_objects])
+    saved_message_ids = [email_obj.message_id for email_obj in email_objects if email_obj.message_id in stored_message_ids]
 
     # After saving all emails, run contact management to add, update, and remove contacts
     if bot_id is not None:  # Ensure bot_id is available before passing to EmailProcessingHandler
@@ -90,6 +169,22 @@ def save_emails(emails_to_save=None):
     else:
         pull_email_logger.error('No valid bot_id found in emails_to_save.')
 
+    return saved_message_ids
+
+def save_emails_one_by_one(email_objects):
+    """
+    Inserts emails one at a time, each in its own savepoint, logging the ones that fail.
+
+    Args:
+        email_objects (list of Email): The unsaved emails.
+    """
+    for email_obj in email_objects:
+        try:
+            with transaction.atomic():
+                Email.objects.bulk_create([email_obj], ignore_conflicts=True)
+        except Exception as e:
+            pull_email_logger.error(f'Error occurred while saving email {email_obj.message_id} of bot = {email_obj.bot_id} to database: {e}')
+
 
 def convert_cookies_to_splash_format(splash_cookies=None, cookies=None):
     """
@@ -127,52 +222,81 @@ def convert_cookies_to_splash_format(splash_cookies=None, cookies=None):
 
 def get_messages_to_send_from_database(message_id_content=[], bot_id=None):
     """
-    Retrieves unprocessed SMS messages from the database and collects corresponding email data.
+    Retrieves unprocessed SMS replies from the database, coalesced into one reply per email.
 
     Args:
-        message_id_content (list of lists, optional): A list to which SMS message details will be appended.
-            Each entry in the list will be a sublist containing SMS ID, email message ID, and the SMS message content.
+        message_id_content (list of lists, optional): A list to which the replies will be appended.
+            Each entry in the list will be a sublist containing the SMS IDs, the email message ID, and the reply content.
 
     Returns:
-        list of lists: Updated `message_id_content` with details of unprocessed SMS messages and corresponding email data.
+        list of lists: Updated `message_id_content` with one entry per email that received SMS replies.
 
     Notes:
-        - Filters for SMS messages that are inbound and have not been processed.
-        - For each unprocessed SMS, retrieves the associated email object to get the message ID.
-        - Appends a list containing SMS ID, email message ID, and message content to `message_id_content` for each unprocessed SMS.
+        - Filters for SMS messages that are inbound and have not been processed, with their emails in one query.
+        - The replies to the same email are joined into one reply by `coalesce_sms_replies`, so a contact sending
+          several texts in a row costs one Corrlinks reply instead of one per text.
     """
-    bot_obj = BotAccount.objects.filter(id=bot_id).first()
-    unprocessed_sms_objects = SMS.objects.filter(is_processed=False, direction='Inbound', bot=bot_obj).all()
-    if unprocessed_sms_objects:
-        for unprocessed_sms in unprocessed_sms_objects:
-            email_obj = Email.objects.filter(id=unprocessed_sms.email.id, bot=bot_obj).first()
-            if email_obj:
-                message_id_content.append([unprocessed_sms.id, email_obj.message_id, unprocessed_sms.message])
+    unprocessed_sms_objects = SMS.objects.filter(
+        is_processed=False, direction='Inbound', bot_id=bot_id, email__bot_id=bot_id
+    ).select_related('email').order_by('email_id', 'created_at', 'id')
+
+    for _, sms_group in groupby(unprocessed_sms_objects, key=lambda sms: sms.email_id):
+        sms_group = list(sms_group)
+        for sms_ids, message_content in coalesce_sms_replies(sms_group):
+            message_id_content.append([sms_ids, sms_group[0].email.message_id, message_content])
     return message_id_content
 
 
-def update_sms_processed_value(sms_id=None):
+def coalesce_sms_replies(sms_replies, max_length=None):
     """
-    Updates the `is_processed` flag of a specific SMS record to `True` in the database.
+    Joins the SMS replies to one email into as few reply bodies as possible.
+
+    Every reply is prefixed with the time it was received. A body never grows beyond `max_length`,
+    the replies that do not fit start the next body. A single reply is returned unchanged.
 
     Args:
-        sms_id (int, optional): The ID of the SMS record to update.
+        sms_replies (list): The inbound `SMS` to the same email, oldest first.
+        max_length (int, optional): The maximum length of a body. Defaults to `CORRLINKS_REPLY_MAX_LENGTH`.
 
     Returns:
-        bool: `True` if the SMS record was found and updated successfully, otherwise `False`.
+        list of tuples: The IDs of the joined SMS and the reply body, for every body.
+    """
+    if len(sms_replies) == 1:
+        return [([sms_replies[0].id], sms_replies[0].message)]
+
+    max_length = max_length or settings.CORRLINKS_REPLY_MAX_LENGTH
+    separator = '\n\n'
+
+    bodies = []
+    sms_ids, parts = [], []
+    for sms in sms_replies:
+        part = f"[{sms.created_at.strftime('%m/%d/%Y %I:%M %p')}] {sms.message}"
+        if parts and len(separator.join(parts + [part])) > max_length:
+            bodies.append((sms_ids, separator.join(parts)))
+            sms_ids, parts = [], []
+        sms_ids.append(sms.id)
+        parts.append(part)
+    bodies.append((sms_ids, separator.join(parts)))
+    return bodies
+
+
+def update_sms_processed_value(sms_ids=None):
+    """
+    Updates the `is_processed` flag of the SMS records sent in one reply to `True` in the database.
+
+    Args:
+        sms_ids (list, optional): The IDs of the SMS records to update.
+
+    Returns:
+        bool: `True` if the SMS records were found and updated successfully, otherwise `False`.
 
     Notes:
-        - Retrieves the SMS object with the given `sms_id`.
-        - Sets the `is_processed` attribute of the SMS object to `True` and saves the changes.
+        - All records are updated with one query.
     """
-    sms_object = SMS.objects.filter(id=int(sms_id)).first()
-    if sms_object:
-        sms_object.is_processed = True
-        sms_object.save()
-
-        return True
+    if not sms_ids:
+        return False
 
-    return False
+    return SMS.objects.filter(id__in=sms_ids).update(is_processed=True, updated_at=timezone.now()) > 0
 
 
 def transform_name(name):
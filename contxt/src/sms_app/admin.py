@@ -1,5 +1,5 @@
 from django.contrib import admin
-from sms_app.models import SMS
+from sms_app.models import SMS, OutboundSMS, SMSStatusCheck
 
 class SMSAdmin(admin.ModelAdmin):
     # Fields to be displayed in the list view
@@ -65,3 +65,22 @@ class SMSAdmin(admin.ModelAdmin):
         return self.readonly_fields
 
 admin.site.register(SMS, SMSAdmin)
+
+
+class OutboundSMSAdmin(admin.ModelAdmin):
+    list_display = ('id', 'bot', 'email', 'contact', 'phone_number', 'status', 'attempts', 'lease_expires_at', 'created_at', 'updated_at')
+    list_filter = ('status', 'bot', 'created_at')
+    search_fields = ('phone_number', 'message', 'email__message_id')
+    readonly_fields = ('sms', 'attempts', 'lease_expires_at', 'last_error', 'created_at', 'updated_at')
+    ordering = ('-created_at',)
+
+admin.site.register(OutboundSMS, OutboundSMSAdmin)
+
+
+class SMSStatusCheckAdmin(admin.ModelAdmin):
+    list_display = ('sms', 'retry_count', 'check_count', 'textbelt_status', 'error', 'next_check_delay', 'created_at')
+    list_filter = ('textbelt_status', 'created_at')
+    search_fields = ('sms__text_id', 'sms__phone_number')
+    ordering = ('-created_at',)
+
+admin.site.register(SMSStatusCheck, SMSStatusCheckAdmin)
@@ -0,0 +1,59 @@
+from sms_app.sms_router import SMSRouter, StubSMSProvider, SMS_PROVIDER_HEALTH_KEY
+from contxt.utils.helper_functions import get_redis_client
+
+from django.core.management.base import BaseCommand, CommandError
+
+from collections import Counter
+import logging
+import requests
+import time
+
+
+class Command(BaseCommand):
+    """
+    Routes messages between local stub providers to test and benchmark `SMSRouter` offline.
+
+    Every provider is given as name:latency:failure_rate, e.g. `--providers fast:0.02:0 slow:0.2:0 flaky:0.01:0.5`.
+    Nothing is sent and nothing is stored, only the health of the stub providers is kept in Redis while
+    the benchmark runs. The report shows how many messages every provider handled, how many failed and
+    how long the batch took.
+    """
+
+    help = 'Benchmark SMS routing and failover with local stub providers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--providers', nargs='+', default=['benchmark_fast:0.02:0', 'benchmark_slow:0.2:0', 'benchmark_flaky:0.01:0.5'],
+            help='The stub providers as name:latency:failure_rate, in order of preference.')
+        parser.add_argument('--messages', type=int, default=200, help='The number of messages to route.')
+
+    def handle(self, *args, **kwargs):
+        providers = []
+        for provider in kwargs['providers']:
+            try:
+                name, latency, failure_rate = provider.split(':')
+                providers.append(StubSMSProvider(name=name, latency=float(latency), failure_rate=float(failure_rate)))
+            except ValueError:
+                raise CommandError(f'Invalid provider "{provider}", expected name:latency:failure_rate.')
+
+        redis_client = get_redis_client()
+        redis_client.delete(*[SMS_PROVIDER_HEALTH_KEY.format(provider.name) for provider in providers])
+
+        router = SMSRouter(providers)
+        # The stub providers have no quota, so routing never depends on the real Textbelt quota here
+        messages = [(f'555000{i:04d}', 'Benchmark message') for i in range(kwargs['messages'])]
+
+        start = time.perf_counter()
+        results = router.send_many(messages, logger=logging.getLogger('send_sms'))
+        elapsed = time.perf_counter() - start
+
+        handled = Counter(provider_name for provider_name, result in results)
+        failed = Counter(provider_name for provider_name, result in results if isinstance(result, requests.RequestException))
+
+        self.stdout.write(f'Messages: {len(messages)} in {elapsed:.2f}s ({len(messages) / elapsed:,.0f} messages/s)')
+        for provider_name, health in router.get_health().items():
+            self.stdout.write(
+                f'{provider_name}: handled {handled[provider_name]}, failed {failed[provider_name]}, '
+                f'latency {health["latency"] * 1000:.0f}ms, error rate {health["error_rate"]:.2f}'
+            )
+
+        redis_client.delete(*[SMS_PROVIDER_HEALTH_KEY.format(provider.name) for provider in providers])
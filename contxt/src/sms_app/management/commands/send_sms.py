@@ -3,15 +3,22 @@ from process_emails.models import Email
 from core.models import Contact
 from sms_app.models import SMS
 from accounts.models import User, BotAccount
-from sms_app.utils import get_to_number_from_message_subject, log_sms_to_database, generate_webhook_token
-from sms_app.tasks import send_quota_limit_reached_email_task
+from core.utils import get_or_create_contacts
+from sms_app.quota_service import get_remaining_quota, record_quota_remaining, invalidate_quota, reserve_quota_notification
+from sms_app.sms_service import get_status_check_delay
+from sms_app.send_keys import build_send_key, reserve_send_key, complete_send_key, release_send_key
+from sms_app.sms_router import get_sms_router, is_connect_failure
+from sms_app.textbelt_client import get_textbelt_client
+from sms_app.utils import get_to_number_from_message_subject, log_sms_to_database
+from sms_app.queue_service import enqueue_outbound_sms
+from sms_app.tasks import send_quota_limit_reached_email_task, check_sms_status_task, dispatch_outbound_sms_task
 from contxt.utils.constants import SMS_DIRECTION_CHOICES, SMS_STATUS_CHOICES, CURRENT_TASKS_RUN_BY_BOTS
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from django.core.management import call_command
 
 import logging
+import math
 import requests
 import time
 
@@ -39,28 +46,34 @@ class Command(BaseCommand):
         logger.info("Starting SMS processing")
         logger.info(f'Send sms got bot id = {bot_id} ')
 
-        quota = self.check_quota(settings.API_KEY, logger=sms_quota_logger)
+        # The quota is cached in Redis and kept up to date by the send responses, see quota_service.
+        quota = get_remaining_quota(logger=sms_quota_logger)
         if quota is not None:
             sms_quota_logger.info(f"Current SMS quota: {quota}")
             if quota == 0 or quota == 100:
-                send_quota_limit_reached_email_task.delay(quota)
-            else:
-                logger.info(f"SMS sending process Started for bot = {bot_id}")
+                if reserve_quota_notification(quota):
+                    send_quota_limit_reached_email_task.delay(quota)
+        else:
+            sms_quota_logger.error('Error occured while getting quota value from textbelt.')
 
-                self.send_sms(logger=logger, sms_quota_logger=sms_quota_logger, bot_id=bot_id)
+        # Messages are routed to the other providers while Textbelt is out of quota, see sms_router.
+        if get_sms_router().has_available_provider(logger=sms_quota_logger):
+            logger.info(f"SMS sending process Started for bot = {bot_id}")
 
-                logger.info("SMS processing completed")
+            self.send_sms(logger=logger, sms_quota_logger=sms_quota_logger, bot_id=bot_id)
+
+            logger.info("SMS processing completed")
         else:
-            sms_quota_logger.error('Error occured while getting quota value from textbelt. Skipping execution of send sms.')
+            sms_quota_logger.error('No SMS provider has quota left. Skipping execution of send sms.')
 
     def send_sms(self, user_id=None, contact_id=None, to_number=None, message_body=None, message_id=None, logger=None, sms_quota_logger=None, bot_id=None):
         if user_id and contact_id:
             logger.debug(f"Starting SMS send process for user_id: {user_id}, contact_id: {contact_id}")
 
         if settings.TEST_MODE:
+            textbelt_client = get_textbelt_client()
             to_number = to_number or settings.TEST_TO_NUMBER
             message_body = message_body or settings.TEST_MESSAGE_BODY
-            key = settings.API_KEY
             user_id = user_id or settings.TEST_USER_ID
 
             user_obj = User.objects.filter(pic_number=user_id).first()
@@ -71,269 +84,163 @@ class Command(BaseCommand):
                 logger.error('No contacts found in the database. Please run seeders to ensure there is at least one contact available for testing.')
             email = Email.objects.filter(user=user_obj).first()
 
-            payload = {
-                'phone': to_number,
-                'message': message_body,
-                'key': key,
-                'replyWebhookUrl': settings.REPLY_WEBHOOK_URL,
-                'webhookData' : generate_webhook_token({"timestamp": int(time.time())})
-            }
-            try:
-                response = requests.post(settings.SMS_SEND_URL, data=payload)
-                result = response.json()
-
-                if result.get('success'):
-                    text_id = result.get('textId')
-                    quota_remaining = result.get('quotaRemaining')
-
-                    logger.info(f"Message sent successfully. Quota remaining: {quota_remaining}. Text ID: {text_id}")
-                    sms_quota_logger.debug(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Quota remaining: {quota_remaining}\n")
-
-                    try:
-                        log_sms_to_database(contact_id=contact_id, message_body=message_body, text_id=text_id, to_number=to_number, \
-                            direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Sent'], is_processed=True, email=email)
-                        self.check_sms_status(text_id, user_id, message_id, message_body, to_number, contact_id, email=email, logger=logger, sms_quota_logger=sms_quota_logger, bot=None)
-                    except Exception as e:
-                        logger.error(f'Error occured while logging sms to DB. {e}')
-
-                else:
-                    error = result.get('error')
-                    logger.error(f"Failed to send message. Error: {error}")
-                    try:
-                        log_sms_to_database(contact_id=contact_id, message_body=message_body, text_id=None, to_number=to_number,
-                            direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Failed'], is_processed=True, email=email)
-
-                        email.is_processed = True
-                        email.save()
-                    except Exception as e:
-                        logger.error(f'Error occured while logging sms to DB. {e}')
-            except Exception as e:
-                logger.error(f"Request failed: {str(e)}")
+            send_key = None
+            if email and contact_id:
+                send_key = build_send_key(email.id, contact_id)
+                reserved, text_id, _ = reserve_send_key(send_key)
+                if not reserved:
+                    self.handle_duplicate_send(text_id, contact_id=contact_id, message_body=message_body, to_number=to_number, email=email, bot=None, logger=logger)
+                    return
+
+            result = textbelt_client.send_many([(to_number, message_body)], logger=logger)[0]
+            self.handle_send_result(result, contact_id=contact_id, message_body=message_body, to_number=to_number, email=email, bot=None,
+                logger=logger, sms_quota_logger=sms_quota_logger, send_key=send_key)
         else:
-            key = settings.API_KEY
-
             bot_obj = None
             if bot_id:
                 bot_obj = BotAccount.objects.filter(id=bot_id).first()
 
-            unprocessed_emails = Email.objects.filter(is_processed=False, bot=bot_obj).all()
+            unprocessed_emails = Email.objects.filter(is_processed=False, bot=bot_obj).select_related('user')
 
+            # The numbers of all emails are read first, so their contacts are resolved with one query and one insert.
+            # The messages are then queued and sent by `dispatch_outbound_sms_task`.
+            email_numbers = []
             for email in unprocessed_emails:
-                user_id = email.user_id
-                message_body = email.body
-                subject = email.subject
-
-                to_number = get_to_number_from_message_subject(subject)
-
-                contact = Contact.objects.filter(user_id=user_id, phone_number=to_number).first()
-                if not contact and to_number:
-                    contact, created = Contact.objects.update_or_create(
-                        email = f'{email.user.user_name}@gmail.com',
-                        defaults={
-                            'user': email.user,
-                            'contact_name': f'{email.user.user_name}_{to_number}',
-                            'phone_number' : to_number
-                        }
-                    )
-                elif not to_number:
-                    logger.error(f'Got an invalid number {subject}.')
-                    contact = None
-
-                if contact:
-                    contact_id = contact.id
-                    contact_name = contact.contact_name
-                    to_number = contact.phone_number
-                    logger.debug(f"Contact details: ID={contact_id}, Name={contact_name}, Number={to_number}")
-
-                    payload = {
-                        'phone': to_number,
-                        'message': message_body,
-                        'key': key,
-                        'replyWebhookUrl': settings.REPLY_WEBHOOK_URL,
-                        'webhookData' : generate_webhook_token({"timestamp": int(time.time())})
-                    }
-
-                    try:
-                        response = requests.post(settings.SMS_SEND_URL, data=payload)
-                        result = response.json()
-
-                        if result.get('success'):
-                            text_id = result.get('textId')
-                            quota_remaining = result.get('quotaRemaining')
-
-                            logger.info(f"Message sent successfully. Quota remaining: {quota_remaining}. Text ID: {text_id}")
-                            sms_quota_logger.debug(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Quota remaining: {quota_remaining}\n")
-
-                            try:
-                                log_sms_to_database(contact_id=contact_id, message_body=message_body, text_id=text_id, to_number=to_number, \
-                                    direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Sent'], is_processed=True, email=email, bot=bot_obj)
-                                self.check_sms_status(text_id, user_id, message_id, message_body, to_number, contact_id, email=email, logger=logger, sms_quota_logger=sms_quota_logger, bot=bot_obj)
-                            except Exception as e:
-                                logger.error(f'Error occured while logging sms to DB. {e}')
-                        else:
-                            error = result.get('error')
-                            logger.error(f"Failed to send message. Error: {error}")
-                            try:
-                                log_sms_to_database(contact_id=contact_id, message_body=message_body, text_id=None, to_number=to_number, \
-                                    direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Failed'], is_processed=True, email=email, bot=bot_obj)
-
-                                email.is_processed = True
-                                email.save()
-                            except Exception as e:
-                                logger.error(f'Error occured while logging sms to DB. {e}')
-                    except requests.RequestException as e:
-                        logger.error(f"Request failed: {str(e)}")
+                to_number = get_to_number_from_message_subject(email.subject)
+                if to_number:
+                    email_numbers.append((email, to_number))
                 else:
-                    logger.error(f'No contact found in database for number {to_number}. Also the number might be invalid so skipping saving it in database or sending sms')
+                    logger.error(f'Got an invalid number {email.subject}. Skipping saving it in database or sending sms')
 
-    def check_sms_status(self, text_id, user_id, message_id, message_body, to_number, contact_id, retry_count=0, email=None, logger=None, sms_quota_logger=None, bot=None):
-        try:
-            '''
-            This currently has to be executed with delay because on textbelt side, the status of SMS is updated with delay.
-            For example a SMS maybe delievered successfuly but their api still return SENT instead of DELIVERED.
-            '''
-            response = None
-            for retry in range(settings.MAX_SMS_RETRIES):
-                time.sleep(settings.SMS_RETRY_DELAY)
-                response = requests.get(settings.SMS_STATUS_URL.format(text_id))
-                response.raise_for_status()
-
-                result = response.json()
-                if result.get('status') == "DELIVERED":
-                    break
-
-            status = result.get('status')
-
-            logger.debug(f"SMS {text_id} status check: {status}")
-
-            sms_obj = SMS.objects.filter(text_id=text_id, direction=SMS_DIRECTION_CHOICES_DICT['Outbound']).first()
-            if not sms_obj:
-                logger.error(f"SMS object with text_id {text_id} not found in database.")
-                return
+            contacts = get_or_create_contacts([(email.user, to_number) for email, to_number in email_numbers])
 
-            if status == "DELIVERED":
-                sms_obj.status = SMS_STATUS_CHOICES_DICT['Delivered']
-                sms_obj.save()
+            outgoing_messages = []
+            for email, to_number in email_numbers:
+                contact = contacts[(email.user_id, to_number)]
+                logger.debug(f"Contact details: ID={contact.id}, Name={contact.contact_name}, Number={contact.phone_number}")
+                outgoing_messages.append({'email': email, 'contact': contact, 'message_body': email.body})
 
-                email.is_processed = True
-                email.save()
+            queued_count = enqueue_outbound_sms(outgoing_messages, bot=bot_obj)
+            logger.info(f"Queued {queued_count} SMS for sending.")
+            if not queued_count:
+                return
 
-                logger.info(f"SMS {text_id} delivered successfully.")
+            if settings.CELERY_ENABLED:
+                for _ in range(min(settings.SMS_QUEUE_DISPATCHERS, math.ceil(queued_count / settings.SMS_QUEUE_BATCH_SIZE))):
+                    dispatch_outbound_sms_task.delay()
             else:
-                logger.warning(f"SMS {text_id} not delivered. Status: {status}")
-
-                if retry_count < settings.MAX_SMS_RETRIES:
-                    sms_obj.status = SMS_STATUS_CHOICES_DICT['Unknown']
-                    sms_obj.save()
-
-                    logger.info(f"Retrying SMS send. Attempt {retry_count + 1}")
-                    time.sleep(settings.SMS_RETRY_DELAY)
-
-                    # Attempt to resend the SMS
-                    new_text_id = self.resend_sms(user_id, contact_id, to_number, message_body, retry_count,email=email, logger=logger, sms_quota_logger=sms_quota_logger, bot=bot)
-
-                    if new_text_id:
-                        self.check_sms_status(new_text_id, user_id, message_id, message_body, to_number, contact_id, retry_count + 1, email=email, logger=logger, sms_quota_logger=sms_quota_logger, bot=bot)
-                else:
-                    sms_obj.status = SMS_STATUS_CHOICES_DICT['Failed']
-                    sms_obj.save()
-
-                    email.is_processed = True
-                    email.save()
-
-                    logger.error(f"SMS {text_id} failed after {settings.MAX_SMS_RETRIES} attempts.")
-                    self.send_failure_notification_email(user_id, to_number, email.message_id, logger=logger)
-
-        except requests.RequestException as e:
-            logger.warning(f"SMS {text_id} not delivered. Status: {status}")
-
-            if retry_count < settings.MAX_SMS_RETRIES:
-                sms_obj.status = SMS_STATUS_CHOICES_DICT['Unknown']
-                sms_obj.save()
+                dispatch_outbound_sms_task()
+
+    def handle_send_result(self, result, contact_id, message_body, to_number, email, bot, logger, sms_quota_logger, send_key=None):
+        """
+        Stores the outcome of a single send and schedules the delivery status check of a sent message.
+
+        Args:
+            result (dict or None or requests.RequestException): The result returned by `TextbeltClient.send_many`.
+            contact_id (int): The ID of the contact the message was sent to.
+            message_body (str): The content of the message.
+            to_number (str): The phone number the message was sent to.
+            email (Email): The email the message was sent for.
+            bot (BotAccount): The bot that sent the message, optional.
+            logger (logging.Logger): The logger instance for logging the result.
+            sms_quota_logger (logging.Logger): The logger instance for logging the remaining quota.
+            send_key (str, optional): The reserved send key of the message.
+        """
+        if result is None:
+            logger.warning(f"SMS to {to_number} not sent, no send slot was free within {settings.SMS_RATE_LIMIT_MAX_WAIT} seconds. It will be sent on the next run.")
+            if send_key:
+                release_send_key(send_key)
+            return
+        if isinstance(result, requests.RequestException):
+            # Only a failed connection proves that Textbelt never got the message. For any other error the
+            # message may have been sent, so the key stays reserved until it expires.
+            if send_key and is_connect_failure(result):
+                release_send_key(send_key)
+            return
+
+        if result.get('success'):
+            text_id = result.get('textId')
+            quota_remaining = result.get('quotaRemaining')
+            if send_key:
+                complete_send_key(send_key, text_id)
+
+            logger.info(f"Message sent successfully. Quota remaining: {quota_remaining}. Text ID: {text_id}")
+            sms_quota_logger.debug(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Quota remaining: {quota_remaining}\n")
+            record_quota_remaining(quota_remaining)
 
-                logger.info(f"Retrying SMS send. Attempt {retry_count + 1}")
-                time.sleep(settings.SMS_RETRY_DELAY)
-
-                # Attempt to resend the SMS
-                new_text_id = self.resend_sms(user_id, contact_id, to_number, message_body, retry_count,email=email, logger=logger, sms_quota_logger=sms_quota_logger, bot=bot)
-
-                if new_text_id:
-                    self.check_sms_status(new_text_id, user_id, message_id, message_body, to_number, contact_id, retry_count + 1, email=email, bot=bot, logger=logger, sms_quota_logger=sms_quota_logger)
-            else:
-                sms_obj.status = SMS_STATUS_CHOICES_DICT['Failed']
-                sms_obj.save()
+            try:
+                sms_obj = log_sms_to_database(contact_id=contact_id, message_body=message_body, text_id=text_id, to_number=to_number, \
+                    direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Sent'], is_processed=True, email=email, bot=bot)
+                self.schedule_status_check(sms_obj, email=email)
+            except Exception as e:
+                logger.error(f'Error occured while logging sms to DB. {e}')
+        else:
+            error = result.get('error')
+            logger.error(f"Failed to send message. Error: {error}")
+            # The cached quota may be wrong (e.g. out of quota), so the next run reads it from Textbelt again
+            invalidate_quota()
+            if send_key:
+                release_send_key(send_key)
+            try:
+                log_sms_to_database(contact_id=contact_id, message_body=message_body, text_id=None, to_number=to_number, \
+                    direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Failed'], is_processed=True, email=email, bot=bot)
 
                 email.is_processed = True
                 email.save()
-
-                logger.error(f"SMS {text_id} failed after {settings.MAX_SMS_RETRIES} attempts.")
-                self.send_failure_notification_email(user_id, to_number, email.message_id, logger=logger)
-
-        except Exception as e:
-            logger.error(f"An error occurred while checking status of the sent SMS {text_id}. Error = {e}")
-
-    def resend_sms(self, user_id, contact_id, to_number, message_body, retry_count, email, logger, sms_quota_logger, bot=None):
-        logger.info(f"Resending SMS. Retry Count: {retry_count}")
-
-        payload = {
-            'phone': to_number,
-            'message': message_body,
-            'key': settings.API_KEY,
-            'replyWebhookUrl': settings.REPLY_WEBHOOK_URL,
-            'webhookData' : generate_webhook_token({"timestamp": int(time.time())})
-        }
+            except Exception as e:
+                logger.error(f'Error occured while logging sms to DB. {e}')
+
+    def handle_duplicate_send(self, text_id, contact_id, message_body, to_number, email, bot, logger):
+        """
+        Handles an email whose send key is already reserved instead of sending it again.
+
+        If the earlier send was accepted by Textbelt but the worker stopped before storing it, the SMS
+        is stored now from the recorded text ID. If the earlier send is still in progress, or its outcome
+        is unknown, the email is left for a later run.
+
+        Args:
+            text_id (str): The Textbelt ID recorded for the earlier send, or None.
+            contact_id (int): The ID of the contact the message was sent to.
+            message_body (str): The content of the message.
+            to_number (str): The phone number the message was sent to.
+            email (Email): The email the message was sent for.
+            bot (BotAccount): The bot that sent the message, optional.
+            logger (logging.Logger): The logger instance for logging the result.
+        """
+        if not text_id:
+            logger.warning(f"SMS for email {email.id} to {to_number} is already being sent or its last send has an unknown outcome. Skipping it.")
+            return
+
+        logger.warning(f"SMS for email {email.id} to {to_number} was already sent with Text ID {text_id}. Not sending it again.")
+        sms_obj = SMS.objects.filter(text_id=text_id, direction=SMS_DIRECTION_CHOICES_DICT['Outbound']).first()
+        if sms_obj:
+            email.is_processed = True
+            email.save(update_fields=['is_processed', 'updated_at'])
+            return
 
         try:
-            response = requests.post(settings.SMS_SEND_URL, data=payload)
-            result = response.json()
-
-            if result.get('success'):
-                new_text_id = result.get('textId')
-                quota_remaining = result.get('quotaRemaining')
-
-                logger.info(f"Message resent successfully. New Text ID: {new_text_id}. Quota remaining: {quota_remaining}")
-                sms_quota_logger.debug(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Quota remaining: {quota_remaining}\n")
-
-                log_sms_to_database(contact_id=contact_id, message_body=message_body, text_id=new_text_id, to_number=to_number,
-                    direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Sent'], is_processed=True, email=email, bot=bot)
-
-                return new_text_id
-
-            else:
-                error = result.get('error')
-                logger.error(f"Failed to resend message. Error: {error}")
-                log_sms_to_database(contact_id=contact_id, message_body=message_body, text_id=None, to_number=to_number,
-                    direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Failed'], is_processed=True, email=email)
-                return None
-
-        except requests.RequestException as e:
-            logger.error(f"Resend request failed: {str(e)}")
-            return None
+            sms_obj = log_sms_to_database(contact_id=contact_id, message_body=message_body, text_id=text_id, to_number=to_number, \
+                direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Sent'], is_processed=True, email=email, bot=bot)
+            self.schedule_status_check(sms_obj, email=email)
+        except Exception as e:
+            logger.error(f'Error occured while logging sms to DB. {e}')
 
-    # TODO make this better
-    def send_failure_notification_email(self, user_id, to_number, message_id, logger):
-        subject = "SMS Delivery Failure Notification\n"
-        body = f"We were unable to deliver your SMS to {to_number}. Please try again later or contact support if the problem persists."
+    def schedule_status_check(self, sms_obj, email):
+        """
+        Marks the email as handled and schedules the first delivery status check of its SMS.
 
-        message_content = subject + body
+        Textbelt reports the delivery with a delay, so the status is checked by `check_sms_status_task`
+        after `get_status_check_delay(0)` seconds instead of waiting here. The email is marked as processed right
+        away, so the next run does not send it again while its delivery is still being tracked.
 
-        call_command('push_emails', message_id=message_id, message_content=message_content)
-        logger.info(f"Sent failure notification email to user {user_id}")
+        Args:
+            sms_obj (SMS): The outbound SMS that was accepted by Textbelt.
+            email (Email): The email the SMS was sent for.
+        """
+        email.is_processed = True
+        email.save(update_fields=['is_processed', 'updated_at'])
 
-    def check_quota(self, api_key, logger):
-        try:
-            response = requests.get(settings.SMS_QUOTA_URL.format(api_key))
-            result = response.json()
-            if result.get('success'):
-                quota_remaining = result.get('quotaRemaining')
-                logger.info(f"Quota remaining: {quota_remaining}")
-                return quota_remaining
-            else:
-                logger.error("Failed to check quota.")
-                return None
-        except requests.RequestException as e:
-            logger.error(f"Error checking quota: {str(e)}")
-            return None
+        check_sms_status_task.apply_async(kwargs={'sms_id': sms_obj.id}, countdown=get_status_check_delay(0))
 
     # Leaving this here as a reminder to include this logic in push email
     def handle_long_email_reply(self, user_id, subject, body, logger):
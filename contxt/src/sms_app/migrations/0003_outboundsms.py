@@ -0,0 +1,97 @@
+# Generated by Django 5.0.8 on 2026-10-18 04:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_alter_botaccount_options"),
+        ("core", "0009_alter_responsemessages_options_and_more"),
+        ("process_emails", "0004_replyoutbox"),
+        ("sms_app", "0002_sms_bot_sms_sms_bot_id_7860cc_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboundSMS",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("message", models.TextField()),
+                ("phone_number", models.CharField(max_length=20)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("processing", "Processing"),
+                            ("sent", "Sent"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("lease_expires_at", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "bot",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="accounts.botaccount",
+                    ),
+                ),
+                (
+                    "contact",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="core.contact"
+                    ),
+                ),
+                (
+                    "email",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="outbound_sms",
+                        to="process_emails.email",
+                    ),
+                ),
+                (
+                    "sms",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="sms_app.sms",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "outbound sms",
+                "verbose_name_plural": "outbound sms",
+                "db_table": "outbound_sms",
+                "indexes": [
+                    models.Index(
+                        fields=["status", "id"], name="outbound_sm_status_1b3da9_idx"
+                    ),
+                    models.Index(
+                        fields=["status", "lease_expires_at"],
+                        name="outbound_sm_status_a79201_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
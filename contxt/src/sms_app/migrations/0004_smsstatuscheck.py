@@ -0,0 +1,56 @@
+# Generated by Django 5.0.8 on 2026-10-18 04:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sms_app", "0003_outboundsms"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SMSStatusCheck",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("retry_count", models.PositiveIntegerField(default=0)),
+                ("check_count", models.PositiveIntegerField(default=0)),
+                (
+                    "textbelt_status",
+                    models.CharField(blank=True, max_length=20, null=True),
+                ),
+                ("error", models.TextField(blank=True, null=True)),
+                (
+                    "next_check_delay",
+                    models.PositiveIntegerField(blank=True, null=True),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "sms",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="status_checks",
+                        to="sms_app.sms",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "sms status check",
+                "verbose_name_plural": "sms status checks",
+                "db_table": "sms_status_checks",
+                "indexes": [
+                    models.Index(fields=["sms"], name="sms_status__sms_id_3a7692_idx")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.8 on 2026-10-18 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sms_app", "0004_smsstatuscheck"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sms",
+            name="provider",
+            field=models.CharField(
+                choices=[("textbelt", "Textbelt"), ("stub", "Stub")],
+                default="textbelt",
+                max_length=20,
+            ),
+        ),
+    ]
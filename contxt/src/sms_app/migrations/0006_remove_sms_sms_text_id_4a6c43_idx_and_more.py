@@ -0,0 +1,27 @@
+# Generated by Django 5.0.8 on 2026-10-18 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_alter_botaccount_options"),
+        ("core", "0010_contact_contacts_user_id_8aacc1_idx"),
+        ("process_emails", "0004_replyoutbox"),
+        ("sms_app", "0005_sms_provider"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="sms",
+            name="sms_text_id_4a6c43_idx",
+        ),
+        migrations.AddIndex(
+            model_name="sms",
+            index=models.Index(
+                fields=["text_id", "direction", "created_at"],
+                name="sms_text_id_cc263e_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.8 on 2026-10-18 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms_app', '0006_remove_sms_sms_text_id_4a6c43_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboundsms',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('sent', 'Sent'), ('failed', 'Failed'), ('unknown', 'Unknown')], default='pending', max_length=10),
+        ),
+    ]
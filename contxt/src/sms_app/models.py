@@ -3,7 +3,7 @@ from core.models import Contact
 from process_emails.models import Email
 from accounts.models import BotAccount
 
-from contxt.utils.constants import SMS_DIRECTION_CHOICES, SMS_STATUS_CHOICES
+from contxt.utils.constants import SMS_DIRECTION_CHOICES, SMS_STATUS_CHOICES, OUTBOUND_SMS_STATUS_CHOICES, SMS_PROVIDER_CHOICES
 
 from django.db import models
 
@@ -14,6 +14,7 @@ class SMS(models.Model):
 
     message = models.TextField()
     text_id = models.CharField(max_length=255, null=True, blank=True)
+    provider = models.CharField(max_length=20, choices=SMS_PROVIDER_CHOICES, default='textbelt')
     phone_number = models.CharField(max_length=20)
     direction = models.CharField(max_length=10, choices=SMS_DIRECTION_CHOICES)
 
@@ -33,7 +34,79 @@ class SMS(models.Model):
         indexes = [
             models.Index(fields=['contact']),
             models.Index(fields=['email']),
-            models.Index(fields=['text_id']),
+            # Backs the lookup of the outbound SMS a reply answers, which filters on text ID and direction and sorts by age
+            models.Index(fields=['text_id', 'direction', 'created_at']),
             models.Index(fields=['is_processed']),
             models.Index(fields=['bot']),
         ]
+
+
+class OutboundSMS(models.Model):
+    """
+    An SMS waiting to be sent for an email.
+
+    The send sms stage of every bot adds its emails here, and any number of workers claim and send them
+    with `SELECT ... FOR UPDATE SKIP LOCKED`. A claimed message is leased until `lease_expires_at`, after
+    which another worker may claim it again if the first one stopped. A message that may have reached
+    the provider without a confirmed result is moved to 'unknown' and never sent again.
+    """
+    email = models.OneToOneField(Email, on_delete=models.CASCADE, related_name='outbound_sms')
+    contact = models.ForeignKey(Contact, on_delete=models.CASCADE)
+    bot = models.ForeignKey(BotAccount, on_delete=models.CASCADE, null=True, blank=True)
+    sms = models.ForeignKey(SMS, on_delete=models.SET_NULL, null=True, blank=True)
+
+    message = models.TextField()
+    phone_number = models.CharField(max_length=20)
+
+    status = models.CharField(max_length=10, choices=OUTBOUND_SMS_STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.phone_number} - {self.status}'
+
+    class Meta:
+        db_table = 'outbound_sms'
+        verbose_name = 'outbound sms'
+        verbose_name_plural = 'outbound sms'
+        indexes = [
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['status', 'lease_expires_at']),
+        ]
+
+
+class SMSStatusCheck(models.Model):
+    """
+    A single delivery status check of an outbound SMS, kept to follow how a message was retried.
+
+    Attributes:
+        sms (ForeignKey): The checked SMS.
+        retry_count (int): How many times the message had been resent when it was checked.
+        check_count (int): The number of the check for this SMS, starting at 0.
+        textbelt_status (str): The status reported by Textbelt, if the check succeeded.
+        error (str): The error of a failed check.
+        next_check_delay (int): Seconds until the next check, if one was scheduled.
+    """
+    sms = models.ForeignKey(SMS, on_delete=models.CASCADE, related_name='status_checks')
+    retry_count = models.PositiveIntegerField(default=0)
+    check_count = models.PositiveIntegerField(default=0)
+    textbelt_status = models.CharField(max_length=20, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    next_check_delay = models.PositiveIntegerField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.sms_id} - {self.textbelt_status}'
+
+    class Meta:
+        db_table = 'sms_status_checks'
+        verbose_name = 'sms status check'
+        verbose_name_plural = 'sms status checks'
+        indexes = [
+            models.Index(fields=['sms']),
+        ]
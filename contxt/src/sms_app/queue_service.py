@@ -0,0 +1,261 @@
+from process_emails.models import Email
+from sms_app.models import SMS, OutboundSMS
+from sms_app.send_keys import build_send_key, reserve_send_key, complete_send_key, release_send_key
+from sms_app.sms_router import get_sms_router, is_connect_failure
+from sms_app.sms_service import get_send_sms_logger
+from sms_app.webhook_service import cache_outbound_sms_context
+from contxt.utils.constants import SMS_DIRECTION_CHOICES, SMS_STATUS_CHOICES
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from datetime import timedelta
+import logging
+import requests
+import time
+
+
+SMS_STATUS_CHOICES_DICT = dict(SMS_STATUS_CHOICES)
+SMS_DIRECTION_CHOICES_DICT = dict(SMS_DIRECTION_CHOICES)
+
+
+def enqueue_outbound_sms(outgoing_messages, bot=None):
+    """
+    Adds the messages of a send sms run to the outbound SMS queue.
+
+    The emails are marked as processed in the same transaction, so from here on the queue is
+    responsible for them and the next run of the bot does not pick them up again.
+
+    Args:
+        outgoing_messages (list of dict): The 'email', 'contact' and 'message_body' of every message.
+        bot (BotAccount, optional): The bot that received the emails.
+
+    Returns:
+        int: The number of messages that were added. Emails that are already queued are not added again.
+    """
+    if not outgoing_messages:
+        return 0
+
+    email_ids = [message['email'].id for message in outgoing_messages]
+    with transaction.atomic():
+        # The insert ignores emails that are already queued and does not report which rows it added
+        queued_before = OutboundSMS.objects.filter(email_id__in=email_ids).count()
+        OutboundSMS.objects.bulk_create([
+            OutboundSMS(
+                email=message['email'],
+                contact=message['contact'],
+                bot=bot,
+                message=message['message_body'],
+                phone_number=message['contact'].phone_number
+            )
+            for message in outgoing_messages
+        ], ignore_conflicts=True)
+        queued_count = OutboundSMS.objects.filter(email_id__in=email_ids).count() - queued_before
+        Email.objects.filter(id__in=email_ids).update(is_processed=True, updated_at=timezone.now())
+
+    return queued_count
+
+
+def claim_outbound_sms(batch_size=None):
+    """
+    Claims a batch of queued messages for the calling worker.
+
+    The rows are locked with `SELECT ... FOR UPDATE SKIP LOCKED`, so workers claiming at the same time
+    get different messages instead of waiting for each other. Claimed messages are leased for
+    `SMS_QUEUE_LEASE_SECONDS`, and messages whose lease expired are claimed again.
+
+    Args:
+        batch_size (int, optional): The maximum number of messages to claim. Defaults to `SMS_QUEUE_BATCH_SIZE`.
+
+    Returns:
+        list: The claimed `OutboundSMS`, oldest first.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        claimable = OutboundSMS.objects.select_for_update(skip_locked=True).filter(
+            Q(status='pending') |
+            Q(status='processing', lease_expires_at__lt=now)
+        ).order_by('id')
+        claimed_ids = list(claimable.values_list('id', flat=True)[:batch_size or settings.SMS_QUEUE_BATCH_SIZE])
+        if not claimed_ids:
+            return []
+
+        OutboundSMS.objects.filter(id__in=claimed_ids).update(
+            status='processing',
+            lease_expires_at=now + timedelta(seconds=settings.SMS_QUEUE_LEASE_SECONDS),
+            updated_at=now
+        )
+
+    return list(OutboundSMS.objects.filter(id__in=claimed_ids).select_related('email', 'contact', 'bot').order_by('id'))
+
+
+def dispatch_outbound_sms(logger):
+    """
+    Claims and sends queued messages until the queue is empty or no SMS provider has quota left.
+
+    Args:
+        logger (logging.Logger): The logger instance for logging the results.
+
+    Returns:
+        list: The `SMS` records of all messages accepted by Textbelt.
+    """
+    sent_sms = []
+    while True:
+        if not get_sms_router().has_available_provider(logger=logging.getLogger('sms_quota')):
+            logger.warning("Stopped sending queued SMS, no SMS provider has quota left.")
+            break
+
+        claimed = claim_outbound_sms()
+        if not claimed:
+            break
+        sent_sms.extend(send_claimed_sms(claimed, logger=logger))
+
+    return sent_sms
+
+
+def send_claimed_sms(claimed, logger):
+    """
+    Sends a batch of claimed messages and stores their outcome.
+
+    Every message still needs its send key (see `send_keys`), so a message whose lease expired while
+    its first worker was sending it is never sent twice. Messages that may have reached Textbelt
+    without a confirmed result (a failed request that got past connecting, see `is_connect_failure`,
+    or a send key left pending) end in the 'unknown' status instead of being retried. A failed request
+    also stores an 'Unknown' SMS record, so the message shows up in the status the user gets back.
+    The SMS records and queue rows of the whole batch are written with one query each.
+
+    Args:
+        claimed (list): The `OutboundSMS` returned by `claim_outbound_sms`.
+        logger (logging.Logger): The logger instance for logging the results.
+
+    Returns:
+        list: The `SMS` records of the messages accepted by Textbelt.
+    """
+    sms_quota_logger = logging.getLogger('sms_quota')
+
+    to_send = []
+    finished = []
+    unknown_ids = []
+    new_sms = []
+    for outbound in claimed:
+        send_key = build_send_key(outbound.email_id, outbound.contact_id)
+        reserved, text_id, provider = reserve_send_key(send_key)
+        if reserved:
+            to_send.append((outbound, send_key))
+        elif text_id:
+            # Sent by a worker that stopped before storing the result
+            get_send_sms_logger(outbound.bot_id).warning(f"Queued SMS {outbound.id} was already sent with Text ID {text_id}. Not sending it again.")
+            outbound.sms = SMS.objects.filter(text_id=text_id, direction=SMS_DIRECTION_CHOICES_DICT['Outbound']).first()
+            if outbound.sms is None:
+                outbound.sms = build_sms(outbound, text_id=text_id, status=SMS_STATUS_CHOICES_DICT['Sent'], provider=provider)
+                new_sms.append(outbound.sms)
+            outbound.status = 'sent'
+            finished.append(outbound)
+        else:
+            # Another worker is still sending it, or stopped in the middle of the request. Either way the
+            # message may have been sent, so it is not retried. A worker that finishes the send overwrites this.
+            get_send_sms_logger(outbound.bot_id).warning(f"Queued SMS {outbound.id} is already being sent or its last send has an unknown outcome. Not sending it again.")
+            unknown_ids.append(outbound.id)
+
+    results = get_sms_router().send_many([(outbound.phone_number, outbound.message) for outbound, _ in to_send], logger=logger)
+
+    sent_sms = []
+    for (outbound, send_key), (provider, result) in zip(to_send, results):
+        bot_logger = get_send_sms_logger(outbound.bot_id)
+        finished.append(outbound)
+
+        if result is None:
+            bot_logger.warning(f"Queued SMS {outbound.id} not sent, no SMS provider had a free send slot.")
+            release_send_key(send_key)
+            outbound.status = 'pending'
+            outbound.lease_expires_at = None
+            continue
+
+        outbound.attempts += 1
+
+        if isinstance(result, requests.RequestException):
+            outbound.last_error = str(result)
+            outbound.lease_expires_at = None
+            # Only a failed connection proves that Textbelt never got the message
+            if not is_connect_failure(result):
+                # The send key stays reserved and the message is not retried, it may have been sent
+                bot_logger.error(f"Queued SMS {outbound.id} has an unknown outcome and is not sent again. Error: {result}")
+                outbound.status = 'unknown'
+                outbound.sms = build_sms(outbound, text_id=None, status=SMS_STATUS_CHOICES_DICT['Unknown'], provider=provider)
+                new_sms.append(outbound.sms)
+                continue
+
+            release_send_key(send_key)
+            if outbound.attempts >= settings.SMS_QUEUE_MAX_ATTEMPTS:
+                bot_logger.error(f"Queued SMS {outbound.id} failed after {outbound.attempts} attempts. Error: {result}")
+                outbound.status = 'failed'
+                outbound.sms = build_sms(outbound, text_id=None, status=SMS_STATUS_CHOICES_DICT['Failed'], provider=provider)
+                new_sms.append(outbound.sms)
+            else:
+                outbound.status = 'pending'
+            continue
+
+        if result.get('success'):
+            text_id = result.get('textId')
+            quota_remaining = result.get('quotaRemaining')
+            complete_send_key(send_key, text_id, provider=provider)
+
+            bot_logger.info(f"Message sent successfully with {provider}. Quota remaining: {quota_remaining}. Text ID: {text_id}")
+            sms_quota_logger.debug(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Quota remaining: {quota_remaining}\n")
+
+            outbound.status = 'sent'
+            outbound.sms = build_sms(outbound, text_id=text_id, status=SMS_STATUS_CHOICES_DICT['Sent'], provider=provider)
+            new_sms.append(outbound.sms)
+            sent_sms.append(outbound.sms)
+        else:
+            error = result.get('error')
+            bot_logger.error(f"Failed to send message with {provider}. Error: {error}")
+            release_send_key(send_key)
+
+            outbound.status = 'failed'
+            outbound.last_error = error
+            outbound.sms = build_sms(outbound, text_id=None, status=SMS_STATUS_CHOICES_DICT['Failed'], provider=provider)
+            new_sms.append(outbound.sms)
+
+    with transaction.atomic():
+        SMS.objects.bulk_create(new_sms)
+        now = timezone.now()
+        for outbound in finished:
+            outbound.updated_at = now
+        OutboundSMS.objects.bulk_update(finished, ['sms', 'status', 'attempts', 'lease_expires_at', 'last_error', 'updated_at'])
+        # Only rows still leased are changed, so the result stored by a worker that finished the send is kept
+        OutboundSMS.objects.filter(id__in=unknown_ids, status='processing').update(
+            status='unknown', lease_expires_at=None, last_error='Send in progress or interrupted, outcome unknown', updated_at=now
+        )
+    cache_outbound_sms_context(new_sms)
+
+    return sent_sms
+
+
+def build_sms(outbound, text_id, status, provider):
+    """
+    Builds the unsaved `SMS` record of a queued message.
+
+    Args:
+        outbound (OutboundSMS): The queued message.
+        text_id (str): The ID of the message at the provider, or None if it was not sent.
+        status (str): The status of the SMS.
+        provider (str): The name of the provider that handled the message.
+
+    Returns:
+        SMS: The unsaved SMS record.
+    """
+    return SMS(
+        contact=outbound.contact,
+        bot_id=outbound.bot_id,
+        email=outbound.email,
+        message=outbound.message,
+        text_id=text_id,
+        provider=provider or 'textbelt',
+        phone_number=outbound.phone_number,
+        direction=SMS_DIRECTION_CHOICES_DICT['Outbound'],
+        status=status,
+        is_processed=True
+    )
@@ -0,0 +1,138 @@
+from contxt.utils.helper_functions import get_redis_client
+from sms_app.textbelt_client import get_textbelt_client
+
+from django.conf import settings
+
+import redis
+import requests
+
+
+SMS_QUOTA_KEY = 'sms_quota_remaining'
+SMS_QUOTA_REFRESH_LOCK_KEY = 'sms_quota_refresh_lock'
+SMS_QUOTA_NOTIFICATION_KEY = 'sms_quota_notification_{}'
+
+# Stores a new remaining quota only if it is lower than the cached one. Send responses can arrive out of order
+# from parallel workers, and the quota only goes down between refreshes. The TTL of the key is kept, so the
+# value is still refreshed from the API on schedule.
+RECORD_QUOTA_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    return nil
+end
+if tonumber(ARGV[1]) < tonumber(current) then
+    local ttl = redis.call('PTTL', KEYS[1])
+    if ttl > 0 then
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ttl)
+    else
+        redis.call('SET', KEYS[1], ARGV[1])
+    end
+    return ARGV[1]
+end
+return current
+"""
+
+
+def get_remaining_quota(logger):
+    """
+    Returns the remaining SMS quota, reading Textbelt only when the cached value is missing.
+
+    The quota is cached in Redis for `SMS_QUOTA_CACHE_TTL` seconds and lowered by every send response in
+    between (see `record_quota_remaining`). Only one worker refreshes an expired value, the others wait
+    for it instead of calling the API as well. A worker that waits longer than `SMS_REQUEST_TIMEOUT`
+    fetches the quota itself.
+
+    Args:
+        logger (logging.Logger): The logger instance for logging quota details.
+
+    Returns:
+        int: The remaining quota, or None if it could not be fetched.
+    """
+    redis_client = get_redis_client()
+
+    cached_quota = redis_client.get(SMS_QUOTA_KEY)
+    if cached_quota is not None:
+        logger.debug(f"Quota remaining (cached): {int(cached_quota)}")
+        return int(cached_quota)
+
+    lock = redis_client.lock(SMS_QUOTA_REFRESH_LOCK_KEY, timeout=60)
+    if not lock.acquire(blocking_timeout=settings.SMS_REQUEST_TIMEOUT):
+        # The refreshing worker is taking too long, so the quota is read without waiting any further
+        cached_quota = redis_client.get(SMS_QUOTA_KEY)
+        if cached_quota is not None:
+            return int(cached_quota)
+        logger.warning("Timed out waiting for the quota refresh lock, fetching the quota directly.")
+        return fetch_remaining_quota(redis_client, logger)
+
+    try:
+        # Another worker may have refreshed the quota while this one was waiting for the lock
+        cached_quota = redis_client.get(SMS_QUOTA_KEY)
+        if cached_quota is not None:
+            return int(cached_quota)
+        return fetch_remaining_quota(redis_client, logger)
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            # The lock expired during a slow refresh and may be held by another worker by now
+            pass
+
+
+def fetch_remaining_quota(redis_client, logger):
+    """
+    Reads the remaining SMS quota from Textbelt and caches it for `SMS_QUOTA_CACHE_TTL` seconds.
+
+    Args:
+        redis_client (redis.Redis): The Redis client.
+        logger (logging.Logger): The logger instance for logging quota details.
+
+    Returns:
+        int: The remaining quota, or None if it could not be fetched.
+    """
+    try:
+        result = get_textbelt_client().get_quota()
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"Error checking quota: {str(e)}")
+        return None
+
+    if not result.get('success'):
+        logger.error("Failed to check quota.")
+        return None
+
+    quota_remaining = int(result.get('quotaRemaining'))
+    redis_client.set(SMS_QUOTA_KEY, quota_remaining, ex=settings.SMS_QUOTA_CACHE_TTL)
+    logger.info(f"Quota remaining: {quota_remaining}")
+    return quota_remaining
+
+
+def record_quota_remaining(quota_remaining):
+    """
+    Updates the cached quota with the `quotaRemaining` value of a send response.
+
+    Args:
+        quota_remaining (int): The remaining quota reported by Textbelt.
+    """
+    if quota_remaining is None:
+        return
+    redis_client = get_redis_client()
+    redis_client.eval(RECORD_QUOTA_SCRIPT, 1, SMS_QUOTA_KEY, int(quota_remaining))
+
+
+def invalidate_quota():
+    """
+    Removes the cached quota, so the next read fetches it from Textbelt. Used after failed sends.
+    """
+    get_redis_client().delete(SMS_QUOTA_KEY)
+
+
+def reserve_quota_notification(quota):
+    """
+    Makes sure the quota limit notification for a quota value is sent only once per `SMS_QUOTA_NOTIFICATION_INTERVAL`.
+
+    Args:
+        quota (int): The quota value the notification is about.
+
+    Returns:
+        bool: True if the caller should send the notification, False if it was already sent.
+    """
+    redis_client = get_redis_client()
+    return bool(redis_client.set(SMS_QUOTA_NOTIFICATION_KEY.format(quota), 1, nx=True, ex=settings.SMS_QUOTA_NOTIFICATION_INTERVAL))
@@ -0,0 +1,77 @@
+from contxt.utils.helper_functions import get_redis_client
+
+from django.conf import settings
+
+
+SMS_SEND_KEY = 'sms_send_{}_{}_{}'
+SMS_SEND_PENDING = 'pending'
+
+
+def build_send_key(email_id, contact_id, attempt=0):
+    """
+    Builds the idempotency key of one send of an email to a contact.
+
+    Args:
+        email_id (int): The ID of the email the message is sent for.
+        contact_id (int): The ID of the contact the message is sent to.
+        attempt (int): 0 for the first send, the retry count for resends.
+
+    Returns:
+        str: The Redis key of the send.
+    """
+    return SMS_SEND_KEY.format(email_id, contact_id, attempt)
+
+
+def reserve_send_key(send_key):
+    """
+    Reserves a send before the request to the provider is made.
+
+    The key is set only if it does not exist yet, so of all workers trying to send the same message
+    exactly one gets the reservation. The reservation expires after `SMS_SEND_PENDING_TTL` seconds
+    unless the send is completed or released before that.
+
+    Args:
+        send_key (str): The key built by `build_send_key`.
+
+    Returns:
+        tuple: (reserved, text_id, provider). `reserved` is True if the caller may send the message.
+        Otherwise `text_id` and `provider` identify the earlier send, or are None if that send is still
+        in progress or its outcome is unknown.
+    """
+    redis_client = get_redis_client()
+    if redis_client.set(send_key, SMS_SEND_PENDING, nx=True, ex=settings.SMS_SEND_PENDING_TTL):
+        return True, None, None
+
+    value = redis_client.get(send_key)
+    if value is None:
+        # The reservation expired between the two calls, try once more
+        return bool(redis_client.set(send_key, SMS_SEND_PENDING, nx=True, ex=settings.SMS_SEND_PENDING_TTL)), None, None
+
+    value = value.decode()
+    if value == SMS_SEND_PENDING:
+        return False, None, None
+    # Keys written before sends were routed between providers only hold a Textbelt ID
+    provider, _, text_id = value.rpartition(':')
+    return False, text_id, provider or 'textbelt'
+
+
+def complete_send_key(send_key, text_id, provider='textbelt'):
+    """
+    Records that the reserved send was accepted by a provider. The key is kept for `SMS_SEND_KEY_TTL` seconds.
+
+    Args:
+        send_key (str): The key built by `build_send_key`.
+        text_id (str): The ID of the message at the provider.
+        provider (str): The name of the provider that sent the message.
+    """
+    get_redis_client().set(send_key, f'{provider}:{text_id}', ex=settings.SMS_SEND_KEY_TTL)
+
+
+def release_send_key(send_key):
+    """
+    Removes a reservation whose message was certainly not sent, so it can be sent again.
+
+    Args:
+        send_key (str): The key built by `build_send_key`.
+    """
+    get_redis_client().delete(send_key)
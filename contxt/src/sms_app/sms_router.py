@@ -0,0 +1,307 @@
+from contxt.utils.helper_functions import get_redis_client
+from sms_app.quota_service import get_remaining_quota, record_quota_remaining, invalidate_quota
+from sms_app.textbelt_client import get_textbelt_client
+
+from django.conf import settings
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import random
+import requests
+import time
+import uuid
+from urllib3.exceptions import NewConnectionError
+
+
+SMS_PROVIDER_HEALTH_KEY = 'sms_provider_health_{}'
+
+# Folds the outcome of one send into the moving averages of a provider. A provider without recent sends starts
+# from the outcome of its first send. The key expires, so a provider that is not used is tried again eventually.
+RECORD_HEALTH_SCRIPT = """
+local alpha = tonumber(ARGV[3])
+local latency = tonumber(ARGV[1])
+local error_rate = tonumber(ARGV[2])
+local current_latency = redis.call('HGET', KEYS[1], 'latency')
+if current_latency then
+    latency = alpha * latency + (1 - alpha) * tonumber(current_latency)
+    error_rate = alpha * error_rate + (1 - alpha) * tonumber(redis.call('HGET', KEYS[1], 'error_rate'))
+end
+redis.call('HSET', KEYS[1], 'latency', tostring(latency), 'error_rate', tostring(error_rate))
+redis.call('HINCRBY', KEYS[1], 'sends', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return redis.status_reply('OK')
+"""
+
+
+def is_connect_failure(error):
+    """
+    Tells whether a failed send request never reached the provider, so sending the message again cannot duplicate it.
+
+    A connect timeout proves that, and so does a connection error raised while opening the connection, e.g.
+    because the host name did not resolve or the connection was refused (urllib3 `NewConnectionError`, of which
+    `NameResolutionError` is a subclass). Any other error may have happened after the request was sent.
+
+    Args:
+        error (requests.RequestException): The error raised while sending.
+
+    Returns:
+        bool: True if the provider never got the request, False otherwise.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # requests wraps the urllib3 MaxRetryError, whose reason is the error of the last connection attempt
+    reason = getattr(error.args[0], 'reason', error.args[0])
+    return isinstance(reason, NewConnectionError)
+
+
+class StubSMSProvider:
+    """
+    A local SMS provider that sends nothing, used to test and benchmark routing and failover offline.
+
+    It answers like Textbelt after `latency` seconds and fails `failure_rate` of the sends. Every sent
+    message is reported as delivered.
+
+    Attributes:
+        name (str): The name the provider is routed and stored with.
+        latency (float): The seconds every send takes.
+        failure_rate (float): The share of sends (0-1) that fail with a connect timeout.
+    """
+
+    def __init__(self, name='stub', latency=None, failure_rate=None):
+        self.name = name
+        self.latency = settings.SMS_STUB_LATENCY if latency is None else latency
+        self.failure_rate = settings.SMS_STUB_FAILURE_RATE if failure_rate is None else failure_rate
+
+    def send(self, to_number, message_body):
+        """
+        Pretends to send a single SMS, see `TextbeltClient.send`.
+        """
+        return self.post_message(to_number, message_body)
+
+    def acquire_send_slot(self):
+        """
+        The stub has no rate limit, a slot is always free.
+        """
+        return True
+
+    def post_message(self, to_number, message_body):
+        """
+        Pretends to send a single SMS, see `TextbeltClient.post_message`.
+        """
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise requests.ConnectTimeout(f'{self.name} did not answer')
+        return {'success': True, 'textId': f'{self.name}-{uuid.uuid4().hex}', 'quotaRemaining': None}
+
+    def get_status(self, text_id):
+        """
+        Reports every message as delivered.
+        """
+        return 'DELIVERED'
+
+    def get_quota(self, api_key=None):
+        """
+        Reports an unlimited quota.
+        """
+        return {'success': True, 'quotaRemaining': None}
+
+
+class SMSRouter:
+    """
+    Sends every SMS with the healthiest of the configured providers.
+
+    The latency and error rate of each provider are kept as moving averages in Redis, so they are shared
+    by all workers. Providers are tried from the fastest healthy one, and a provider that certainly did
+    not send the message (it could not be reached, rejected it, or had no free send slot) is followed by
+    the next one. Errors after which the message may have been sent are never retried with another
+    provider, so a message is sent at most once.
+
+    Attributes:
+        providers (list): The providers in order of preference. Every provider has a `name` and the
+            `acquire_send_slot`, `post_message`, `get_status` and `get_quota` methods of `TextbeltClient`.
+    """
+
+    def __init__(self, providers):
+        self.providers = list(providers)
+        self.providers_by_name = {provider.name: provider for provider in self.providers}
+        self.redis_client = get_redis_client()
+
+    def get_provider(self, name):
+        """
+        Returns the provider with the given name, or Textbelt for messages stored before routing existed.
+        """
+        return self.providers_by_name.get(name) or get_textbelt_client()
+
+    def get_health(self):
+        """
+        Reads the moving averages of every provider.
+
+        Returns:
+            dict: The 'latency' (seconds) and 'error_rate' (0-1) of every provider, keyed by name. Both
+            are 0 for a provider without recent sends.
+        """
+        pipeline = self.redis_client.pipeline()
+        for provider in self.providers:
+            pipeline.hmget(SMS_PROVIDER_HEALTH_KEY.format(provider.name), 'latency', 'error_rate')
+
+        health = {}
+        for provider, (latency, error_rate) in zip(self.providers, pipeline.execute()):
+            health[provider.name] = {'latency': float(latency or 0), 'error_rate': float(error_rate or 0)}
+        return health
+
+    def record_send(self, provider_name, latency, failed):
+        """
+        Adds the outcome of one send to the moving averages of a provider.
+
+        Args:
+            provider_name (str): The name of the provider.
+            latency (float): The seconds the send took.
+            failed (bool): Whether the send failed.
+        """
+        self.redis_client.eval(
+            RECORD_HEALTH_SCRIPT, 1, SMS_PROVIDER_HEALTH_KEY.format(provider_name),
+            latency, int(failed), settings.SMS_PROVIDER_HEALTH_ALPHA, settings.SMS_PROVIDER_HEALTH_TTL
+        )
+
+    def has_quota(self, provider, logger):
+        """
+        Checks whether a provider can still send. Only Textbelt has a quota, it is read from `quota_service`.
+        """
+        if provider.name != 'textbelt':
+            return True
+        return get_remaining_quota(logger=logger) != 0
+
+    def rank_providers(self, logger):
+        """
+        Orders the providers with quota left from the healthiest to the least healthy.
+
+        Providers failing more than `SMS_PROVIDER_MAX_ERROR_RATE` of their sends come last, the others are
+        ordered by latency. Ties keep the configured order.
+
+        Args:
+            logger (logging.Logger): The logger instance for logging quota errors.
+
+        Returns:
+            list: The providers to try, in order.
+        """
+        health = self.get_health()
+        available = [provider for provider in self.providers if self.has_quota(provider, logger)]
+        return sorted(available, key=lambda provider: (
+            health[provider.name]['error_rate'] > settings.SMS_PROVIDER_MAX_ERROR_RATE,
+            health[provider.name]['latency']
+        ))
+
+    def send(self, to_number, message_body, logger):
+        """
+        Sends a single SMS with the healthiest provider, failing over to the next ones where that is safe.
+
+        Args:
+            to_number (str): The phone number to send the message to.
+            message_body (str): The content of the message.
+            logger (logging.Logger): The logger instance for logging failovers.
+
+        Returns:
+            tuple: The name of the provider that handled the message (None if no provider is available)
+            and its result, which is the provider response, None if no send slot was free, or the
+            `requests.RequestException` raised while sending.
+        """
+        provider_name, result = None, None
+        for provider in self.rank_providers(logger=logging.getLogger('sms_quota')):
+            provider_name = provider.name
+            if not provider.acquire_send_slot():
+                result = None
+                logger.warning(f"No free send slot for {provider_name}, trying the next provider.")
+                continue
+
+            # Only the request is timed, waiting for the local rate limit says nothing about the provider
+            start = time.monotonic()
+            try:
+                result = provider.post_message(to_number, message_body)
+            except requests.RequestException as e:
+                result = e
+            except ValueError as e:
+                result = requests.RequestException(str(e))
+
+            failed = isinstance(result, requests.RequestException) or not result.get('success')
+            self.record_send(provider_name, time.monotonic() - start, failed)
+
+            if provider_name == 'textbelt' and not failed:
+                record_quota_remaining(result.get('quotaRemaining'))
+            elif provider_name == 'textbelt' and isinstance(result, dict):
+                # The cached quota may be wrong (e.g. out of quota), so the next read fetches it from Textbelt again
+                invalidate_quota()
+
+            if (isinstance(result, requests.RequestException) and is_connect_failure(result)) or (isinstance(result, dict) and not result.get('success')):
+                error = result if isinstance(result, requests.RequestException) else result.get('error')
+                logger.warning(f"{provider_name} did not send the message to {to_number}, trying the next provider. Error: {error}")
+                continue
+            break
+
+        return provider_name, result
+
+    def send_many(self, messages, logger):
+        """
+        Sends a batch of SMS concurrently, routing every message on its own.
+
+        Args:
+            messages (list of tuple): The (to_number, message_body) of every message.
+            logger (logging.Logger): The logger instance for logging failed requests.
+
+        Returns:
+            list: The (provider_name, result) of every message in the same order as `messages`, see `send`.
+        """
+        if not messages:
+            return []
+        with ThreadPoolExecutor(max_workers=min(settings.SMS_DISPATCH_CONCURRENCY, len(messages))) as executor:
+            return list(executor.map(lambda message: self.send(message[0], message[1], logger=logger), messages))
+
+    def get_status(self, provider_name, text_id):
+        """
+        Fetches the delivery status of a message from the provider that sent it.
+
+        Args:
+            provider_name (str): The name of the provider stored with the SMS.
+            text_id (str): The ID of the message at the provider.
+
+        Returns:
+            str: The status in the Textbelt names (e.g. 'DELIVERED').
+
+        Raises:
+            requests.RequestException: If the request to the provider failed.
+        """
+        return self.get_provider(provider_name).get_status(text_id)
+
+    def has_available_provider(self, logger):
+        """
+        Checks whether at least one provider can still send.
+        """
+        return any(self.has_quota(provider, logger) for provider in self.providers)
+
+
+_sms_router = None
+
+
+def get_sms_provider(name):
+    """
+    Creates the provider configured under a name in `SMS_PROVIDERS`.
+    """
+    if name == 'textbelt':
+        return get_textbelt_client()
+    if name == 'stub':
+        return StubSMSProvider()
+    raise ValueError(f'Unknown SMS provider {name}')
+
+
+def get_sms_router():
+    """
+    Returns the `SMSRouter` of this process for the providers in `SMS_PROVIDERS`, creating it on first use.
+
+    Returns:
+        SMSRouter: The shared router.
+    """
+    global _sms_router
+    if _sms_router is None:
+        _sms_router = SMSRouter([get_sms_provider(name.strip()) for name in settings.SMS_PROVIDERS])
+    return _sms_router
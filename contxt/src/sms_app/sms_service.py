@@ -0,0 +1,368 @@
+from process_emails.models import ReplyOutbox
+from sms_app.models import SMS, SMSStatusCheck
+from sms_app.send_keys import build_send_key, reserve_send_key, complete_send_key, release_send_key
+from sms_app.sms_router import get_sms_router, is_connect_failure
+from sms_app.utils import log_sms_to_database
+from contxt.utils.constants import SMS_DIRECTION_CHOICES, SMS_STATUS_CHOICES, CURRENT_TASKS_RUN_BY_BOTS, TEXTBELT_STATUS_TO_SMS_STATUS, SMS_STATUS_TRANSITIONS
+
+from django.conf import settings
+from django.core.management import call_command
+from django.utils import timezone
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import random
+import requests
+import time
+
+
+SMS_STATUS_CHOICES_DICT = dict(SMS_STATUS_CHOICES)
+SMS_DIRECTION_CHOICES_DICT = dict(SMS_DIRECTION_CHOICES)
+
+
+def get_send_sms_logger(bot_id=None):
+    """
+    Returns the logger used by the send sms stage of a bot.
+
+    Args:
+        bot_id (int, optional): The ID of the bot. The generic 'send_sms' logger is used without it.
+
+    Returns:
+        logging.Logger: The logger instance.
+    """
+    if bot_id:
+        return logging.getLogger(f"bot_{bot_id}_{CURRENT_TASKS_RUN_BY_BOTS['send_sms']}")
+    return logging.getLogger('send_sms')
+
+
+def get_status_check_delay(check_count):
+    """
+    Returns the number of seconds to wait before a delivery status check.
+
+    The delay doubles with every check, starting at `SMS_RETRY_DELAY` and capped at `SMS_RETRY_MAX_DELAY`.
+    Half of it is random, so checks of messages sent together do not all hit Textbelt at the same moment.
+
+    Args:
+        check_count (int): The number of the upcoming check, starting at 0.
+
+    Returns:
+        int: The delay in seconds.
+    """
+    delay = min(settings.SMS_RETRY_DELAY * 2 ** check_count, settings.SMS_RETRY_MAX_DELAY)
+    return int(delay / 2 + random.uniform(0, delay / 2))
+
+
+def set_sms_status(sms, status):
+    """
+    Moves an SMS to a new status if `SMS_STATUS_TRANSITIONS` allows it.
+
+    The current status is checked by the update itself, so a status check or sweep that finishes late
+    can never move a message out of a final status set by another worker in the meantime.
+
+    Args:
+        sms (SMS): The SMS to update. Its `status` is updated as well.
+        status (str): The new status.
+
+    Returns:
+        bool: True if the status was changed, False if the transition is not allowed.
+    """
+    allowed_from = [current for current, targets in SMS_STATUS_TRANSITIONS.items() if status in targets]
+    updated = SMS.objects.filter(id=sms.id, status__in=allowed_from).update(status=status, updated_at=timezone.now())
+    if updated:
+        sms.status = status
+    return bool(updated)
+
+
+def check_sms_status(sms_id, check_count=0, retry_count=0):
+    """
+    Checks the delivery status of an outbound SMS once and decides what happens next.
+
+    Providers update the status of a message with a delay, so a message that is still 'SENT' is checked
+    again later, up to `MAX_SMS_RETRIES` times. When every check is used up, or the provider reports the
+    message as failed, the message is resent, up to `MAX_SMS_RETRIES` times as well. After that it is
+    marked as failed and the user is notified. Every check is stored as an `SMSStatusCheck`.
+
+    Nothing here waits: the caller schedules the returned follow-up check after `get_status_check_delay` seconds.
+
+    Args:
+        sms_id (int): The ID of the outbound SMS.
+        check_count (int): How many times the status of this SMS has been checked already.
+        retry_count (int): How many times the message has been resent already.
+
+    Returns:
+        dict: The keyword arguments of the next status check and its 'countdown' in seconds, or None if no
+        further check is needed.
+    """
+    sms = SMS.objects.select_related('email', 'contact', 'bot').filter(
+        id=sms_id, direction=SMS_DIRECTION_CHOICES_DICT['Outbound']
+    ).first()
+    if not sms:
+        logging.getLogger('send_sms').error(f"SMS object with id {sms_id} not found in database.")
+        return None
+
+    logger = get_send_sms_logger(bot_id=sms.bot_id)
+
+    if not SMS_STATUS_TRANSITIONS[sms.status]:
+        logger.debug(f"SMS {sms.text_id} already has the final status {sms.status}.")
+        return None
+
+    status_check = SMSStatusCheck(sms=sms, retry_count=retry_count, check_count=check_count)
+    try:
+        status_check.textbelt_status = get_sms_router().get_status(sms.provider, sms.text_id)
+    except (requests.RequestException, ValueError) as e:
+        status_check.error = str(e)
+        logger.warning(f"Error occurred while checking status of SMS {sms.text_id}. Error = {e}")
+
+    logger.debug(f"SMS {sms.text_id} status check {check_count + 1}: {status_check.textbelt_status}")
+    next_check = None
+
+    if status_check.textbelt_status == "DELIVERED":
+        if set_sms_status(sms, SMS_STATUS_CHOICES_DICT['Delivered']):
+            logger.info(f"SMS {sms.text_id} delivered successfully.")
+
+    elif status_check.textbelt_status != "FAILED" and check_count + 1 < settings.MAX_SMS_RETRIES:
+        next_check = {'sms_id': sms.id, 'check_count': check_count + 1, 'retry_count': retry_count}
+
+    elif retry_count < settings.MAX_SMS_RETRIES:
+        logger.warning(f"SMS {sms.text_id} not delivered. Status: {status_check.textbelt_status}")
+        if set_sms_status(sms, SMS_STATUS_CHOICES_DICT['Unknown']):
+            logger.info(f"Retrying SMS send. Attempt {retry_count + 1}")
+            new_sms = resend_sms(sms, retry_count, logger=logger)
+            if new_sms:
+                next_check = {'sms_id': new_sms.id, 'check_count': 0, 'retry_count': retry_count + 1}
+
+    elif set_sms_status(sms, SMS_STATUS_CHOICES_DICT['Failed']):
+        logger.error(f"SMS {sms.text_id} failed after {settings.MAX_SMS_RETRIES} attempts.")
+        send_failure_notification_email(sms, logger=logger)
+
+    if next_check:
+        next_check['countdown'] = status_check.next_check_delay = get_status_check_delay(next_check['check_count'])
+    status_check.save()
+    return next_check
+
+
+def resend_sms(sms, retry_count, logger):
+    """
+    Sends the message of an undelivered SMS again and logs the new attempt to the database.
+
+    Every attempt has its own send key, so a status check that runs twice (e.g. because it was scheduled
+    twice, or its worker was restarted) does not send the same attempt twice.
+
+    Args:
+        sms (SMS): The outbound SMS that was not delivered.
+        retry_count (int): How many times the message has been resent already.
+        logger (logging.Logger): The logger instance for logging the result.
+
+    Returns:
+        SMS: The SMS record of the new attempt, or None if no provider accepted the message or the
+        attempt was already made by another worker.
+    """
+    logger.info(f"Resending SMS. Retry Count: {retry_count}")
+    sms_quota_logger = logging.getLogger('sms_quota')
+
+    send_key = build_send_key(sms.email_id, sms.contact_id, attempt=retry_count + 1)
+    reserved, sent_text_id, sent_provider = reserve_send_key(send_key)
+    if not reserved:
+        return get_unlogged_resend(sms, sent_text_id, sent_provider, logger=logger)
+
+    provider, result = get_sms_router().send(sms.phone_number, sms.message, logger=logger)
+
+    if result is None:
+        logger.error(f"Resend of SMS {sms.text_id} skipped, no SMS provider had a free send slot.")
+        release_send_key(send_key)
+        return None
+
+    if isinstance(result, requests.RequestException):
+        logger.error(f"Resend request failed: {str(result)}")
+        # Only a failed connection proves that the provider never got the message
+        if is_connect_failure(result):
+            release_send_key(send_key)
+        return None
+
+    if result.get('success'):
+        new_text_id = result.get('textId')
+        quota_remaining = result.get('quotaRemaining')
+        complete_send_key(send_key, new_text_id, provider=provider)
+
+        logger.info(f"Message resent successfully with {provider}. New Text ID: {new_text_id}. Quota remaining: {quota_remaining}")
+        sms_quota_logger.debug(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Quota remaining: {quota_remaining}\n")
+
+        return log_sms_to_database(contact_id=sms.contact_id, message_body=sms.message, text_id=new_text_id, to_number=sms.phone_number,
+            direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Sent'], is_processed=True, email=sms.email, bot=sms.bot,
+            provider=provider)
+
+    logger.error(f"Failed to resend message with {provider}. Error: {result.get('error')}")
+    release_send_key(send_key)
+    log_sms_to_database(contact_id=sms.contact_id, message_body=sms.message, text_id=None, to_number=sms.phone_number,
+        direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Failed'], is_processed=True, email=sms.email, bot=sms.bot,
+        provider=provider)
+    return None
+
+
+def get_unlogged_resend(sms, sent_text_id, sent_provider, logger):
+    """
+    Handles a resend whose send key is already reserved by an earlier run of the same attempt.
+
+    If that run got the message accepted but stopped before storing it, the SMS is stored now so its
+    delivery is still tracked. In every other case the attempt belongs to the other run and nothing is done.
+
+    Args:
+        sms (SMS): The outbound SMS that was not delivered.
+        sent_text_id (str): The ID recorded for the attempt, or None if it is still in progress.
+        sent_provider (str): The provider recorded for the attempt.
+        logger (logging.Logger): The logger instance for logging the result.
+
+    Returns:
+        SMS: The stored SMS of the attempt if this call stored it, None otherwise.
+    """
+    if not sent_text_id:
+        logger.warning(f"Resend of SMS {sms.text_id} is already in progress. Not sending it again.")
+        return None
+
+    if SMS.objects.filter(text_id=sent_text_id, direction=SMS_DIRECTION_CHOICES_DICT['Outbound']).exists():
+        logger.warning(f"Resend of SMS {sms.text_id} was already made with Text ID {sent_text_id}. Not sending it again.")
+        return None
+
+    logger.warning(f"Resend of SMS {sms.text_id} was sent with Text ID {sent_text_id} but not stored. Storing it now.")
+    return log_sms_to_database(contact_id=sms.contact_id, message_body=sms.message, text_id=sent_text_id, to_number=sms.phone_number,
+        direction=SMS_DIRECTION_CHOICES_DICT['Outbound'], status=SMS_STATUS_CHOICES_DICT['Sent'], is_processed=True, email=sms.email, bot=sms.bot,
+        provider=sent_provider)
+
+
+# TODO make this better
+def send_failure_notification_email(sms, logger):
+    """
+    Lets the user know that their SMS could not be delivered by replying to their email.
+
+    The reply is queued in the `ReplyOutbox` of the bot that received the email. Messages sent without
+    a bot (test mode) are still pushed right away.
+
+    Args:
+        sms (SMS): The outbound SMS that failed.
+        logger (logging.Logger): The logger instance for logging the result.
+    """
+    subject = "SMS Delivery Failure Notification\n"
+    body = f"We were unable to deliver your SMS to {sms.phone_number}. Please try again later or contact support if the problem persists."
+
+    message_content = subject + body
+
+    if sms.bot_id:
+        ReplyOutbox.objects.create(bot_id=sms.bot_id, email=sms.email, message_id=sms.email.message_id, message_content=message_content)
+    else:
+        call_command('push_emails', message_id=sms.email.message_id, message_content=message_content)
+    logger.info(f"Sent failure notification email to user {sms.email.user_id}")
+
+
+def get_stale_outbound_sms():
+    """
+    Retrieves the outbound SMS whose delivery status is still not final after `SMS_STATUS_SWEEP_AGE` minutes.
+
+    Messages that are younger than that are still followed by `check_sms_status_task`, so they are left alone.
+
+    Returns:
+        QuerySet: At most `SMS_STATUS_SWEEP_BATCH_SIZE` SMS, least recently updated first.
+    """
+    return SMS.objects.filter(
+        direction=SMS_DIRECTION_CHOICES_DICT['Outbound'],
+        status__in=[SMS_STATUS_CHOICES_DICT['Sent'], SMS_STATUS_CHOICES_DICT['Unknown']],
+        text_id__isnull=False,
+        updated_at__lt=timezone.now() - timedelta(minutes=settings.SMS_STATUS_SWEEP_AGE)
+    ).order_by('updated_at').only('id', 'text_id', 'provider', 'status', 'created_at')[:settings.SMS_STATUS_SWEEP_BATCH_SIZE]
+
+
+def fetch_sms_status(sms, logger):
+    """
+    Fetches the delivery status of a single message from the provider that sent it.
+
+    Args:
+        sms (SMS): The outbound SMS.
+        logger (logging.Logger): The logger instance for logging errors.
+
+    Returns:
+        str: The status reported by the provider (e.g. 'DELIVERED'), or None if it could not be fetched.
+    """
+    try:
+        return get_sms_router().get_status(sms.provider, sms.text_id)
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"Error occurred while checking status of SMS {sms.text_id}. Error = {e}")
+        return None
+
+
+def sweep_stale_sms_statuses(logger):
+    """
+    Reconciles outbound SMS that are stuck in 'Sent' or 'Unknown', e.g. because the worker tracking them stopped.
+
+    The statuses are fetched from the provider of every message with `SMS_STATUS_SWEEP_CONCURRENCY` parallel
+    requests that share the pooled session of `TextbeltClient`, and written back with one update per resulting status. Messages that are still not settled
+    after `SMS_STATUS_SWEEP_MAX_AGE` hours are marked as failed, so every message reaches a final status.
+    Failed messages go through `fail_stale_sms`, so the user is notified like after the last status check.
+
+    Args:
+        logger (logging.Logger): The logger instance for logging the results.
+
+    Returns:
+        dict: The number of SMS updated per status.
+    """
+    stale_sms = list(get_stale_outbound_sms())
+    if not stale_sms:
+        logger.debug('No stale SMS statuses to check.')
+        return {}
+
+    with ThreadPoolExecutor(max_workers=settings.SMS_STATUS_SWEEP_CONCURRENCY) as executor:
+        textbelt_statuses = list(executor.map(lambda sms: fetch_sms_status(sms, logger), stale_sms))
+
+    expired_before = timezone.now() - timedelta(hours=settings.SMS_STATUS_SWEEP_MAX_AGE)
+    sms_ids_by_status = {}
+    for sms, textbelt_status in zip(stale_sms, textbelt_statuses):
+        status = TEXTBELT_STATUS_TO_SMS_STATUS.get(textbelt_status, sms.status)
+        if status in [SMS_STATUS_CHOICES_DICT['Sent'], SMS_STATUS_CHOICES_DICT['Unknown']] and sms.created_at < expired_before:
+            status = SMS_STATUS_CHOICES_DICT['Failed']
+        # Unchanged messages are written too, so their updated_at moves and the next sweep starts with other messages
+        sms_ids_by_status.setdefault(status, []).append(sms.id)
+
+    updated_counts = {}
+    failed_sms_ids = sms_ids_by_status.pop(SMS_STATUS_CHOICES_DICT['Failed'], [])
+    if failed_sms_ids:
+        updated_counts[SMS_STATUS_CHOICES_DICT['Failed']] = fail_stale_sms(failed_sms_ids, logger=logger)
+    for status, sms_ids in sms_ids_by_status.items():
+        # Messages that reached a final status since they were read are left alone
+        allowed_from = [current for current, targets in SMS_STATUS_TRANSITIONS.items() if status in targets]
+        updated_counts[status] = SMS.objects.filter(id__in=sms_ids, status__in=allowed_from).update(status=status, updated_at=timezone.now())
+
+    logger.info(f"Checked {len(stale_sms)} stale SMS statuses. Updated = {updated_counts}")
+    return updated_counts
+
+
+def fail_stale_sms(sms_ids, logger):
+    """
+    Marks swept SMS as failed and lets the user know, the same way `check_sms_status` does after its last check.
+
+    Every message is moved with `set_sms_status`, so only messages that this call actually failed are
+    reported. A message that was already resent with a newer tracked attempt is superseded by it, and
+    that attempt is reported on its own, so no notification is queued for it.
+
+    Args:
+        sms_ids (list of int): The IDs of the outbound SMS to fail.
+        logger (logging.Logger): The logger instance for logging the results.
+
+    Returns:
+        int: The number of SMS that were marked as failed.
+    """
+    failed_count = 0
+    for sms in SMS.objects.select_related('email').filter(id__in=sms_ids):
+        if not set_sms_status(sms, SMS_STATUS_CHOICES_DICT['Failed']):
+            continue
+        failed_count += 1
+
+        is_superseded = SMS.objects.filter(
+            email_id=sms.email_id, contact_id=sms.contact_id, direction=SMS_DIRECTION_CHOICES_DICT['Outbound'],
+            text_id__isnull=False, id__gt=sms.id
+        ).exists()
+        if is_superseded:
+            logger.debug(f"SMS {sms.text_id} failed but was already resent. Not notifying the user again.")
+            continue
+
+        logger.error(f"SMS {sms.text_id} marked as failed by the stale status sweep.")
+        send_failure_notification_email(sms, logger=logger)
+    return failed_count
@@ -1,11 +1,18 @@
 
 from contxt.celery import CustomExceptionHandler
+from core.tasks import schedule_reply_push
+from contxt.utils.helper_functions import get_redis_client
+from sms_app.queue_service import dispatch_outbound_sms
+from sms_app.sms_service import check_sms_status, get_status_check_delay, sweep_stale_sms_statuses
 from sms_app.utils import send_quota_limit_reached_notification
+from sms_app.webhook_service import ingest_webhook_payloads
 
 from django.core.management import call_command
 from django.conf import settings
 
 from celery import shared_task
+import logging
+import os
 
 
 @shared_task(base=CustomExceptionHandler, bind=True, queue='scheduling_queue')
@@ -49,3 +56,89 @@ def send_quota_limit_reached_email_task(self, quota_limit=0):
             self.retry(exc=e, countdown=60, max_retries=3)
     else:
         print('SMS sending quota limit has been reached.')
+
+@shared_task(base=CustomExceptionHandler, bind=True, queue='sms_status_queue')
+def check_sms_status_task(self, sms_id, check_count=0, retry_count=0):
+    """
+    Celery task to check the delivery status of an outbound SMS.
+
+    The task runs shortly after the SMS was sent and schedules itself again with an exponential backoff
+    (see `get_status_check_delay`) while the status is not final. The wait happens in the broker, so it
+    takes no worker time and never blocks the send sms stage of the bot.
+
+    Args:
+        self (Task): The current task instance. Used for exception handling.
+        sms_id (int): The ID of the outbound SMS.
+        check_count (int): How many times the status of this SMS has been checked already.
+        retry_count (int): How many times the message has been resent already.
+
+    Notes:
+        - The task uses `CustomExceptionHandler` to handle any exceptions that occur during execution.
+        - The task is bound to the 'sms_status_queue' queue, so status checks never wait behind the send sms stages.
+    """
+    next_check = check_sms_status(sms_id=sms_id, check_count=check_count, retry_count=retry_count)
+    if next_check:
+        countdown = next_check.pop('countdown')
+        check_sms_status_task.apply_async(kwargs=next_check, countdown=countdown)
+
+@shared_task(base=CustomExceptionHandler, bind=True, queue='sms_status_queue')
+def sweep_stale_sms_statuses_task(self):
+    """
+    Periodic Celery task that reconciles the delivery status of outbound SMS stuck in 'Sent' or 'Unknown'.
+
+    Args:
+        self (Task): The current task instance. Used for exception handling.
+
+    Notes:
+        - A Redis lock makes sure only one sweep runs at a time.
+        - The task is bound to the 'sms_status_queue' queue.
+    """
+    logger = logging.getLogger('send_sms')
+    lock = get_redis_client().lock('sms_status_sweep_lock', timeout=settings.BOT_STAGE_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        logger.warning('SMS status sweep is already running.')
+        return
+
+    try:
+        sweep_stale_sms_statuses(logger=logger)
+    finally:
+        lock.release()
+
+@shared_task(base=CustomExceptionHandler, bind=True, queue='send_sms_queue')
+def dispatch_outbound_sms_task(self):
+    """
+    Celery task that sends the messages waiting in the outbound SMS queue.
+
+    Any number of these tasks can run at the same time on any worker, every one of them claims its own
+    batches of messages, so sending scales with the number of workers instead of the number of bots.
+    The first delivery status check of every sent message is scheduled here.
+
+    Args:
+        self (Task): The current task instance. Used for exception handling.
+
+    Notes:
+        - The task uses `CustomExceptionHandler` to handle any exceptions that occur during execution.
+        - The task is bound to the 'send_sms_queue' queue.
+    """
+    for sms in dispatch_outbound_sms(logger=logging.getLogger('send_sms')):
+        check_sms_status_task.apply_async(kwargs={'sms_id': sms.id}, countdown=get_status_check_delay(0))
+
+@shared_task(base=CustomExceptionHandler, bind=True, queue='sms_webhook_queue')
+def ingest_sms_webhooks_task(self):
+    """
+    Celery task that stores the SMS replies put on the webhook stream by `textbelt_webhook`.
+
+    The webhook queues this task once per burst of replies, so every run stores many replies with a
+    few queries. It also runs periodically to store replies a stopped worker left unacknowledged.
+    Every bot that received replies gets a push queued, see `schedule_reply_push`.
+
+    Args:
+        self (Task): The current task instance. Used for exception handling.
+
+    Notes:
+        - The task uses `CustomExceptionHandler` to handle any exceptions that occur during execution.
+        - The task is bound to the 'sms_webhook_queue' queue, so replies are stored even while the other queues are busy.
+    """
+    inbound_sms = ingest_webhook_payloads(consumer_name=f'{self.request.hostname}_{os.getpid()}', logger=logging.getLogger('sms_webhook'))
+    for bot_id in {sms.bot_id for sms in inbound_sms if sms.bot_id}:
+        schedule_reply_push(bot_id)
@@ -1,3 +1,158 @@
-from django.test import TestCase
+from accounts.models import BotAccount, User
+from core.models import Contact
+from process_emails.models import Email, ReplyOutbox
+from sms_app.models import SMS, OutboundSMS
+from sms_app.queue_service import enqueue_outbound_sms, claim_outbound_sms, send_claimed_sms
+from sms_app.sms_router import is_connect_failure
+from sms_app.sms_service import sweep_stale_sms_statuses
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from datetime import timedelta
+from unittest.mock import Mock, patch
+from urllib3.exceptions import MaxRetryError, NameResolutionError, NewConnectionError, ProtocolError
+import logging
+import requests
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CELERY_ENABLED=False, SMS_STATUS_SWEEP_AGE=10, SMS_STATUS_SWEEP_MAX_AGE=24)
+class SweepStaleSmsStatusesTests(TestCase):
+    """
+    Covers how `sweep_stale_sms_statuses` settles outbound SMS that are no longer tracked.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bot = BotAccount.objects.create(bot_name='bot1', email_address='bot1@example.com')
+        cls.user = User.objects.create(user_name='user1', name='User 1', pic_number='00000001')
+        cls.contact = Contact.objects.create(user=cls.user, contact_name='Contact 1', phone_number='5555550100')
+        cls.email = Email.objects.create(
+            user=cls.user, bot=cls.bot, message_id='message1', subject='text Contact 1', body='Hello', sent_date_time=timezone.now()
+        )
+
+    def create_sms(self, text_id, status='Sent', age=timedelta(hours=1)):
+        """
+        Creates an outbound SMS that was created `age` ago and last updated at the same time.
+        """
+        sms = SMS.objects.create(
+            contact=self.contact, email=self.email, bot=self.bot, message='Hello', text_id=text_id,
+            phone_number='5555550100', direction='Outbound', status=status, is_processed=True
+        )
+        SMS.objects.filter(id=sms.id).update(created_at=timezone.now() - age, updated_at=timezone.now() - age)
+        return sms
+
+    def sweep(self, textbelt_status):
+        with patch('sms_app.sms_service.fetch_sms_status', return_value=textbelt_status):
+            return sweep_stale_sms_statuses(logger=logging.getLogger('send_sms'))
+
+    def test_failed_sms_notifies_the_user(self):
+        sms = self.create_sms('text1')
+
+        self.assertEqual(self.sweep('FAILED'), {'Failed': 1})
+
+        sms.refresh_from_db()
+        self.assertEqual(sms.status, 'Failed')
+        reply = ReplyOutbox.objects.get()
+        self.assertEqual(reply.message_id, 'message1')
+        self.assertIn('unable to deliver your SMS to 5555550100', reply.message_content)
+
+    def test_expired_sms_notifies_the_user(self):
+        self.create_sms('text1', age=timedelta(hours=25))
+
+        self.assertEqual(self.sweep('SENT'), {'Failed': 1})
+        self.assertEqual(ReplyOutbox.objects.count(), 1)
+
+    def test_resent_sms_does_not_notify_twice(self):
+        self.create_sms('text1', status='Unknown', age=timedelta(hours=25))
+        self.create_sms('text2', status='Delivered')
+
+        self.assertEqual(self.sweep('FAILED'), {'Failed': 1})
+        self.assertFalse(ReplyOutbox.objects.exists())
+
+    def test_unsettled_sms_is_not_failed(self):
+        sms = self.create_sms('text1')
+
+        self.assertEqual(self.sweep('SENT'), {'Sent': 1})
+
+        sms.refresh_from_db()
+        self.assertEqual(sms.status, 'Sent')
+        self.assertFalse(ReplyOutbox.objects.exists())
+
+
+class IsConnectFailureTests(SimpleTestCase):
+    """
+    Covers which failed send requests are known to have never reached the provider.
+    """
+
+    def connection_error(self, reason):
+        return requests.ConnectionError(MaxRetryError(pool=None, url='/text', reason=reason))
+
+    def test_connect_phase_failures(self):
+        self.assertTrue(is_connect_failure(requests.ConnectTimeout('timed out')))
+        self.assertTrue(is_connect_failure(self.connection_error(NameResolutionError('textbelt.com', None, 'no such host'))))
+        self.assertTrue(is_connect_failure(self.connection_error(NewConnectionError(None, 'connection refused'))))
+
+    def test_failures_after_the_request_was_sent(self):
+        self.assertFalse(is_connect_failure(requests.ReadTimeout('read timed out')))
+        self.assertFalse(is_connect_failure(self.connection_error(ProtocolError('connection aborted'))))
+        self.assertFalse(is_connect_failure(requests.ConnectionError('connection reset')))
+        self.assertFalse(is_connect_failure(requests.RequestException('bad response')))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CELERY_ENABLED=False)
+class OutboundSmsQueueTests(TestCase):
+    """
+    Covers how queued messages are added and how unconfirmed sends are recorded.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bot = BotAccount.objects.create(bot_name='bot1', email_address='bot1@example.com')
+        cls.user = User.objects.create(user_name='user1', name='User 1', pic_number='00000001')
+        cls.contact = Contact.objects.create(user=cls.user, contact_name='Contact 1', phone_number='5555550100')
+        cls.emails = [
+            Email.objects.create(
+                user=cls.user, bot=cls.bot, message_id=f'message{index}', subject='text Contact 1', body='Hello', sent_date_time=timezone.now()
+            )
+            for index in range(2)
+        ]
+
+    def outgoing_messages(self, emails):
+        return [{'email': email, 'contact': self.contact, 'message_body': 'Hello'} for email in emails]
+
+    def test_enqueue_counts_only_added_messages(self):
+        self.assertEqual(enqueue_outbound_sms(self.outgoing_messages(self.emails[:1]), bot=self.bot), 1)
+        self.assertEqual(enqueue_outbound_sms(self.outgoing_messages(self.emails), bot=self.bot), 1)
+        self.assertEqual(OutboundSMS.objects.count(), 2)
+
+    def send_queued_sms(self, error):
+        enqueue_outbound_sms(self.outgoing_messages(self.emails[:1]), bot=self.bot)
+        router = Mock()
+        router.send_many.return_value = [('textbelt', error)]
+        with patch('sms_app.queue_service.get_sms_router', return_value=router), \
+                patch('sms_app.queue_service.reserve_send_key', return_value=(True, None, None)), \
+                patch('sms_app.queue_service.release_send_key') as release_send_key, \
+                patch('sms_app.queue_service.cache_outbound_sms_context'):
+            send_claimed_sms(claim_outbound_sms(), logger=logging.getLogger('send_sms'))
+        return OutboundSMS.objects.get(), release_send_key
+
+    def test_failed_dns_lookup_is_retried(self):
+        error = requests.ConnectionError(MaxRetryError(pool=None, url='/text', reason=NameResolutionError('textbelt.com', None, 'no such host')))
+
+        outbound, release_send_key = self.send_queued_sms(error)
+
+        self.assertEqual(outbound.status, 'pending')
+        release_send_key.assert_called_once()
+        self.assertFalse(SMS.objects.exists())
+
+    def test_unknown_outcome_is_recorded(self):
+        outbound, release_send_key = self.send_queued_sms(requests.ReadTimeout('read timed out'))
+
+        self.assertEqual(outbound.status, 'unknown')
+        release_send_key.assert_not_called()
+        self.assertEqual(outbound.sms.status, 'Unknown')
+        self.assertIsNone(outbound.sms.text_id)
@@ -0,0 +1,207 @@
+from contxt.utils.helper_functions import get_redis_client
+from sms_app.utils import generate_webhook_token
+
+from django.conf import settings
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import requests
+import time
+
+
+class SMSRateLimiter:
+    """
+    A rate limiter shared by every worker and bot, backed by Redis.
+
+    Sends are counted in one second windows. When the limit of the current window is reached the caller
+    waits for the next window, so the provider limit holds no matter how many workers are sending.
+
+    Attributes:
+        key (str): The prefix of the Redis keys that hold the counters.
+        limit_per_second (int): The maximum number of sends per second.
+        max_wait (int): The maximum number of seconds to wait for a free slot.
+    """
+
+    def __init__(self, key, limit_per_second, max_wait):
+        self.key = key
+        self.limit_per_second = limit_per_second
+        self.max_wait = max_wait
+        self.redis_client = get_redis_client()
+
+    def acquire(self):
+        """
+        Waits until a send is allowed in the current window.
+
+        Returns:
+            bool: True if a slot was acquired, False if `max_wait` seconds passed without a free slot.
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            window = int(time.time())
+            window_key = f'{self.key}:{window}'
+
+            pipeline = self.redis_client.pipeline()
+            pipeline.incr(window_key)
+            pipeline.expire(window_key, 2)
+            count, _ = pipeline.execute()
+
+            if count <= self.limit_per_second:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(max(window + 1 - time.time(), 0.01))
+
+
+class TextbeltClient:
+    """
+    Sends SMS and reads their status from Textbelt over a pooled keep-alive session.
+
+    A single session is shared by all threads of the process, so connections to Textbelt are reused
+    instead of opening a new TCP/TLS connection for every message. `send_many` sends a batch of messages
+    with `SMS_DISPATCH_CONCURRENCY` parallel requests while `SMSRateLimiter` keeps all of them below
+    `SMS_RATE_LIMIT_PER_SECOND`.
+    """
+
+    name = 'textbelt'
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(settings.SMS_DISPATCH_CONCURRENCY, settings.SMS_STATUS_SWEEP_CONCURRENCY))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.rate_limiter = SMSRateLimiter(
+            key='sms_rate_limit',
+            limit_per_second=settings.SMS_RATE_LIMIT_PER_SECOND,
+            max_wait=settings.SMS_RATE_LIMIT_MAX_WAIT
+        )
+
+    def send(self, to_number, message_body):
+        """
+        Sends a single SMS.
+
+        Args:
+            to_number (str): The phone number to send the message to.
+            message_body (str): The content of the message.
+
+        Returns:
+            dict: The JSON response of Textbelt (with 'success', 'textId', 'quotaRemaining' or 'error'),
+            or None if no slot was free within `SMS_RATE_LIMIT_MAX_WAIT` seconds and nothing was sent.
+
+        Raises:
+            requests.RequestException: If the request to Textbelt failed.
+        """
+        if not self.acquire_send_slot():
+            return None
+        return self.post_message(to_number, message_body)
+
+    def acquire_send_slot(self):
+        """
+        Waits for a free send slot of the rate limit, see `SMSRateLimiter.acquire`.
+
+        Returns:
+            bool: True if a slot was acquired, False if no slot was free within `SMS_RATE_LIMIT_MAX_WAIT` seconds.
+        """
+        return self.rate_limiter.acquire()
+
+    def post_message(self, to_number, message_body):
+        """
+        Sends a single SMS without waiting for the rate limit. The caller has to hold a send slot
+        (see `acquire_send_slot`).
+
+        Args:
+            to_number (str): The phone number to send the message to.
+            message_body (str): The content of the message.
+
+        Returns:
+            dict: The JSON response of Textbelt, see `send`.
+
+        Raises:
+            requests.RequestException: If the request to Textbelt failed.
+        """
+        payload = {
+            'phone': to_number,
+            'message': message_body,
+            'key': settings.API_KEY,
+            'replyWebhookUrl': settings.REPLY_WEBHOOK_URL,
+            'webhookData' : generate_webhook_token({"timestamp": int(time.time())})
+        }
+        response = self.session.post(settings.SMS_SEND_URL, data=payload, timeout=settings.SMS_REQUEST_TIMEOUT)
+        return response.json()
+
+    def send_many(self, messages, logger):
+        """
+        Sends a batch of SMS concurrently.
+
+        Args:
+            messages (list of tuple): The (to_number, message_body) of every message.
+            logger (logging.Logger): The logger instance for logging failed requests.
+
+        Returns:
+            list: The result of every message in the same order as `messages`. A result is the Textbelt
+            response, None if the message was not sent because of the rate limit, or the
+            `requests.RequestException` raised while sending it.
+        """
+        def send_message(message):
+            to_number, message_body = message
+            try:
+                return self.send(to_number, message_body)
+            except requests.RequestException as e:
+                logger.error(f"Request failed: {str(e)}")
+                return e
+            except ValueError as e:
+                logger.error(f"Request failed: {str(e)}")
+                return requests.RequestException(str(e))
+
+        if not messages:
+            return []
+        with ThreadPoolExecutor(max_workers=min(settings.SMS_DISPATCH_CONCURRENCY, len(messages))) as executor:
+            return list(executor.map(send_message, messages))
+
+    def get_status(self, text_id):
+        """
+        Fetches the delivery status of a single message.
+
+        Args:
+            text_id (str): The Textbelt ID of the message.
+
+        Returns:
+            str: The status reported by Textbelt (e.g. 'DELIVERED').
+
+        Raises:
+            requests.RequestException: If the request to Textbelt failed.
+        """
+        response = self.session.get(settings.SMS_STATUS_URL.format(text_id), timeout=settings.SMS_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json().get('status')
+
+    def get_quota(self, api_key=None):
+        """
+        Fetches the remaining quota of an API key.
+
+        Args:
+            api_key (str, optional): The Textbelt API key. Defaults to `API_KEY`.
+
+        Returns:
+            dict: The JSON response of Textbelt (with 'success' and 'quotaRemaining').
+
+        Raises:
+            requests.RequestException: If the request to Textbelt failed.
+        """
+        response = self.session.get(settings.SMS_QUOTA_URL.format(api_key or settings.API_KEY), timeout=settings.SMS_REQUEST_TIMEOUT)
+        return response.json()
+
+
+_textbelt_client = None
+
+
+def get_textbelt_client():
+    """
+    Returns the `TextbeltClient` of this process, creating it on first use.
+
+    Returns:
+        TextbeltClient: The shared client.
+    """
+    global _textbelt_client
+    if _textbelt_client is None:
+        _textbelt_client = TextbeltClient()
+    return _textbelt_client
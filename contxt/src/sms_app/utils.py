@@ -1,6 +1,7 @@
 
 from core.models import Contact
 from sms_app.models import SMS
+from sms_app.webhook_service import cache_outbound_sms_context
 
 from django.conf import settings
 from django.core.mail import send_mail
@@ -37,19 +38,23 @@ def get_to_number_from_message_subject(subject=None):
 
     return to_number
 
-def log_sms_to_database(contact_id, message_body, text_id, to_number, direction, status, is_processed, email, bot=None):
+def log_sms_to_database(contact_id, message_body, text_id, to_number, direction, status, is_processed, email, bot=None, provider='textbelt'):
     contact = Contact.objects.filter(id=contact_id).first()
-    SMS.objects.create(
+    sms = SMS.objects.create(
         contact = contact,
         bot = bot,
         email = email,
         message = message_body,
         text_id = text_id,
+        provider = provider,
         phone_number = to_number,
         direction = direction,
         status = status,
         is_processed = is_processed
     )
+    # Lets the reply webhook find the email and contact of the SMS without the database
+    cache_outbound_sms_context([sms])
+    return sms
 
 def log_incoming_request(request, logger):
     logger.debug(f'----------------------------------------------')
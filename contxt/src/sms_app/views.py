@@ -1,8 +1,13 @@
 
-from sms_app.models import SMS
+from core.tasks import schedule_reply_push
+from sms_app.tasks import ingest_sms_webhooks_task
+from sms_app.webhook_service import (
+    enqueue_webhook_payload, clear_webhook_ingest_schedule, get_outbound_sms_contexts, build_inbound_sms,
+    reserve_webhook_reply, release_webhook_reply
+)
 from sms_app.utils import log_incoming_request, validate_webhook_token, get_webhook_schema
 from sms_app.constants import OPERATIONAL_DESCRIPTION
-from contxt.utils.constants import SMS_DIRECTION_CHOICES, SMS_STATUS_CHOICES, CURRENT_TASKS_RUN_BY_BOTS
+from contxt.utils.constants import CURRENT_TASKS_RUN_BY_BOTS
 
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -15,10 +20,6 @@ from drf_yasg import openapi
 import logging
 
 
-SMS_STATUS_CHOICES_DICT = dict(SMS_STATUS_CHOICES)
-SMS_DIRECTION_CHOICES_DICT = dict(SMS_DIRECTION_CHOICES)
-
-
 @swagger_auto_schema(
     method='post',
     operation_description=OPERATIONAL_DESCRIPTION,
@@ -28,7 +29,8 @@ SMS_DIRECTION_CHOICES_DICT = dict(SMS_DIRECTION_CHOICES)
             type=openapi.TYPE_OBJECT,
             properties={
                 'email': openapi.Schema(type=openapi.TYPE_STRING, description='The email address associated with the SMS'),
-                'contact': openapi.Schema(type=openapi.TYPE_STRING, description='The name of the contact associated with the SMS')
+                'contact': openapi.Schema(type=openapi.TYPE_STRING, description='The name of the contact associated with the SMS'),
+                'queued': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='Returned instead of email and contact in fast ack mode, False for an empty request or a replayed reply')
             }
         )),
         400: openapi.Response('Bad request', openapi.Schema(
@@ -54,32 +56,61 @@ def textbelt_webhook(request):
     # Extract incoming data from the request
     incoming_data = request.data
 
+    # In fast ack mode the reply is only validated and queued, `ingest_sms_webhooks_task` stores it in a batch later
+    if settings.SMS_WEBHOOK_FAST_ACK and settings.CELERY_ENABLED:
+        if not incoming_data:
+            return Response({'queued': False})
+
+        if settings.TEST_MODE == False:
+            token = incoming_data.get('data', None)
+            if not token or not validate_webhook_token(token):
+                logging.getLogger('sms_webhook').error(f"Invalid or expired token in webhook request. Incoming data was = {incoming_data}")
+                return Response({'error': 'Invalid or expired token'}, status=status.HTTP_403_FORBIDDEN)
+
+        # A reply delivered again by Textbelt is acknowledged without queueing it twice
+        if not reserve_webhook_reply(incoming_data):
+            logging.getLogger('sms_webhook').warning(f"Ignoring replayed webhook for text_id {incoming_data.get('textId', None)}")
+            return Response({'queued': False})
+
+        try:
+            schedule_ingest = enqueue_webhook_payload({key: incoming_data.get(key) for key in incoming_data})
+        except Exception:
+            # Textbelt retries the webhook, which must not be taken for a replay
+            release_webhook_reply(incoming_data)
+            raise
+
+        # Only the first reply of a burst queues the consumer, the others are stored by the same run
+        if schedule_ingest:
+            try:
+                ingest_sms_webhooks_task.apply_async(countdown=settings.SMS_WEBHOOK_INGEST_DELAY)
+            except Exception as e:
+                # The reply is already in the stream, the periodic ingest task stores it
+                clear_webhook_ingest_schedule()
+                logging.getLogger('sms_webhook').error(f"Could not queue the SMS webhook ingest task. Error = {e}")
+        return Response({'queued': True})
+
     # Initialize variables to hold email, contact, error state, and response status code
     email = None
     contact = None
     error_occured = False
     status_code = status.HTTP_200_OK
 
+    logger = logging.getLogger('sms_webhook')
+
     # Check if there is any incoming data
     if incoming_data:
         try:
-            # Try to find the outbound SMS object using the text ID from incoming data
-            outbound_sms_obj = SMS.objects.filter(
-                text_id=incoming_data.get('textId', None),
-                direction=SMS_DIRECTION_CHOICES_DICT['Outbound']
-            ).order_by('-created_at').first()
-
-            # If no outbound SMS object is found, log the error and raise a ValueError
-            if not outbound_sms_obj:
-                logger = logging.getLogger('sms_webhook')
+            # Resolve the outbound SMS from the context cached when it was sent, or from the database
+            outbound_context = get_outbound_sms_contexts([incoming_data.get('textId', None)]).get(incoming_data.get('textId', None))
+
+            # If no outbound SMS is found, log the error and raise a ValueError
+            if not outbound_context:
                 logger.error(f"No outbound SMS found for text_id = {incoming_data.get('textId', None)}")
                 raise ValueError(f"No outbound SMS found for textid {incoming_data.get('textId', None)}")
 
             # Set up the logger depending on whether the SMS is associated with a bot
-            if outbound_sms_obj.bot:
-                logger = logging.getLogger(f'bot_{outbound_sms_obj.bot.id}_{command_name}')
-            else:
-                logger = logging.getLogger('sms_webhook')
+            if outbound_context['bot_id']:
+                logger = logging.getLogger(f"bot_{outbound_context['bot_id']}_{command_name}")
 
             # Log the incoming request for debugging or audit purposes
             log_incoming_request(request=request, logger=logger)
@@ -97,28 +128,31 @@ def textbelt_webhook(request):
                     # If no token is present in the incoming data, return a 403 response
                     return Response({'error': 'Invalid or expired token'}, status=status.HTTP_403_FORBIDDEN)
 
-            # Log the outbound SMS object for debugging purposes
-            logger.debug(f'Outbound SMS object = {outbound_sms_obj}')
-
-            # Extract the email and contact information from the outbound SMS object
-            email = outbound_sms_obj.email
-            contact = outbound_sms_obj.contact
-
-            # If both email and contact are present, create a new inbound SMS object
-            if email and contact:
-                inbound_sms_obj = SMS.objects.create(
-                    bot=outbound_sms_obj.bot,
-                    email=email,
-                    contact=contact,
-                    message=incoming_data.get('text', None),
-                    text_id=incoming_data.get('textId', None),
-                    phone_number=incoming_data.get('fromNumber', None),
-                    direction=SMS_DIRECTION_CHOICES_DICT['Inbound'],
-                    status=SMS_STATUS_CHOICES_DICT['Delivered']
-                )
+            # Log the outbound SMS context for debugging purposes
+            logger.debug(f'Outbound SMS context = {outbound_context}')
+
+            # Extract the email message ID and contact name from the outbound SMS context
+            email = outbound_context['message_id']
+            contact = outbound_context['contact_name']
+
+            # A reply delivered again by Textbelt is acknowledged without storing it twice
+            if not reserve_webhook_reply(incoming_data):
+                logger.warning(f"Ignoring replayed webhook for text_id {incoming_data.get('textId', None)}")
+            else:
+                try:
+                    inbound_sms_obj = build_inbound_sms(incoming_data, outbound_context)
+                    inbound_sms_obj.save()
+                except Exception:
+                    # Textbelt retries the webhook, which must not be taken for a replay
+                    release_webhook_reply(incoming_data)
+                    raise
                 # Log the creation of the new inbound SMS object
                 logger.debug(f"SMS inbound object created. Data = {inbound_sms_obj}")
 
+                # Forward the reply to Corrlinks without waiting for the next scheduled push
+                if settings.CELERY_ENABLED and inbound_sms_obj.bot_id:
+                    schedule_reply_push(inbound_sms_obj.bot_id)
+
         except Exception as e:
             # If any exception occurs, set error_occured to True and log the error
             error_occured = True
@@ -129,7 +163,7 @@ def textbelt_webhook(request):
         status_code = status.HTTP_400_BAD_REQUEST
 
     # Return a response containing the email message ID and contact name, if available
-    return Response({'email': email.message_id if email else False, 'contact': contact.contact_name if contact else False}, status=status_code)
+    return Response({'email': email if email else False, 'contact': contact if contact else False}, status=status_code)
 
 
 
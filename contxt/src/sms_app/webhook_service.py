@@ -0,0 +1,351 @@
+from contxt.utils.helper_functions import get_redis_client
+from sms_app.models import SMS
+from contxt.utils.constants import SMS_DIRECTION_CHOICES, SMS_STATUS_CHOICES, CURRENT_TASKS_RUN_BY_BOTS
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+
+import hashlib
+import json
+import logging
+import redis
+
+
+SMS_STATUS_CHOICES_DICT = dict(SMS_STATUS_CHOICES)
+SMS_DIRECTION_CHOICES_DICT = dict(SMS_DIRECTION_CHOICES)
+
+SMS_WEBHOOK_STREAM_KEY = 'sms_webhook_stream'
+SMS_WEBHOOK_DEAD_LETTER_KEY = 'sms_webhook_dead_letter'
+SMS_WEBHOOK_CONSUMER_GROUP = 'sms_webhook_consumers'
+SMS_WEBHOOK_INGEST_SCHEDULED_KEY = 'sms_webhook_ingest_scheduled'
+SMS_WEBHOOK_REPLY_KEY = 'sms_webhook_reply_{}_{}'
+SMS_OUTBOUND_CONTEXT_KEY = 'sms_outbound_context_{}'
+
+
+def get_webhook_logger(bot_id=None):
+    """
+    Returns the logger used for the SMS replies of a bot.
+
+    Args:
+        bot_id (int, optional): The ID of the bot. The generic 'sms_webhook' logger is used without it.
+
+    Returns:
+        logging.Logger: The logger instance.
+    """
+    if bot_id:
+        return logging.getLogger(f"bot_{bot_id}_{CURRENT_TASKS_RUN_BY_BOTS['receive_sms']}")
+    return logging.getLogger('sms_webhook')
+
+
+def build_outbound_sms_context(sms):
+    """
+    Builds what a reply to an outbound SMS needs to know about it.
+
+    Args:
+        sms (SMS): The outbound SMS, with its email and contact loaded.
+
+    Returns:
+        dict: The IDs of its bot, email and contact, the message ID of the email, the name of the contact
+        and the provider that sent it.
+    """
+    return {
+        'bot_id': sms.bot_id,
+        'email_id': sms.email_id,
+        'message_id': sms.email.message_id,
+        'contact_id': sms.contact_id,
+        'contact_name': sms.contact.contact_name,
+        'provider': sms.provider,
+    }
+
+
+def cache_outbound_sms_context(sms_list):
+    """
+    Stores the context of sent outbound SMS by text ID, so their replies are resolved without the database.
+    The contexts expire after `SMS_OUTBOUND_CONTEXT_TTL` seconds.
+
+    Args:
+        sms_list (list): The stored outbound `SMS`, with their email and contact loaded. SMS without a
+            text ID (not sent) are ignored.
+    """
+    sms_list = [sms for sms in sms_list if sms.text_id and sms.direction == SMS_DIRECTION_CHOICES_DICT['Outbound']]
+    if not sms_list:
+        return
+
+    pipeline = get_redis_client().pipeline()
+    for sms in sms_list:
+        pipeline.set(SMS_OUTBOUND_CONTEXT_KEY.format(sms.text_id), json.dumps(build_outbound_sms_context(sms)), ex=settings.SMS_OUTBOUND_CONTEXT_TTL)
+    try:
+        pipeline.execute()
+    except redis.RedisError as e:
+        # Replies to these SMS are resolved from the database instead
+        logging.getLogger('sms_webhook').warning(f"Could not cache the context of {len(sms_list)} outbound SMS. Error = {e}")
+
+
+def get_outbound_sms_contexts(text_ids, use_cache=True):
+    """
+    Resolves the outbound SMS a batch of replies answer.
+
+    The contexts are read from Redis with one call, and the text IDs missing there (e.g. sent before the
+    cache existed, or expired) are read from the database with one query and cached again.
+
+    Args:
+        text_ids (iterable): The text IDs of the replies.
+        use_cache (bool): Whether to read the cached contexts. False resolves every text ID from the database.
+
+    Returns:
+        dict: The context of every resolved text ID (see `build_outbound_sms_context`), keyed by text ID.
+    """
+    text_ids = list({text_id for text_id in text_ids if text_id})
+    if not text_ids:
+        return {}
+
+    contexts = {}
+    if use_cache:
+        cached = get_redis_client().mget([SMS_OUTBOUND_CONTEXT_KEY.format(text_id) for text_id in text_ids])
+        contexts = {text_id: json.loads(context) for text_id, context in zip(text_ids, cached) if context}
+
+    missing = [text_id for text_id in text_ids if text_id not in contexts]
+    if missing:
+        outbound_sms_by_text_id = {}
+        for outbound_sms in SMS.objects.filter(
+            text_id__in=missing, direction=SMS_DIRECTION_CHOICES_DICT['Outbound']
+        ).select_related('email', 'contact').order_by('-created_at'):
+            # The latest outbound SMS of a text ID is the one that was answered
+            outbound_sms_by_text_id.setdefault(outbound_sms.text_id, outbound_sms)
+
+        cache_outbound_sms_context(list(outbound_sms_by_text_id.values()))
+        contexts.update({text_id: build_outbound_sms_context(sms) for text_id, sms in outbound_sms_by_text_id.items()})
+
+    return contexts
+
+
+def reserve_webhook_reply(payload):
+    """
+    Records a reply webhook, so the same reply delivered again within `SMS_WEBHOOK_REPLAY_WINDOW` seconds is ignored.
+
+    A reply is identified by its text ID, sender and text, so different replies to the same SMS are all kept.
+    Textbelt sends no id or timestamp per reply, so the same text sent twice by the user within the window
+    looks like a replay. That is why the window only covers the few minutes Textbelt retries a webhook.
+
+    Args:
+        payload (dict): The request data of the webhook.
+
+    Returns:
+        bool: True if the reply is new, False if it is a replay.
+    """
+    return bool(get_redis_client().set(get_webhook_reply_key(payload), 1, nx=True, ex=settings.SMS_WEBHOOK_REPLAY_WINDOW))
+
+
+def release_webhook_reply(payload):
+    """
+    Forgets a reply that could not be stored, so a retry of its webhook is accepted.
+
+    Args:
+        payload (dict): The request data of the webhook.
+    """
+    get_redis_client().delete(get_webhook_reply_key(payload))
+
+
+def get_webhook_reply_key(payload):
+    """
+    Builds the Redis key that identifies a reply webhook.
+    """
+    digest = hashlib.sha256(f"{payload.get('fromNumber')}:{payload.get('text')}".encode()).hexdigest()
+    return SMS_WEBHOOK_REPLY_KEY.format(payload.get('textId'), digest)
+
+
+def enqueue_webhook_payload(payload):
+    """
+    Appends the payload of a Textbelt reply webhook to the webhook stream.
+
+    Args:
+        payload (dict): The request data of the webhook.
+
+    Returns:
+        bool: True if a consumer run has to be scheduled, False if one is already scheduled.
+    """
+    redis_client = get_redis_client()
+    redis_client.xadd(SMS_WEBHOOK_STREAM_KEY, {'payload': json.dumps(payload)}, maxlen=settings.SMS_WEBHOOK_STREAM_MAX_LENGTH, approximate=True)
+    # Replies of a burst are picked up by the same consumer run
+    return bool(redis_client.set(SMS_WEBHOOK_INGEST_SCHEDULED_KEY, 1, nx=True, ex=settings.SMS_WEBHOOK_INGEST_DELAY + 60))
+
+
+def clear_webhook_ingest_schedule():
+    """
+    Forgets that a consumer run is scheduled, so the next reply schedules one again.
+    """
+    get_redis_client().delete(SMS_WEBHOOK_INGEST_SCHEDULED_KEY)
+
+
+def read_webhook_payloads(redis_client, consumer_name):
+    """
+    Reads the next batch of webhook payloads for a consumer of the webhook consumer group.
+
+    Payloads read by a consumer that did not acknowledge them within `SMS_WEBHOOK_CLAIM_IDLE` seconds
+    (e.g. because its worker stopped) are claimed first, so every payload is stored at least once.
+
+    Args:
+        redis_client (redis.Redis): The Redis client.
+        consumer_name (str): The name of the consumer.
+
+    Returns:
+        list: The (entry_id, payload) of every read entry.
+    """
+    try:
+        redis_client.xgroup_create(SMS_WEBHOOK_STREAM_KEY, SMS_WEBHOOK_CONSUMER_GROUP, id='0', mkstream=True)
+    except redis.ResponseError:
+        # The group already exists
+        pass
+
+    _, entries, _ = redis_client.xautoclaim(
+        SMS_WEBHOOK_STREAM_KEY, SMS_WEBHOOK_CONSUMER_GROUP, consumer_name,
+        min_idle_time=settings.SMS_WEBHOOK_CLAIM_IDLE * 1000, start_id='0-0', count=settings.SMS_WEBHOOK_BATCH_SIZE
+    )
+    if not entries:
+        response = redis_client.xreadgroup(
+            SMS_WEBHOOK_CONSUMER_GROUP, consumer_name, {SMS_WEBHOOK_STREAM_KEY: '>'}, count=settings.SMS_WEBHOOK_BATCH_SIZE
+        )
+        entries = response[0][1] if response else []
+
+    return [(entry_id, json.loads(fields[b'payload'])) for entry_id, fields in entries]
+
+
+def store_inbound_sms(payloads, use_cache=True):
+    """
+    Stores the SMS replies of a batch of webhook payloads.
+
+    The outbound SMS the replies answer are resolved from the cached contexts (see
+    `get_outbound_sms_contexts`), and the inbound SMS are created with one bulk insert. If the insert
+    fails, the replies are stored one by one so a single bad payload (e.g. without text) does not hold
+    back the rest of its batch. Payloads that cannot be stored are moved to the dead letter stream.
+
+    Args:
+        payloads (list of dict): The webhook payloads.
+        use_cache (bool): Whether to resolve the outbound SMS from the cached contexts.
+
+    Returns:
+        list: The created inbound `SMS`.
+    """
+    contexts = get_outbound_sms_contexts([payload.get('textId') for payload in payloads], use_cache=use_cache)
+
+    inbound_sms = []
+    for payload in payloads:
+        context = contexts.get(payload.get('textId'))
+        if not context:
+            get_webhook_logger().error(f"No outbound SMS found for text_id = {payload.get('textId')}")
+            continue
+
+        logger = get_webhook_logger(context['bot_id'])
+        logger.debug(f'Webhook payload = {payload}')
+        inbound_sms.append((payload, build_inbound_sms(payload, context)))
+
+    try:
+        with transaction.atomic():
+            return SMS.objects.bulk_create([sms for _, sms in inbound_sms])
+    except IntegrityError:
+        if use_cache:
+            # A cached context can outlive its email or contact, so the batch is resolved from the database instead
+            get_redis_client().delete(*[SMS_OUTBOUND_CONTEXT_KEY.format(sms.text_id) for _, sms in inbound_sms])
+            return store_inbound_sms(payloads, use_cache=False)
+    except DatabaseError:
+        pass
+
+    get_webhook_logger().warning(f"Could not store {len(inbound_sms)} SMS replies at once, storing them one by one.")
+    return save_inbound_sms_one_by_one(inbound_sms)
+
+
+def save_inbound_sms_one_by_one(inbound_sms):
+    """
+    Saves inbound SMS one at a time, moving the payloads of those that fail to the dead letter stream.
+
+    Args:
+        inbound_sms (list of tuple): The (payload, unsaved `SMS`) of every reply.
+
+    Returns:
+        list: The created inbound `SMS`.
+    """
+    created = []
+    for payload, sms in inbound_sms:
+        try:
+            with transaction.atomic():
+                sms.save()
+        except DatabaseError as e:
+            get_webhook_logger(sms.bot_id).error(f"Could not store the SMS reply to text_id = {sms.text_id}, moving it to the dead letter stream. Error = {e}")
+            dead_letter_webhook_payload(payload, error=e)
+            continue
+        created.append(sms)
+    return created
+
+
+def dead_letter_webhook_payload(payload, error):
+    """
+    Keeps a webhook payload that cannot be stored in the dead letter stream, so it can be inspected
+    and replayed by hand instead of blocking the webhook stream.
+
+    Args:
+        payload (dict): The webhook payload.
+        error (Exception): The error raised while storing it.
+    """
+    get_redis_client().xadd(
+        SMS_WEBHOOK_DEAD_LETTER_KEY, {'payload': json.dumps(payload), 'error': str(error)},
+        maxlen=settings.SMS_WEBHOOK_STREAM_MAX_LENGTH, approximate=True
+    )
+
+
+def build_inbound_sms(payload, context):
+    """
+    Builds the unsaved inbound `SMS` of a reply.
+
+    Args:
+        payload (dict): The webhook payload of the reply.
+        context (dict): The context of the answered outbound SMS, see `build_outbound_sms_context`.
+
+    Returns:
+        SMS: The unsaved SMS record.
+    """
+    return SMS(
+        bot_id=context['bot_id'],
+        email_id=context['email_id'],
+        contact_id=context['contact_id'],
+        message=payload.get('text', None),
+        text_id=payload.get('textId', None),
+        provider=context['provider'],
+        phone_number=payload.get('fromNumber', None),
+        direction=SMS_DIRECTION_CHOICES_DICT['Inbound'],
+        status=SMS_STATUS_CHOICES_DICT['Delivered']
+    )
+
+
+def ingest_webhook_payloads(consumer_name, logger):
+    """
+    Stores the SMS replies waiting in the webhook stream until it is empty.
+
+    An entry is acknowledged and removed only after its batch was stored, so replies are never lost if
+    the worker stops in between. Entries that cannot be stored are acknowledged as well, their payloads
+    are kept in the dead letter stream (see `store_inbound_sms`).
+
+    Args:
+        consumer_name (str): The name of the consumer, unique per running task.
+        logger (logging.Logger): The logger instance for logging the results.
+
+    Returns:
+        list: The created inbound `SMS`.
+    """
+    redis_client = get_redis_client()
+    # New replies from here on schedule another run, so none of them waits for the periodic one
+    clear_webhook_ingest_schedule()
+
+    inbound_sms = []
+    while True:
+        entries = read_webhook_payloads(redis_client, consumer_name)
+        if not entries:
+            break
+
+        inbound_sms.extend(store_inbound_sms([payload for _, payload in entries]))
+
+        entry_ids = [entry_id for entry_id, _ in entries]
+        redis_client.xack(SMS_WEBHOOK_STREAM_KEY, SMS_WEBHOOK_CONSUMER_GROUP, *entry_ids)
+        redis_client.xdel(SMS_WEBHOOK_STREAM_KEY, *entry_ids)
+        logger.info(f"Stored {len(entries)} SMS webhook payloads.")
+
+    return inbound_sms